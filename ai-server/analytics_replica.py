@@ -0,0 +1,350 @@
+"""
+Embedded DuckDB replica of the analytics tables for aggregate-heavy SQL.
+
+Questions like "median invoice amount by category", "month-over-month growth"
+or "rank vendors with their share of total spend" scan whole tables; with
+ANALYTICS_REPLICA=duckdb they run on an in-process columnar copy instead of
+competing with the application's traffic on Postgres. Only SQL that reads the
+replicated tables and aggregates (GROUP BY / aggregate / window functions) is
+routed there, transpiled from the Postgres dialect with sqlglot, and only
+while the copies of its tables are current; anything else, and any DuckDB
+error, runs on Postgres as before.
+
+Tables are copied with COPY ... TO STDOUT (CSV) on startup and then kept in
+step: rows named by change feed events (see change_feed.py) are re-copied
+incrementally, and tables whose data version moved without such events are
+reloaded whole, checked every ANALYTICS_REPLICA_REFRESH seconds. Each check
+also re-reads the tables' columns and reloads a table whose columns changed,
+so a column added later (TENANT_COLUMN in particular, which decides whether
+queries on the copy are filtered per organization) reaches the copy. Needs
+the optional duckdb package (pip install duckdb).
+"""
+
+import os
+import time
+import logging
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+import sqlglot
+from sqlglot import exp
+
+import change_feed
+import data_version
+import database
+import metrics
+import tenancy
+from sql_templates import render_sql
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_REPLICA = os.getenv("ANALYTICS_REPLICA", "off").lower()
+ANALYTICS_REPLICA_PATH = os.getenv("ANALYTICS_REPLICA_PATH", ":memory:")
+ANALYTICS_REPLICA_REFRESH = float(os.getenv("ANALYTICS_REPLICA_REFRESH", 30))
+# More changed ids than this are applied as a full reload of the table
+MAX_INCREMENTAL_IDS = 5000
+TABLES = data_version.TABLES
+
+# information_schema types -> DuckDB column types; anything else is copied as text
+DUCKDB_TYPES = {
+    "smallint": "SMALLINT", "integer": "INTEGER", "bigint": "BIGINT",
+    "real": "FLOAT", "double precision": "DOUBLE", "boolean": "BOOLEAN", "date": "DATE",
+    "timestamp without time zone": "TIMESTAMP", "timestamp with time zone": "TIMESTAMPTZ",
+    "uuid": "UUID", "jsonb": "VARCHAR", "json": "VARCHAR",
+}
+
+
+def _duckdb_type(data_type: str, precision: Optional[int], scale: Optional[int]) -> str:
+    if data_type == "numeric":
+        # DuckDB decimals top out at 38 digits; unconstrained numerics become doubles
+        return f"DECIMAL({precision},{scale})" if precision and precision <= 38 else "DOUBLE"
+    return DUCKDB_TYPES.get(data_type, "VARCHAR")
+
+
+def routable_sql(sql: str, params: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """The DuckDB form of `sql` when it is an aggregate read of replicated tables, else None"""
+    try:
+        tree = sqlglot.parse_one(render_sql(sql, params), read="postgres")
+    except Exception:
+        return None
+    if not isinstance(tree, exp.Query) or tree.find(exp.DML, exp.DDL, exp.Lock, exp.Into):
+        return None
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    tables = set()
+    for table in tree.find_all(exp.Table):
+        if table.name.lower() in ctes:
+            continue
+        if table.db.lower() not in ("", "public"):
+            return None
+        # The replica keeps its copies in DuckDB's default schema
+        table.set("db", None)
+        tables.add(table.name.lower())
+    if not tables or not tables <= set(TABLES):
+        return None
+    if not (tree.find(exp.AggFunc) or tree.find(exp.Window) or tree.find(exp.Group)):
+        return None
+    try:
+        return tree.sql(dialect="duckdb")
+    except Exception:
+        return None
+
+
+class AnalyticsReplica:
+    """DuckDB copy of the analytics tables, refreshed from Postgres in a background thread"""
+
+    def __init__(self, path: str = ANALYTICS_REPLICA_PATH, schema: str = "public",
+                 refresh_interval: float = ANALYTICS_REPLICA_REFRESH):
+        self.path = path
+        self.schema = schema
+        self.refresh_interval = refresh_interval
+        self.conn = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._columns: Dict[str, List[tuple]] = {}
+        # Data version each table was copied at, and changes not applied yet
+        # (a set of ids, or None when the whole table has to be reloaded)
+        self._loaded: Dict[str, Optional[str]] = {}
+        self._pending: Dict[str, Optional[Set[str]]] = {}
+        self.rows: Dict[str, int] = {}
+        self.last_refresh: Optional[float] = None
+        self.routed = 0
+        self.fallbacks = 0
+        self.latency = metrics.histogram("analytics_replica_query_seconds")
+
+    def open(self):
+        try:
+            import duckdb
+        except ImportError:
+            raise RuntimeError("Analytics replica needs duckdb. Install with: pip install duckdb")
+        self.conn = duckdb.connect(self.path)
+
+    @property
+    def ready(self) -> bool:
+        return self.conn is not None and len(self._loaded) == len(TABLES)
+
+    def start(self):
+        """Copy the tables and keep them current until stop()"""
+        if self._thread is not None:
+            return
+        self.open()
+        change_feed.subscribe(self._on_change)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics-replica", daemon=True)
+        self._thread.start()
+        logger.info(f"Analytics replica started ({self.path}, refresh every {self.refresh_interval}s)")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        change_feed.feed.unsubscribe(self._on_change)
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self._loaded.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Analytics replica refresh failed: {e}")
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+
+    def _on_change(self, event: Dict[str, Any]):
+        table, ids = event.get("table"), event.get("ids")
+        with self._lock:
+            for name in ([table] if table in TABLES else TABLES):
+                pending = self._pending.get(name, set())
+                if ids is None or table is None or pending is None:
+                    self._pending[name] = None
+                else:
+                    self._pending[name] = pending | set(ids)
+        # Apply feed changes promptly rather than on the next scheduled check
+        self._wake.set()
+
+    def refresh(self):
+        """Bring every table whose data version moved up to date"""
+        with self._refresh_lock:
+            columns = self._read_columns()
+            for table in TABLES:
+                # Version first: changes after this point leave the table marked stale
+                version = data_version.current([table])
+                with self._lock:
+                    pending = self._pending.pop(table, set())
+                if table not in self._loaded or columns.get(table) != self._columns.get(table):
+                    # New copy, or the columns changed (DDL moves no data version): copy it whole.
+                    # Until the reload is done, queries filtering on a new column fail and use Postgres
+                    self._columns[table] = columns.get(table, [])
+                    pending = None
+                elif pending == set():
+                    if version == self._loaded[table]:
+                        continue
+                    # With the feed running, its events were applied already; otherwise
+                    # the table changed and only a full copy can say how
+                    if not change_feed.feed.running:
+                        pending = None
+                started = time.perf_counter()
+                try:
+                    if pending is None or len(pending) > MAX_INCREMENTAL_IDS:
+                        self.load_table(table)
+                        logger.info(f"Replica reloaded {table} ({self.rows[table]} rows) in "
+                                    f"{time.perf_counter() - started:.2f}s")
+                    elif pending:
+                        self._apply(table, sorted(pending))
+                except Exception:
+                    with self._lock:
+                        self._pending[table] = None
+                    raise
+                self._loaded[table] = version
+            self.last_refresh = time.time()
+
+    def _read_columns(self) -> Dict[str, List[tuple]]:
+        """(name, type, precision, scale) of each replicated table's columns in Postgres"""
+        with database.connection() as conn:
+            rows = conn.execute(
+                "SELECT table_name, column_name, data_type, numeric_precision, numeric_scale"
+                " FROM information_schema.columns WHERE table_schema = %s AND table_name = ANY(%s)"
+                " ORDER BY table_name, ordinal_position",
+                (self.schema, list(TABLES)),
+            ).fetchall()
+        columns: Dict[str, List[tuple]] = {}
+        for table, *spec in rows:
+            columns.setdefault(table, []).append(tuple(spec))
+        return columns
+
+    def _table_columns(self, table: str) -> List[tuple]:
+        """The columns of the copy of `table`, as of its last full load"""
+        if table not in self._columns:
+            self._columns[table] = self._read_columns().get(table, [])
+        return self._columns[table]
+
+    def _export(self, table: str, ids: Optional[List[str]], path: str):
+        """Write the table (or the rows with `ids`) from Postgres to a CSV file"""
+        names = ", ".join(f'"{name}"' for name, *_ in self._table_columns(table))
+        where = " WHERE id = ANY(%s)" if ids is not None else ""
+        with database.connection() as conn, open(path, "wb") as out:
+            # The copy holds every organization; execute() filters it per tenant
+            tenancy.all_tenants(conn)
+            with conn.cursor().copy(f"COPY (SELECT {names} FROM {self.schema}.{table}{where})"
+                                    " TO STDOUT WITH (FORMAT csv)", (ids,) if ids is not None else None) as copy:
+                for block in copy:
+                    out.write(block)
+
+    def _read_csv(self, table: str, path: str) -> str:
+        columns = ", ".join(f"'{name}': '{_duckdb_type(*spec)}'" for name, *spec in self._table_columns(table))
+        # Postgres' CSV dialect, spelled out: sniffing fails on empty files, and a quoted
+        # empty field is an empty string while an unquoted one is NULL
+        return (f"read_csv('{path}', header = false, auto_detect = false, delim = ',', quote = '\"',"
+                f" escape = '\"', allow_quoted_nulls = false, columns = {{{columns}}})")
+
+    def load_table(self, table: str):
+        """Replace the copy of `table` with a fresh full copy"""
+        with tempfile.TemporaryDirectory() as scratch:
+            path = os.path.join(scratch, f"{table}.csv")
+            self._export(table, None, path)
+            cursor = self.conn.cursor()
+            # Readers see the old or the new table, never a partial one
+            cursor.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {self._read_csv(table, path)}")
+            self.rows[table] = cursor.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+    def _apply(self, table: str, ids: List[str]):
+        """Re-copy the rows with `ids`; ids no longer in Postgres are deleted"""
+        with tempfile.TemporaryDirectory() as scratch:
+            path = os.path.join(scratch, f"{table}.csv")
+            self._export(table, ids, path)
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN TRANSACTION")
+            try:
+                cursor.execute(f"DELETE FROM {table} WHERE id IN (SELECT UNNEST(?))", [ids])
+                cursor.execute(f"INSERT INTO {table} SELECT * FROM {self._read_csv(table, path)}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            self.rows[table] = cursor.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+    def fresh(self, tables: List[str]) -> bool:
+        """True when the copies of `tables` reflect the current data"""
+        if not self.ready:
+            return False
+        with self._lock:
+            if any(table in self._pending for table in tables):
+                return False
+        return all(data_version.current([table]) == self._loaded.get(table) for table in tables)
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None):
+        """
+        Run `sql` on the replica when it is routable and the replica is current;
+        returns a DuckDB cursor, or None for the caller to use Postgres
+        """
+        if not self.ready:
+            return None
+        tenant = tenancy.current_tenant.get()
+        if tenant is not None:
+            # DuckDB has no row level security: filter every tenant table in the SQL
+            scoped = {table for table in TABLES
+                      if any(name == tenancy.TENANT_COLUMN for name, *_ in self._table_columns(table))}
+            try:
+                sql, params = tenancy.scope_sql(render_sql(sql, params), tenant, scoped), None
+            except tenancy.TenantError:
+                return None
+        duck_sql = routable_sql(sql, params)
+        if duck_sql is None:
+            return None
+        if not self.fresh(data_version.referenced_tables(duck_sql) or list(TABLES)):
+            return None
+        started = time.perf_counter()
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(duck_sql)
+        except Exception as e:
+            self.fallbacks += 1
+            logger.info(f"Replica could not run query, using Postgres: {e}")
+            return None
+        self.routed += 1
+        self.latency.observe(time.perf_counter() - started)
+        return cursor
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._thread is not None,
+            "ready": self.ready,
+            "path": self.path,
+            "rows": dict(self.rows),
+            "stale_tables": sorted(self._pending),
+            "last_refresh_age": round(time.time() - self.last_refresh, 1) if self.last_refresh else None,
+            "routed": self.routed,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# The process-wide replica; started by the server when ANALYTICS_REPLICA=duckdb
+replica = AnalyticsReplica()
+
+
+def start():
+    if ANALYTICS_REPLICA != "duckdb" or not os.getenv("DATABASE_URL"):
+        return
+    try:
+        replica.start()
+    except Exception as e:
+        logger.error(f"Analytics replica disabled: {e}")
+
+
+def stop():
+    replica.stop()
+
+
+def execute(sql: str, params: Optional[Dict[str, Any]] = None):
+    """A DuckDB cursor with the result of `sql`, or None when it should run on Postgres"""
+    if replica.conn is None:
+        return None
+    return replica.execute(sql, params)
@@ -0,0 +1,130 @@
+"""
+Compare aggregate-heavy /chat queries on Postgres and on the DuckDB replica.
+
+Builds a scaled-up synthetic copy of vendors and invoices in a scratch schema
+of DATABASE_URL, loads it into DuckDB the way analytics_replica.py does, then
+times the TestQueries.txt shapes that scan whole tables on both engines
+(the DuckDB side runs the sqlglot-transpiled SQL the router would send).
+
+    python benchmarks/bench_analytics_replica.py --invoices 2000000
+    python benchmarks/bench_analytics_replica.py --invoices 200000 --repeat 5 --keep
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCHEMA = "replica_bench"
+
+QUERIES = {
+    "median by category": """
+        SELECT v.category, PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY i."totalAmount") AS median_amount
+        FROM invoices i JOIN vendors v ON v.id = i."vendorId"
+        WHERE i.status = 'PAID' GROUP BY v.category ORDER BY v.category""",
+    "month-over-month growth": """
+        WITH monthly AS (
+            SELECT DATE_TRUNC('month', "issueDate") AS month, COUNT(*) AS invoices
+            FROM invoices GROUP BY 1)
+        SELECT month, invoices,
+               ROUND(100.0 * (invoices - LAG(invoices) OVER (ORDER BY month))
+                     / NULLIF(LAG(invoices) OVER (ORDER BY month), 0), 2) AS growth_pct
+        FROM monthly ORDER BY month""",
+    "vendor rank and share": """
+        SELECT v.name, SUM(i."totalAmount") AS spend,
+               RANK() OVER (ORDER BY SUM(i."totalAmount") DESC) AS spend_rank,
+               ROUND(100 * SUM(i."totalAmount") / SUM(SUM(i."totalAmount")) OVER (), 2) AS pct_of_total
+        FROM invoices i JOIN vendors v ON v.id = i."vendorId"
+        GROUP BY v.name ORDER BY spend DESC""",
+    "spend by category and quarter": """
+        SELECT category, DATE_TRUNC('quarter', "issueDate") AS quarter, SUM("totalAmount") AS spend
+        FROM invoices WHERE "issueDate" >= DATE '2023-01-01'
+        GROUP BY 1, 2 ORDER BY 1, 2""",
+}
+
+
+def build_dataset(conn, invoices: int, vendors: int):
+    conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    conn.execute(f"""
+        CREATE TABLE {SCHEMA}.vendors AS
+        SELECT 'vendor_' || n AS id, 'Vendor ' || n AS name,
+               (ARRAY['Software', 'Hardware', 'Services', 'Travel', 'Office', 'Marketing'])[1 + n % 6] AS category,
+               now()::timestamp(3) AS "updatedAt"
+        FROM generate_series(1, {int(vendors)}) AS n""")
+    conn.execute(f"""
+        CREATE TABLE {SCHEMA}.invoices AS
+        SELECT 'inv_' || n AS id, 'INV-' || n AS "invoiceNumber",
+               'vendor_' || (1 + (hashint4(n)::bigint & 2147483647) % {int(vendors)}) AS "vendorId",
+               (timestamp '2022-01-01' + (n % 1095) * interval '1 day')::timestamp(3) AS "issueDate",
+               round((10 + random() * 4990)::numeric, 2)::numeric(15, 2) AS "totalAmount",
+               (ARRAY['PAID', 'PENDING', 'OVERDUE'])[1 + n % 3]::varchar AS status,
+               (ARRAY['General', 'Document', 'Services'])[1 + n % 3]::varchar AS category,
+               now()::timestamp(3) AS "updatedAt"
+        FROM generate_series(1, {int(invoices)}) AS n""")
+    conn.execute(f"ANALYZE {SCHEMA}.vendors")
+    conn.execute(f"ANALYZE {SCHEMA}.invoices")
+    conn.commit()
+
+
+def timed(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=2_000_000, help="synthetic invoice rows")
+    parser.add_argument("--vendors", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help=f"keep the {SCHEMA} schema afterwards")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    import database
+    from analytics_replica import AnalyticsReplica, routable_sql
+
+    with database.connection() as conn:
+        started = time.perf_counter()
+        build_dataset(conn, args.invoices, args.vendors)
+        print(f"built {args.invoices} invoices / {args.vendors} vendors in {time.perf_counter() - started:.1f}s")
+
+    replica = AnalyticsReplica(path=":memory:", schema=SCHEMA)
+    replica.open()
+    started = time.perf_counter()
+    for table in ("vendors", "invoices"):
+        replica.load_table(table)
+    print(f"loaded into DuckDB in {time.perf_counter() - started:.1f}s")
+
+    print(f"{'query':>30}  {'postgres':>10}  {'duckdb':>10}  speedup")
+    try:
+        with database.connection() as conn:
+            conn.execute(f"SET search_path = {SCHEMA}")
+            for label, sql in QUERIES.items():
+                duck_sql = routable_sql(sql)
+                if duck_sql is None:
+                    print(f"{label:>30}  not routable")
+                    continue
+                pg_seconds = timed(lambda: conn.execute(sql).fetchall(), args.repeat)
+                duck_seconds = timed(lambda: replica.conn.execute(duck_sql).fetchall(), args.repeat)
+                print(f"{label:>30}  {pg_seconds * 1000:8.1f}ms  {duck_seconds * 1000:8.1f}ms  "
+                      f"{pg_seconds / duck_seconds:6.1f}x")
+            conn.execute("RESET search_path")
+    finally:
+        replica.conn.close()
+        if not args.keep:
+            with database.connection() as conn:
+                conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+                conn.commit()
+
+
+if __name__ == "__main__":
+    main()
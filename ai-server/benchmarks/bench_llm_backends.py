@@ -0,0 +1,86 @@
+"""
+Throughput and latency of the SQL-generation LLM backends.
+
+Fires --requests questions at each backend from --concurrency threads, the way
+concurrent /chat requests would, and reports generated tokens/sec and
+p50 / p95 / max latency. The local backend is driven through the same
+MicroBatcher as the server, so raising --concurrency shows the batching gain
+(tune it with LLM_BATCH_WINDOW_MS / LLM_MAX_BATCH_SIZE).
+
+    python benchmarks/bench_llm_backends.py --backends groq,local --concurrency 8 --requests 32
+"""
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from llm_backends import get_backend
+from micro_batcher import batched
+from main import sql_system_prompt
+
+QUESTIONS = [
+    "Which vendors did we pay the most last month?",
+    "Show spending by vendor category for 2024",
+    "How many invoices are still pending?",
+    "What is the average invoice amount per customer?",
+    "List overdue invoices with their vendor names",
+    "Monthly invoice totals for the last twelve months",
+    "Which customers have more than ten invoices?",
+    "Total payments received per payment method",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(backend_name: str, requests: int, concurrency: int, max_tokens: int):
+    backend = batched(get_backend(backend_name))
+    if not backend.is_configured():
+        print(f"{backend_name:>6}: not configured, skipped")
+        return
+    system = sql_system_prompt()
+
+    def one(i):
+        return backend.complete(system, QUESTIONS[i % len(QUESTIONS)], max_tokens=max_tokens, temperature=0)
+
+    # Warm-up: client connection / model load is not what we are measuring
+    one(0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        completions = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [c["latency"] for c in completions]
+    tokens = sum(c["completion_tokens"] for c in completions)
+    print(f"{backend_name:>6}: {requests} requests x{concurrency} in {elapsed:.2f}s  "
+          f"{tokens / elapsed:8.1f} tok/s  "
+          f"p50 {percentile(latencies, 50) * 1000:7.0f} ms  "
+          f"p95 {percentile(latencies, 95) * 1000:7.0f} ms  "
+          f"max {max(latencies) * 1000:7.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="groq,local")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    for name in args.backends.split(","):
+        run(name.strip(), args.requests, args.concurrency, args.max_tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Compare the ways a query result can reach the /chat payload, on pooled connections.
+
+  dataframe     fetchall -> pandas DataFrame -> to_dict('records') -> JSON   (old vn.run_sql path)
+  fetchall      fetchall -> dict(zip(names, row)) -> JSON                    (every row buffered)
+  stream        result_stream.iter_result_batches, every batch consumed       (streaming cost alone)
+  collect       result_stream.collect_result: one page + chart config -> JSON (what /chat runs)
+
+Reports wall time and peak traced memory for each, fetching included. By
+default the rows come from a generate_series query shaped like an invoice
+listing; pass --sql to run a real query instead. Needs DATABASE_URL.
+
+    python benchmarks/bench_result_path.py --rows 100000
+    python benchmarks/bench_result_path.py --sql 'SELECT * FROM invoices'
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import database
+import tenancy
+from result_stream import collect_result, iter_result_batches
+
+SYNTHETIC_SQL = """
+SELECT g AS id, 'INV-' || lpad(g::text, 7, '0') AS "invoiceNumber",
+       timestamp '2024-01-01' + g * interval '7 minutes' AS "issueDate",
+       'Vendor ' || (g * 7919 % 200) AS vendor,
+       (ARRAY['Software', 'Hardware', 'Services', 'Travel', 'Office', 'Marketing'])[g % 6 + 1] AS category,
+       round((10 + (g * 104729 % 499000) / 100.0)::numeric, 2) AS "totalAmount",
+       (ARRAY['PAID', 'PENDING', 'OVERDUE'])[g % 3 + 1] AS status
+FROM generate_series(1::bigint, {rows}) AS g
+"""
+
+
+def fetch_all(sql: str):
+    with database.read_connection() as conn:
+        # Same organization scoping as the streamed path
+        sql, params = tenancy.scope_query(conn, sql)
+        cursor = conn.execute(sql, params)
+        return [desc[0] for desc in cursor.description], cursor.fetchall()
+
+
+def via_dataframe(sql: str, page_size: int) -> int:
+    import pandas as pd
+    names, rows = fetch_all(sql)
+    records = pd.DataFrame(rows, columns=names).to_dict("records")
+    return len(json.dumps(records, default=str))
+
+
+def via_fetchall(sql: str, page_size: int) -> int:
+    names, rows = fetch_all(sql)
+    return len(json.dumps([dict(zip(names, row)) for row in rows], default=str))
+
+
+def via_stream(sql: str, page_size: int) -> int:
+    return sum(len(rows) for _, rows in iter_result_batches(sql))
+
+
+def via_collect(sql: str, page_size: int) -> int:
+    return len(json.dumps(collect_result("invoice totals by category", sql, None, page_size), default=str))
+
+
+def measure(fn, sql: str, page_size: int, repeat: int):
+    timings, peaks, size = [], [], 0
+    for _ in range(repeat):
+        gc.collect()
+        tracemalloc.start()
+        started = time.perf_counter()
+        size = fn(sql, page_size)
+        timings.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(timings), max(peaks), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="rows of the synthetic query")
+    parser.add_argument("--sql", help="run this query instead of the synthetic one")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sql = args.sql or SYNTHETIC_SQL.format(rows=args.rows)
+    # Open the pool first, so no path pays for the first connection
+    database.ping(timeout=30)
+    rows = via_stream(sql, args.page_size)
+    print(f"{rows} rows, page size {args.page_size}")
+
+    paths = {"fetchall": via_fetchall, "stream": via_stream, "collect": via_collect}
+    try:
+        import pandas  # noqa: F401
+        paths = {"dataframe": via_dataframe, **paths}
+    except ImportError:
+        print("pandas not installed, skipping the dataframe path")
+
+    try:
+        for label, fn in paths.items():
+            seconds, peak, size = measure(fn, sql, args.page_size, args.repeat)
+            unit = "rows" if fn is via_stream else "bytes"
+            print(f"{label:>10}: {seconds * 1000:8.1f} ms  peak {peak / 2**20:7.1f} MiB  {unit} {size:,}")
+    finally:
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
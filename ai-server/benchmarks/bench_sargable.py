@@ -0,0 +1,126 @@
+"""
+EXPLAIN costs of generated date filters before and after sargable.rewrite().
+
+Builds a synthetic invoices table with an index on "issueDate" (like
+idx_invoices_issue_date) in a scratch schema of DATABASE_URL, then for each
+predicate shape the LLM produces (the Vanna training examples, DATE_TRUNC
+comparisons, casts) prints the planner's estimated cost and the access path for
+the SQL as generated and as rewritten; --analyze also times both.
+
+    python benchmarks/bench_sargable.py --invoices 2000000
+    python benchmarks/bench_sargable.py --invoices 500000 --analyze --keep
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCHEMA = "sargable_bench"
+
+QUERIES = {
+    "this year (EXTRACT)": """
+        SELECT SUM("totalAmount") FROM invoices
+        WHERE EXTRACT(YEAR FROM "issueDate") = EXTRACT(YEAR FROM CURRENT_DATE) AND status = 'PAID'""",
+    "this month (EXTRACT x2)": """
+        SELECT COUNT(*) FROM invoices
+        WHERE EXTRACT(MONTH FROM "issueDate") = EXTRACT(MONTH FROM CURRENT_DATE)
+          AND EXTRACT(YEAR FROM "issueDate") = EXTRACT(YEAR FROM CURRENT_DATE)""",
+    "year literal": """
+        SELECT COUNT(*), SUM("totalAmount") FROM invoices WHERE EXTRACT(YEAR FROM "issueDate") = 2023""",
+    "month = DATE_TRUNC": """
+        SELECT COUNT(*) FROM invoices
+        WHERE DATE_TRUNC('month', "issueDate") = DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '1 month'""",
+    "quarter >= DATE_TRUNC": """
+        SELECT category, SUM("totalAmount") FROM invoices
+        WHERE DATE_TRUNC('quarter', "issueDate") >= DATE_TRUNC('quarter', CURRENT_DATE) GROUP BY category""",
+    "day cast": """
+        SELECT * FROM invoices WHERE "issueDate"::date = CURRENT_DATE - 30""",
+    "cast range": """
+        SELECT COUNT(*) FROM invoices
+        WHERE CAST("issueDate" AS DATE) BETWEEN CURRENT_DATE - 7 AND CURRENT_DATE""",
+}
+
+
+def build_dataset(conn, invoices: int):
+    conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    # Six years of invoices up to today, at any time of day
+    conn.execute(f"""
+        CREATE TABLE {SCHEMA}.invoices AS
+        SELECT 'inv_' || n AS id,
+               (now() - random() * interval '6 years')::timestamp(3) AS "issueDate",
+               round((10 + random() * 4990)::numeric, 2)::numeric(15, 2) AS "totalAmount",
+               (ARRAY['PAID', 'PENDING', 'OVERDUE'])[1 + n % 3]::varchar AS status,
+               (ARRAY['General', 'Document', 'Services'])[1 + n % 3]::varchar AS category
+        FROM generate_series(1, {int(invoices)}) AS n""")
+    conn.execute(f'CREATE INDEX idx_invoices_issue_date ON {SCHEMA}.invoices ("issueDate")')
+    conn.execute(f"ANALYZE {SCHEMA}.invoices")
+    conn.commit()
+
+
+def explain(conn, sql: str):
+    """(estimated total cost, scan nodes) of the plan"""
+    plan = conn.execute(f"EXPLAIN (FORMAT JSON) {sql}").fetchone()[0][0]["Plan"]
+    scans, stack = [], [plan]
+    while stack:
+        node = stack.pop()
+        if "Scan" in node["Node Type"]:
+            scans.append(node["Node Type"].replace(" Scan", ""))
+        stack.extend(node.get("Plans", []))
+    return plan["Total Cost"], "+".join(sorted(set(scans)))
+
+
+def timed(conn, sql: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql).fetchall()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=2_000_000, help="synthetic invoice rows")
+    parser.add_argument("--analyze", action="store_true", help="also time both versions")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help=f"keep the {SCHEMA} schema afterwards")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    import database
+    from sargable import rewrite
+
+    with database.connection() as conn:
+        started = time.perf_counter()
+        build_dataset(conn, args.invoices)
+        print(f"built {args.invoices} invoices in {time.perf_counter() - started:.1f}s")
+
+    header = f"{'query':>26}  {'cost before':>12}  {'cost after':>12}  {'scan before':>12}  {'scan after':>12}"
+    print(header + ("  time before  time after" if args.analyze else ""))
+    try:
+        with database.connection() as conn:
+            conn.execute(f"SET search_path = {SCHEMA}")
+            for label, sql in QUERIES.items():
+                rewritten, _ = rewrite(sql)
+                before, after = explain(conn, sql), explain(conn, rewritten)
+                line = f"{label:>26}  {before[0]:12.0f}  {after[0]:12.0f}  {before[1]:>12}  {after[1]:>12}"
+                if args.analyze:
+                    line += (f"  {timed(conn, sql, args.repeat) * 1000:9.1f}ms"
+                             f"  {timed(conn, rewritten, args.repeat) * 1000:8.1f}ms")
+                print(line)
+            conn.execute("RESET search_path")
+    finally:
+        if not args.keep:
+            with database.connection() as conn:
+                conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+                conn.commit()
+
+
+if __name__ == "__main__":
+    main()
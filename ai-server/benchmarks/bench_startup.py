@@ -0,0 +1,122 @@
+"""
+Cold-start cost of the servers: import time and time until they answer probes.
+
+Imports each app module in a fresh interpreter under `python -X importtime`
+and reports the median total and its heaviest direct imports; --serve also
+starts it under uvicorn and measures the time until /health/live and
+/health/ready first return 200 (readiness needs DATABASE_URL to answer).
+--json writes the numbers to a file so they can be tracked between commits.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --modules vanna_main --repeat 10 --serve --json startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.request
+from collections import defaultdict
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def environment():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [SERVER_DIR, env.get("PYTHONPATH")]))
+    return env
+
+
+def import_times(module: str):
+    """(total microseconds, {direct import: cumulative microseconds}) of one cold import"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=SERVER_DIR, env=environment(), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    total, children = None, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nesting is two spaces per level after the separator's own space
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if level == 0 and name == module:
+            total = int(cumulative)
+        elif level == 1:
+            children[name] = int(cumulative)
+    return total, children
+
+
+def wait_for(url: str, deadline: float) -> float:
+    """Seconds until `url` first answers 200, or None past the deadline"""
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.monotonic()
+        except Exception:
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def serve_times(module: str, port: int, timeout: float):
+    started = time.monotonic()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(port),
+                               "--log-level", "warning"], cwd=SERVER_DIR, env=environment())
+    try:
+        live = wait_for(f"http://127.0.0.1:{port}/health/live", started + timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/health/ready", started + timeout) if live else None
+    finally:
+        server.terminate()
+        server.wait()
+    return (live - started if live else None), (ready - started if ready else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", default="main,vanna_main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="heaviest direct imports to list")
+    parser.add_argument("--serve", action="store_true", help="also time /health/live and /health/ready")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for each probe")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for module in [m.strip() for m in args.modules.split(",") if m.strip()]:
+        # The first import compiles bytecode and warms the page cache
+        import_times(module)
+        totals, children = [], defaultdict(list)
+        for _ in range(args.repeat):
+            total, direct = import_times(module)
+            totals.append(total)
+            for name, cumulative in direct.items():
+                children[name].append(cumulative)
+        total = statistics.median(totals) / 1000
+        heaviest = sorted(((statistics.median(v) / 1000, name) for name, v in children.items()), reverse=True)
+        print(f"{module}: import {total:.0f}ms (median of {args.repeat})")
+        for ms, name in heaviest[:args.top]:
+            print(f"  {ms:8.1f}ms  {name}")
+        results[module] = {"import_ms": round(total, 1),
+                           "direct_imports_ms": {name: round(ms, 1) for ms, name in heaviest[:args.top]}}
+
+        if args.serve:
+            live, ready = serve_times(module, args.port, args.timeout)
+            print(f"  /health/live after {live * 1000:.0f}ms" if live is not None else "  /health/live never answered")
+            print(f"  /health/ready after {ready * 1000:.0f}ms" if ready is not None else "  /health/ready not ready in time")
+            results[module]["live_ms"] = round(live * 1000, 1) if live is not None else None
+            results[module]["ready_ms"] = round(ready * 1000, 1) if ready is not None else None
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Change capture for the analytics tables.
+
+A background thread follows writes to invoices, line_items, payments, vendors
+and customers and publishes one event per change to the subscribers in this
+process (see subscribe()), so caches and rollups built on top of the data can
+refresh just the tables, rows and months that changed. Two sources:
+
+  notify  statement-level triggers (install_triggers(), or
+          `python change_feed.py --install`) NOTIFY on every INSERT / UPDATE /
+          DELETE, with the changed ids when there are few of them
+  poll    every CHANGE_FEED_INTERVAL seconds, look up each table's newest
+          "updatedAt" and read the rows past the previous high-water mark;
+          needs the "updatedAt" indexes (`python change_feed.py
+          --install-indexes`) to stay cheap on large tables. Deletes and
+          writes that leave "updatedAt" alone are caught from the tables'
+          write counters (pg_stat_user_tables), which Postgres publishes up
+          to about ten seconds late, and carry no ids
+
+Select one with CHANGE_FEED=notify|poll (default off). An event is a dict:
+
+  {"table": "invoices", "op": "INSERT", "count": 3, "ids": [...],
+   "invoice_ids": [...], "months": ["2024-03"], "source": "notify"}
+
+ids / invoice_ids / months are None when unknown or too many to list, and
+table is None after a (re)connect, when anything may have changed meanwhile.
+"""
+
+import os
+import sys
+import json
+import time
+import select
+import logging
+import argparse
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg
+from dotenv import load_dotenv
+
+import database
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "ai_change_feed"
+TABLES = ("vendors", "customers", "invoices", "line_items", "payments")
+# Above this many changed rows an event only carries the table
+MAX_IDS = 100
+# NOTIFY payloads are limited to 8000 bytes; larger ones fail the writing transaction
+MAX_PAYLOAD = 7900
+RECONNECT_DELAY = 5.0
+
+TRIGGER_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION ai_change_feed_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    changed bigint;
+    ids jsonb;
+    invoice_ids jsonb;
+    months jsonb;
+    payload text;
+BEGIN
+    SELECT count(*) INTO changed FROM changed_rows;
+    IF changed = 0 THEN
+        RETURN NULL;
+    END IF;
+    IF changed <= {MAX_IDS} THEN
+        SELECT jsonb_agg(id) INTO ids FROM changed_rows;
+        IF TG_TABLE_NAME = 'invoices' THEN
+            SELECT jsonb_agg(DISTINCT to_char("issueDate", 'YYYY-MM')) INTO months FROM changed_rows;
+        ELSIF TG_TABLE_NAME IN ('line_items', 'payments') THEN
+            SELECT jsonb_agg(DISTINCT "invoiceId") INTO invoice_ids FROM changed_rows;
+        END IF;
+    END IF;
+    payload := jsonb_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'count', changed,
+                                  'ids', ids, 'invoice_ids', invoice_ids, 'months', months)::text;
+    IF octet_length(payload) > {MAX_PAYLOAD} THEN
+        payload := jsonb_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'count', changed)::text;
+    END IF;
+    PERFORM pg_notify('{CHANNEL}', payload);
+    RETURN NULL;
+END
+$$;
+"""
+
+
+def install_triggers(conn: psycopg.Connection, tables=TABLES):
+    """Create (or replace) the NOTIFY triggers; transition tables need one trigger per operation"""
+    conn.execute(TRIGGER_FUNCTION)
+    for table in tables:
+        for op, transition in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+            name = f"ai_change_feed_{op}"
+            conn.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+            conn.execute(
+                f"CREATE TRIGGER {name} AFTER {op.upper()} ON {table}"
+                f" REFERENCING {transition} TABLE AS changed_rows"
+                " FOR EACH STATEMENT EXECUTE FUNCTION ai_change_feed_notify()"
+            )
+    conn.commit()
+
+
+def write_counters(conn: psycopg.Connection, tables=TABLES) -> Dict[str, int]:
+    """Rows inserted, updated and deleted per table since the statistics were last reset"""
+    rows = conn.execute(
+        # Partitioned tables have no counters of their own; their partitions' add up
+        "SELECT c.relname, sum(s.n_tup_ins + s.n_tup_upd + s.n_tup_del)"
+        " FROM pg_stat_user_tables s JOIN pg_class c ON c.oid = coalesce(pg_partition_root(s.relid), s.relid)"
+        " WHERE c.relname = ANY(%s) GROUP BY c.relname",
+        (list(tables),),
+    ).fetchall()
+    return {relname: int(writes) for relname, writes in rows}
+
+
+def install_indexes(conn: psycopg.Connection, tables=TABLES):
+    """Index "updatedAt" so poll mode's high-water lookups do not scan the tables"""
+    for table in tables:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} ("updatedAt")')
+    conn.commit()
+
+
+def triggers_installed(conn: psycopg.Connection, tables=TABLES) -> bool:
+    row = conn.execute(
+        "SELECT count(DISTINCT c.relname) FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid"
+        " WHERE t.tgname LIKE 'ai_change_feed_%%' AND c.relname = ANY(%s)",
+        (list(tables),),
+    ).fetchone()
+    return row[0] == len(tables)
+
+
+class ChangeFeed:
+    """Follows table changes in a background thread and publishes them to subscribers"""
+
+    def __init__(self, mode: Optional[str] = None, interval: Optional[float] = None):
+        self.mode = (mode if mode is not None else os.getenv("CHANGE_FEED", "off")).lower()
+        self.interval = interval if interval is not None else float(os.getenv("CHANGE_FEED_INTERVAL", 2))
+        self._subscribers: List[Callable[[Dict[str, Any]], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._connected = threading.Event()
+        self._marks: Dict[str, tuple] = {}
+        self.events = {table: 0 for table in TABLES}
+        self.last_event_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        """True while changes are being followed, i.e. subscribers hear about every write"""
+        return self._thread is not None and self._thread.is_alive() and self._connected.is_set()
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Dict[str, Any]], None]):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, event: Dict[str, Any]):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            if event.get("table") in self.events:
+                self.events[event["table"]] += 1
+            self.last_event_at = time.time()
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Change feed subscriber {callback!r} failed: {e}")
+
+    def start(self):
+        if self.mode not in ("notify", "poll") or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+        self._thread.start()
+        logger.info(f"Change feed started ({self.mode})")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 2)
+            self._thread = None
+        self._connected.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(database.get_database_url(), autocommit=True) as conn:
+                    # The feed sees every organization's writes
+                    tenancy.all_tenants(conn, local=False)
+                    mode = self.mode
+                    if mode == "notify" and not triggers_installed(conn):
+                        logger.warning("Change feed triggers not installed (python change_feed.py --install);"
+                                       " polling instead")
+                        mode = "poll"
+                    self._follow(conn, mode)
+            except Exception as e:
+                logger.warning(f"Change feed connection lost: {e}")
+            self._connected.clear()
+            self._stop.wait(RECONNECT_DELAY)
+
+    def _follow(self, conn: psycopg.Connection, mode: str):
+        if mode == "notify":
+            conn.add_notify_handler(self._on_notify)
+            conn.execute(f"LISTEN {CHANNEL}")
+        else:
+            self._marks = {}
+            self._poll(conn)
+        self._connected.set()
+        # Writes made while nobody was listening are unknown
+        self.publish({"table": None, "op": "RESYNC", "count": None, "ids": None, "invoice_ids": None,
+                      "months": None, "source": mode})
+        while not self._stop.is_set():
+            if mode == "notify":
+                ready, _, _ = select.select([conn.fileno()], [], [], self.interval)
+                if ready:
+                    # Running any command makes psycopg dispatch the pending notifications
+                    conn.execute("SELECT 1")
+            else:
+                self._stop.wait(self.interval)
+                self._poll(conn)
+
+    def _on_notify(self, notify: psycopg.Notify):
+        try:
+            event = json.loads(notify.payload)
+        except ValueError:
+            logger.warning(f"Ignoring malformed change notification: {notify.payload[:200]}")
+            return
+        for key in ("ids", "invoice_ids", "months"):
+            event.setdefault(key, None)
+        event["source"] = "notify"
+        self.publish(event)
+
+    def _poll(self, conn: psycopg.Connection):
+        # Per interval: one catalog read of the write counters and one index lookup of each
+        # table's newest "updatedAt"; rows are only read past a mark that moved
+        counters = write_counters(conn)
+        for table in TABLES:
+            writes = counters.get(table, 0)
+            high_water = conn.execute(f'SELECT max("updatedAt") FROM {table}').fetchone()[0]
+            previous = self._marks.get(table)
+            if previous is None:
+                self._marks[table] = (writes, writes, high_water)
+                continue
+            seen, accounted, mark = previous
+            # Statistics reset, rows appearing in an empty table, or the newest ones deleted
+            known = writes >= seen and (high_water == mark or None not in (high_water, mark))
+
+            rows = []
+            extra = {"invoices": """, to_char("issueDate", 'YYYY-MM')""",
+                     "line_items": ', "invoiceId"', "payments": ', "invoiceId"'}.get(table, "")
+            if high_water is not None and mark is not None and high_water > mark:
+                rows = conn.execute(
+                    f'SELECT id{extra} FROM {table} WHERE "updatedAt" > %s AND "updatedAt" <= %s LIMIT %s',
+                    (mark, high_water, MAX_IDS + 1),
+                ).fetchall()
+            # The counters are published seconds after the rows are visible, so rows found past
+            # the mark are credited ahead; writes they do not explain (deletes, or writes that
+            # left "updatedAt" alone) only show up in the counters
+            accounted += len(rows)
+            known = known and accounted >= writes
+            self._marks[table] = (writes, accounted if known else writes, high_water)
+            if known and not rows:
+                continue
+
+            event = {"table": table, "op": "CHANGE", "count": None, "ids": None, "invoice_ids": None,
+                     "months": None, "source": "poll"}
+            if known and len(rows) <= MAX_IDS:
+                event["count"] = len(rows)
+                event["ids"] = [row[0] for row in rows]
+                if table == "invoices":
+                    event["months"] = sorted({row[1] for row in rows})
+                elif extra:
+                    event["invoice_ids"] = sorted({row[1] for row in rows})
+            self.publish(event)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "running": self.running,
+                "events": dict(self.events),
+                "last_event_at": datetime.fromtimestamp(self.last_event_at).isoformat()
+                if self.last_event_at else None,
+            }
+
+
+# The process-wide feed; started by the server when CHANGE_FEED is set
+feed = ChangeFeed()
+
+
+def subscribe(callback: Callable[[Dict[str, Any]], None]):
+    """Call `callback(event)` for every change (on the feed thread; keep it quick)"""
+    feed.subscribe(callback)
+
+
+def start():
+    if os.getenv("DATABASE_URL"):
+        feed.start()
+
+
+def stop():
+    feed.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Install the change feed triggers / indexes or watch the feed")
+    parser.add_argument("--install", action="store_true", help="create the NOTIFY triggers")
+    parser.add_argument("--install-indexes", action="store_true", help='index "updatedAt" for poll mode')
+    parser.add_argument("--watch", choices=("notify", "poll"), help="print events as they arrive")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    if args.install:
+        with psycopg.connect(database.get_database_url()) as conn:
+            install_triggers(conn)
+        print(f"Change feed triggers installed on {', '.join(TABLES)}")
+    if args.install_indexes:
+        with psycopg.connect(database.get_database_url()) as conn:
+            install_indexes(conn)
+        print(f"\"updatedAt\" indexed on {', '.join(TABLES)}")
+    if args.watch:
+        watcher = ChangeFeed(args.watch)
+        watcher.subscribe(lambda event: print(json.dumps(event, default=str), flush=True))
+        watcher.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            watcher.stop()
+    if not (args.install or args.install_indexes or args.watch):
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Chart inference over columnar query results.
+
+Instead of guessing a chart from question keywords and the first two columns,
+the result set is turned into NumPy columns, each column is classified as
+temporal, numeric or categorical, and axes / aggregation are picked from that.
+Large results are reduced to chart-ready series (LTTB for lines, top-N plus
+"Other" for bars and pies) so the frontend never has to draw the raw rows.
+"""
+
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+MAX_LINE_POINTS = 500
+MAX_BAR_CATEGORIES = 20
+MAX_PIE_SLICES = 8
+OTHER_LABEL = "Other"
+
+# Numeric columns with these names are ordinal time parts (EXTRACT(YEAR ...) etc.)
+TIME_PART_NAMES = {"year", "quarter", "month", "week", "day", "hour"}
+
+LINE_KEYWORDS = ("trend", "over time", "monthly", "yearly", "weekly", "daily", "growth")
+PIE_KEYWORDS = ("distribution", "breakdown", "percentage", "share", "split")
+
+
+def columns_from_records(rows: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Pivot row dicts into one NumPy array per column"""
+    if not rows:
+        return {}
+    names = list(rows[0].keys())
+    return {name: to_array([row.get(name) for row in rows]) for name in names}
+
+
+def to_array(values: Sequence[Any]) -> np.ndarray:
+    """Convert one column to the narrowest useful dtype (float64, datetime64 or object)"""
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, (int, float, Decimal)) and not isinstance(v, bool) for v in present):
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    if present and all(isinstance(v, (datetime, date)) for v in present):
+        return np.array([np.datetime64("NaT") if v is None else np.datetime64(_naive_utc(v), "ms") for v in values],
+                        dtype="datetime64[ms]")
+    return np.array(["" if v is None else str(v) for v in values], dtype=object)
+
+
+def _naive_utc(value):
+    """NumPy datetimes carry no timezone; normalize aware values to naive UTC"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def column_kind(name: str, values: np.ndarray) -> str:
+    """Classify a column as temporal, numeric or categorical from its dtype"""
+    if values.dtype.kind == "M":
+        return "temporal"
+    if values.dtype.kind in "fiu":
+        if name.lower() in TIME_PART_NAMES:
+            return "temporal"
+        return "numeric"
+    return "categorical"
+
+
+def aggregate(keys: np.ndarray, values: Optional[np.ndarray], how: str):
+    """Group values by key (sum or count); returns (unique_keys, aggregated)"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    if how == "count" or values is None:
+        return unique, np.bincount(inverse, minlength=len(unique)).astype(np.float64)
+    return unique, np.bincount(inverse, weights=np.nan_to_num(values), minlength=len(unique))
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int):
+    """Largest-Triangle-Three-Buckets downsampling; x must be sorted ascending"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    xf = x.astype(np.float64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = xf[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Twice the triangle area for every candidate in the bucket at once
+        areas = np.abs((xf[a] - avg_x) * (y[start:end] - y[a]) - (xf[a] - xf[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        keep[i + 1] = a
+
+    return x[keep], y[keep]
+
+
+def top_n_with_other(labels: np.ndarray, values: np.ndarray, n: int):
+    """Keep the n largest categories and fold the rest into a single 'Other' entry"""
+    order = np.argsort(values)[::-1]
+    if len(order) <= n:
+        return labels[order], values[order]
+    head = order[:n - 1]
+    rest = values[order[n - 1:]].sum()
+    return (np.append(labels[head], OTHER_LABEL).astype(object),
+            np.append(values[head], rest))
+
+
+def _to_python(value: Any, integral: bool = False) -> Any:
+    if isinstance(value, np.datetime64):
+        return value.astype("datetime64[ms]").astype(datetime) if not np.isnat(value) else None
+    if isinstance(value, np.floating):
+        if np.isnan(value):
+            return None
+        if integral and value.is_integer():
+            return int(value)
+        # Drop float summation noise (e.g. 15677.659999999998)
+        return round(float(value), 6)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def _pick_measure(numeric: List[str], question_lower: str) -> Optional[str]:
+    """Choose the y column: counts for "how many" questions, amounts otherwise"""
+    if not numeric:
+        return None
+    wants_count = any(word in question_lower for word in ("how many", "count", "number of", "volume"))
+    counts = [name for name in numeric if "count" in name.lower()]
+    amounts = [name for name in numeric if name not in counts]
+    preferred = counts if wants_count else amounts
+    return (preferred or numeric)[0]
+
+
+def combine_year_month(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Fold separate EXTRACT(YEAR ...) / EXTRACT(MONTH ...) columns into one datetime column"""
+    lower = {name.lower(): name for name in columns}
+    year, month = lower.get("year"), lower.get("month")
+    if not (year and month) or columns[year].dtype.kind != "f" or columns[month].dtype.kind != "f":
+        return columns
+    years, months = columns[year], columns[month]
+    valid = ~(np.isnan(years) | np.isnan(months))
+    period = np.full(len(years), np.datetime64("NaT"), dtype="datetime64[M]")
+    period[valid] = ((years[valid] - 1970) * 12 + months[valid] - 1).astype(np.int64).astype("datetime64[M]")
+    combined = {"period": period.astype("datetime64[ms]")}
+    combined.update((name, values) for name, values in columns.items() if name not in (year, month))
+    return combined
+
+
+def choose_axes(question: str, columns: Dict[str, np.ndarray]) -> Optional[Dict[str, Any]]:
+    """Decide chart type, x / y columns and aggregation; None means "show a table" """
+    question_lower = question.lower()
+    kinds = {name: column_kind(name, values) for name, values in columns.items()}
+    temporal = [name for name, kind in kinds.items() if kind == "temporal"]
+    numeric = [name for name, kind in kinds.items() if kind == "numeric"]
+    categorical = [name for name, kind in kinds.items() if kind == "categorical"]
+
+    y_axis = _pick_measure(numeric, question_lower)
+    aggregation = "sum" if y_axis else "count"
+    wants_line = any(word in question_lower for word in LINE_KEYWORDS)
+
+    if temporal and (wants_line or not categorical):
+        x_axis = temporal[0]
+        chart_type = "line"
+    elif categorical:
+        # A column named in the question wins; otherwise the first one (the usual GROUP BY key)
+        mentioned = [name for name in categorical if name.lower() in question_lower]
+        x_axis = mentioned[0] if mentioned else categorical[0]
+        wants_pie = any(word in question_lower for word in PIE_KEYWORDS)
+        if wants_pie and len(np.unique(columns[x_axis])) <= MAX_PIE_SLICES * 2:
+            chart_type = "pie"
+        else:
+            chart_type = "bar"
+    elif len(numeric) >= 2:
+        x_axis, y_axis = numeric[0], numeric[1]
+        chart_type, aggregation = "scatter", None
+    else:
+        return None
+
+    return {"type": chart_type, "x_axis": x_axis, "y_axis": y_axis, "aggregation": aggregation,
+            "x_kind": kinds[x_axis]}
+
+
+def valid_mask(values: np.ndarray) -> np.ndarray:
+    """Rows whose value is not NULL (NaT / NaN)"""
+    if values.dtype.kind == "M":
+        return ~np.isnat(values)
+    if values.dtype.kind == "f":
+        return ~np.isnan(values)
+    return np.ones(len(values), dtype=bool)
+
+
+def infer_chart_config(question: str, columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Pick chart type, axes and aggregation for a columnar result and build its series"""
+    columns = combine_year_month(columns)
+    row_count = len(next(iter(columns.values()))) if columns else 0
+    kinds = {name: column_kind(name, values) for name, values in columns.items()}
+    config = {"type": "table", "title": question, "data": [], "columns": kinds, "total_rows": row_count}
+
+    if row_count <= 1:
+        # Single-row answers (totals, averages) read best as a table / KPI
+        config["data"] = [{name: _to_python(values[0]) for name, values in columns.items()}] if row_count else []
+        return config
+
+    axes = choose_axes(question, columns)
+    if axes is None:
+        config["data"] = [{name: _to_python(v) for name, v in zip(columns, row)}
+                          for row in zip(*columns.values())]
+        return config
+
+    chart_type, x_axis, y_axis, aggregation = axes["type"], axes["x_axis"], axes["y_axis"], axes["aggregation"]
+    x = columns[x_axis]
+    y = columns[y_axis] if y_axis else None
+    downsampled = False
+
+    if chart_type == "scatter":
+        x_out, y_out = x, y
+        if len(x) > MAX_LINE_POINTS:
+            idx = np.linspace(0, len(x) - 1, MAX_LINE_POINTS).astype(np.int64)
+            x_out, y_out = x[idx], y[idx]
+            downsampled = True
+    else:
+        mask = valid_mask(x)
+        x_out, y_out = aggregate(x[mask], y[mask] if y is not None else None, aggregation)
+        if chart_type == "line":
+            if len(x_out) > MAX_LINE_POINTS:
+                x_out, y_out = lttb(x_out, y_out, MAX_LINE_POINTS)
+                downsampled = True
+        else:
+            limit = MAX_PIE_SLICES if chart_type == "pie" else MAX_BAR_CATEGORIES
+            downsampled = len(x_out) > limit
+            x_out, y_out = top_n_with_other(x_out, y_out, limit)
+
+    y_name = y_axis or "count"
+    config.update({
+        "type": chart_type,
+        "x_axis": x_axis,
+        "y_axis": y_name,
+        "aggregation": aggregation,
+        "downsampled": downsampled,
+        "data": [{x_axis: _to_python(xv, integral=kinds[x_axis] == "temporal"), y_name: _to_python(yv)}
+                 for xv, yv in zip(x_out, y_out)],
+    })
+    return config
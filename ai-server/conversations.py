@@ -0,0 +1,133 @@
+"""
+Per-session conversation state for multi-turn /chat.
+
+Clients pass `context.session_id` (the server hands one out when it is
+missing) and every answered turn is remembered: the question and the SQL that
+answered it. Sessions live in an in-memory LRU; set CONVERSATION_DB to a SQLite
+file to keep them across restarts.
+
+Follow-up questions ("now only for Q4", "break that down by vendor") are not
+sent to the LLM as a fresh question. The prompt carries only the previous SQL
+and the requested change, on top of the unchanged schema system prompt, so the
+cacheable prefix stays identical and each turn costs a few dozen tokens more
+than the question itself instead of a re-derivation from scratch.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", 10000))
+SESSION_TTL = float(os.getenv("CONVERSATION_TTL", 3600))
+MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", 10))
+
+# Phrasing that only makes sense relative to the previous answer
+FOLLOW_UP_RE = re.compile(
+    r"^\s*(now|then|and|also|only|just|instead|but|same|what about|how about|break (it|that|this) down|"
+    r"split (it|that|this)|group (it|that|this)|sort|order|limit|show (only|me only)|exclude|include|filter|"
+    r"without|except|top \d+ of (those|these|them))\b"
+    r"|\b(that|those|these|them|same|previous|above)\b",
+    re.IGNORECASE,
+)
+# Longer questions usually stand on their own even if they contain "it" or "that"
+FOLLOW_UP_MAX_WORDS = 12
+
+
+def is_follow_up(question: str) -> bool:
+    """Heuristic: does the question refine the previous answer rather than ask a new one?"""
+    return len(question.split()) <= FOLLOW_UP_MAX_WORDS and bool(FOLLOW_UP_RE.search(question))
+
+
+def follow_up_prompt(previous: Dict[str, Any], question: str) -> str:
+    """User prompt for a follow-up: just the previous SQL and the requested change"""
+    return (
+        f"Previous question: {previous['question']}\n"
+        f"Previous SQL:\n{previous['sql']}\n\n"
+        f"Follow-up: {question}\n"
+        "Modify the previous SQL so it answers the follow-up. Return ONLY the SQL query."
+    )
+
+
+class ConversationStore:
+    """Recent turns per session: in-memory LRU with optional SQLite write-through"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.sessions = LRUCache(max_size=MAX_SESSIONS, ttl=SESSION_TTL)
+        self.db_path = db_path if db_path is not None else os.getenv("CONVERSATION_DB")
+        self._db = None
+        self._db_lock = threading.Lock()
+        if self.db_path:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_turns ("
+                " session_id TEXT NOT NULL, created_at REAL NOT NULL, turn TEXT NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS conversation_turns_session"
+                " ON conversation_turns (session_id, created_at)"
+            )
+            self._db.commit()
+
+    def _load(self, session_id: str) -> List[Dict[str, Any]]:
+        if self._db is None:
+            return []
+        cutoff = time.time() - SESSION_TTL
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT turn FROM conversation_turns WHERE session_id = ? AND created_at >= ?"
+                " ORDER BY created_at DESC LIMIT ?",
+                (session_id, cutoff, MAX_TURNS),
+            ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def turns(self, session_id: str) -> List[Dict[str, Any]]:
+        turns = self.sessions.get(session_id)
+        if turns is None:
+            turns = self._load(session_id)
+            if turns:
+                self.sessions.set(session_id, turns)
+        return list(turns or [])
+
+    def last_turn(self, session_id: str) -> Optional[Dict[str, Any]]:
+        turns = self.turns(session_id)
+        return turns[-1] if turns else None
+
+    def add_turn(self, session_id: str, question: str, sql: str, **extra: Any):
+        turn = {"question": question, "sql": sql, "at": time.time(), **extra}
+        turns = (self.turns(session_id) + [turn])[-MAX_TURNS:]
+        self.sessions.set(session_id, turns)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT INTO conversation_turns (session_id, created_at, turn) VALUES (?, ?, ?)",
+                    (session_id, turn["at"], json.dumps(turn, default=str)),
+                )
+                self._db.execute(
+                    "DELETE FROM conversation_turns WHERE created_at < ?", (time.time() - SESSION_TTL,)
+                )
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+
+def session_id_from(context: Any) -> str:
+    """The client's session id from the request context, or a new one"""
+    session_id = context.get("session_id") if isinstance(context, dict) else None
+    if isinstance(session_id, str) and session_id.strip():
+        return session_id.strip()[:128]
+    return uuid.uuid4().hex
@@ -0,0 +1,99 @@
+"""
+Version of the data behind /chat results, for cache validation.
+
+current(tables) returns a token that changes whenever rows of the given
+analytics tables are written, so a cached result is only dropped when a table
+it read from changes. While the change feed is running (see change_feed.py)
+the token is driven by its events and moves as soon as a write commits.
+Otherwise it is derived from Postgres' cumulative per-table write counters
+(pg_stat_user_tables), re-read at most every DATA_VERSION_TTL seconds;
+Postgres publishes those with a delay of up to about ten seconds, so a cached
+result can outlive a write by that plus the TTL. Writers in this process call
+bump() to invalidate straight away.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import sqlglot
+from sqlglot import exp
+
+import change_feed
+import database
+
+logger = logging.getLogger(__name__)
+
+DATA_VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", 5))
+TABLES = ("vendors", "customers", "invoices", "line_items", "payments")
+
+_lock = threading.Lock()
+_local_versions: Dict[str, int] = {table: 0 for table in TABLES}
+_counters: Optional[Dict[str, int]] = None
+_checked_at = 0.0
+
+
+def referenced_tables(sql: str) -> Optional[List[str]]:
+    """The analytics tables `sql` reads from, or None when it cannot be parsed"""
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except Exception:
+        return None
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    names = {table.name.lower() for table in tree.find_all(exp.Table)} - ctes
+    return sorted(names & set(TABLES))
+
+
+def _tracked(tables: Optional[Iterable[str]]) -> List[str]:
+    # Unknown dependencies mean any write may matter
+    tracked = sorted(set(tables or ()) & set(TABLES))
+    return tracked or list(TABLES)
+
+
+def _read_counters() -> Dict[str, int]:
+    with database.connection() as conn:
+        return change_feed.write_counters(conn, TABLES)
+
+
+def current(tables: Optional[Iterable[str]] = None) -> Optional[str]:
+    """
+    The current version of `tables` (all analytics tables by default), or None
+    when it cannot be determined (no caching then)
+    """
+    global _counters, _checked_at
+    if not os.getenv("DATABASE_URL"):
+        return None
+    tracked = _tracked(tables)
+    with _lock:
+        local = ".".join(str(_local_versions[table]) for table in tracked)
+    if change_feed.feed.running:
+        return f"feed.{local}"
+
+    now = time.monotonic()
+    with _lock:
+        counters = _counters if now - _checked_at < DATA_VERSION_TTL else None
+    if counters is None:
+        try:
+            counters = _read_counters()
+        except Exception as e:
+            logger.warning(f"Could not read data version: {e}")
+            return None
+        with _lock:
+            _counters, _checked_at = counters, now
+    return f"{sum(counters.get(table, 0) for table in tracked)}.{local}"
+
+
+def bump(table: Optional[str] = None):
+    """Invalidate results cached against `table` (every table when None)"""
+    with _lock:
+        for name in ([table] if table in _local_versions else _local_versions):
+            _local_versions[name] += 1
+
+
+def _on_change(event: Dict[str, Any]):
+    bump(event.get("table"))
+
+
+change_feed.subscribe(_on_change)
@@ -0,0 +1,270 @@
+"""
+Pooled PostgreSQL access for the analytics server.
+
+Connections are long-lived and shared between requests, which is what lets
+prepared statements (see query_plans.py) survive from one request to the next.
+
+Writes and bookkeeping use the primary (DATABASE_URL, see connection()). The
+read-only SQL generated for /chat can be spread over read replicas listed in
+DATABASE_REPLICA_URLS (see read_connection()): each query goes to the healthy
+replica with the fewest queries in flight, a replica that fails
+DB_REPLICA_MAX_FAILURES times in a row is ejected for DB_REPLICA_EJECT_SECONDS,
+and the primary answers when no replica can. Replicas may lag the primary,
+so callers can check read_source to see which one answered.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import psycopg
+import psycopg.errors
+from psycopg.conninfo import conninfo_to_dict
+from psycopg_pool import ConnectionPool, PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+DB_REPLICA_MAX_FAILURES = int(os.getenv("DB_REPLICA_MAX_FAILURES", 3))
+DB_REPLICA_EJECT_SECONDS = float(os.getenv("DB_REPLICA_EJECT_SECONDS", 30))
+# Waiting longer than this for a replica connection counts as a failure
+DB_REPLICA_TIMEOUT = float(os.getenv("DB_REPLICA_TIMEOUT", 2))
+
+# SQLAlchemy-style and legacy schemes that libpq does not accept
+_SCHEME_RE = re.compile(r"^postgres(?:ql)?(?:\+\w+)?://")
+# Replica URLs are separated by commas or whitespace; a comma inside one URL
+# (libpq multi-host syntax) is never followed by a scheme
+_URL_SEPARATOR_RE = re.compile(r"[\s,]+(?=postgres(?:ql)?(?:\+\w+)?://)")
+
+# Where the last read_connection() in this context went: "primary" or a replica's name
+read_source: ContextVar[Optional[str]] = ContextVar("read_source", default=None)
+
+_pool = None
+_pool_lock = threading.Lock()
+_replicas: Optional[List["DataSource"]] = None
+
+
+def normalize_url(url: str) -> str:
+    """Rewrite postgres:// and postgresql+driver:// URLs to the postgresql:// form libpq parses"""
+    return _SCHEME_RE.sub("postgresql://", url.strip(), count=1)
+
+
+def get_database_url() -> str:
+    """Read DATABASE_URL and strip the SQLAlchemy driver suffix psycopg does not understand"""
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL not configured")
+    return normalize_url(database_url)
+
+
+def parse_database_url(url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    host, port, dbname, user and password of `url` (DATABASE_URL by default),
+    for clients that take keyword arguments such as Vanna's connect_to_postgres.
+    Parsed by libpq, so percent-encoded passwords, IPv6 hosts, Unix sockets
+    (?host=/path) and key=value strings all work.
+    """
+    params = conninfo_to_dict(normalize_url(url) if url else get_database_url())
+    user = params.get("user", "postgres")
+    return {
+        # libpq multi-host lists: keyword clients only take the first entry
+        "host": params.get("host", "localhost").split(",")[0],
+        "port": int(str(params.get("port") or 5432).split(",")[0]),
+        "dbname": params.get("dbname", user),
+        "user": user,
+        "password": params.get("password", ""),
+    }
+
+
+def get_pool() -> ConnectionPool:
+    """Create the connection pool on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    get_database_url(),
+                    min_size=int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+                    max_size=int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+                    name="analytics",
+                )
+                logger.info("Database connection pool created")
+    return _pool
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection; commits on success and rolls back on error"""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+class DataSource:
+    """A read replica: its pool, the queries in flight on it and its health"""
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = normalize_url(url)
+        self.host = parse_database_url(self.url)["host"]
+        self.pool: Optional[ConnectionPool] = None
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.errors = 0
+        self.ejected_until = 0.0
+
+    def get_pool(self) -> ConnectionPool:
+        with _pool_lock:
+            if self.pool is None:
+                self.pool = ConnectionPool(
+                    self.url,
+                    min_size=int(os.getenv("DB_REPLICA_POOL_MIN_SIZE", 1)),
+                    max_size=int(os.getenv("DB_REPLICA_POOL_MAX_SIZE", 10)),
+                    timeout=DB_REPLICA_TIMEOUT,
+                    name=self.name,
+                )
+                logger.info(f"Connection pool created for {self.name} ({self.host})")
+            return self.pool
+
+    def available(self, now: float) -> bool:
+        # After the ejection period one request is let through as a probe
+        return now >= self.ejected_until
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self, error: Exception):
+        self.failures += 1
+        self.errors += 1
+        if self.failures >= DB_REPLICA_MAX_FAILURES:
+            self.ejected_until = time.monotonic() + DB_REPLICA_EJECT_SECONDS
+            logger.warning(f"Ejecting {self.name} ({self.host}) for {DB_REPLICA_EJECT_SECONDS:g}s "
+                           f"after {self.failures} failures: {error}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        ejected_for = self.ejected_until - time.monotonic()
+        return {
+            "name": self.name,
+            "host": self.host,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.failures,
+            "ejected_for": round(ejected_for, 1) if ejected_for > 0 else 0,
+        }
+
+
+def get_replicas() -> List[DataSource]:
+    """The read replicas configured in DATABASE_REPLICA_URLS"""
+    global _replicas
+    if _replicas is None:
+        with _pool_lock:
+            if _replicas is None:
+                urls = _URL_SEPARATOR_RE.split(os.getenv("DATABASE_REPLICA_URLS", "").strip())
+                _replicas = [DataSource(f"replica-{i}", url) for i, url in enumerate(filter(None, urls), 1)]
+    return _replicas
+
+
+def _pick_replica(exclude: List[DataSource]) -> Optional[DataSource]:
+    """Least outstanding requests among the healthy replicas; reserves the pick"""
+    replicas, now = get_replicas(), time.monotonic()
+    with _pool_lock:
+        candidates = [r for r in replicas if r not in exclude and r.available(now)]
+        if not candidates:
+            return None
+        chosen = min(candidates, key=lambda r: (r.outstanding, r.requests))
+        chosen.outstanding += 1
+        chosen.requests += 1
+        return chosen
+
+
+def _release(source: DataSource):
+    with _pool_lock:
+        source.outstanding -= 1
+
+
+@contextmanager
+def read_connection():
+    """
+    Borrow a connection for read-only SQL: from the least busy healthy replica,
+    or from the primary when there are none; commits on success and rolls
+    back on error
+    """
+    tried: List[DataSource] = []
+    while True:
+        source = _pick_replica(tried)
+        if source is None:
+            read_source.set("primary")
+            with connection() as conn:
+                yield conn
+            return
+        tried.append(source)
+        try:
+            conn = source.get_pool().getconn()
+        except (PoolTimeout, psycopg.OperationalError) as e:
+            source.record_failure(e)
+            _release(source)
+            continue
+        break
+
+    read_source.set(source.name)
+    pool = source.pool
+    try:
+        # Same commit / rollback behaviour as ConnectionPool.connection()
+        with conn:
+            yield conn
+        source.record_success()
+    except psycopg.OperationalError as e:
+        # Lost connection or server trouble, as opposed to a bad or cancelled query
+        if not isinstance(e, psycopg.errors.QueryCanceled):
+            source.record_failure(e)
+        raise
+    finally:
+        pool.putconn(conn)
+        _release(source)
+
+
+def ping(timeout: float = 2.0):
+    """Round-trip to the primary through the pool; raises when it is unreachable or slower than `timeout`"""
+    with get_pool().connection(timeout=timeout) as conn:
+        # The checkout is bounded by the pool, the query by the server (for this transaction only)
+        conn.execute("SELECT set_config('statement_timeout', %s, true)", (f"{max(int(timeout * 1000), 1)}ms",))
+        conn.execute("SELECT 1")
+
+
+def warm_up():
+    """Create the pools and check out a first connection from each"""
+    # Not ConnectionPool.wait(): it closes the pool for good when the timeout expires
+    ping(timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)))
+    for replica in get_replicas():
+        try:
+            with replica.get_pool().connection(timeout=DB_REPLICA_TIMEOUT) as conn:
+                conn.execute("SELECT 1")
+        except Exception as e:
+            logger.warning(f"Replica {replica.name} not reachable at startup: {e}")
+
+
+def sources_snapshot() -> Dict[str, Any]:
+    """Where reads go: the primary host and each replica's load and health"""
+    return {
+        "primary": parse_database_url()["host"] if os.getenv("DATABASE_URL") else None,
+        "replicas": [replica.snapshot() for replica in get_replicas()],
+    }
+
+
+def close_pool():
+    """Close the pools (used on shutdown)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        for replica in _replicas or []:
+            if replica.pool is not None:
+                replica.pool.close()
+                replica.pool = None
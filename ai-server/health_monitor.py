@@ -0,0 +1,236 @@
+"""
+Background health checks, so that probes never touch a dependency.
+
+Orchestrators probe every pod every few seconds; running a query (or opening
+a connection) per probe turns that into real load on Postgres. Instead one
+background thread checks each registered dependency on its own interval: the
+database with SELECT 1 through the pool every HEALTH_CHECK_INTERVAL seconds,
+the LLM with a lightweight call (e.g. listing models) every
+HEALTH_LLM_CHECK_INTERVAL seconds. /health and /health/ready serve the cached
+results along with their age and the last HEALTH_HISTORY latencies.
+
+Due checks run concurrently, each given HEALTH_CHECK_TIMEOUT seconds: a
+check still running then counts as failed (and is not started again until it
+returns), so one hung dependency never delays the others. A failing check is
+retried every HEALTH_CHECK_INTERVAL seconds until it passes, and a result
+older than three intervals counts as failing, so a stuck monitor cannot keep
+reporting healthy.
+"""
+
+import os
+import time
+import logging
+import statistics
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import database
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 10))
+HEALTH_LLM_CHECK_INTERVAL = float(os.getenv("HEALTH_LLM_CHECK_INTERVAL", 60))
+# Budget for a single check; a slow dependency fails its check instead of stalling the others
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 2))
+HEALTH_HISTORY = int(os.getenv("HEALTH_HISTORY", 30))
+STALE_AFTER_INTERVALS = 3
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+def _timed(fn: Callable[[], Any]) -> Tuple[bool, Optional[str], float]:
+    """(ok, error, seconds) of calling `fn`"""
+    started = time.perf_counter()
+    try:
+        fn()
+        ok, error = True, None
+    except Exception as e:
+        ok, error = False, str(e) or type(e).__name__
+    return ok, error, time.perf_counter() - started
+
+
+class Check:
+    """One dependency: how to check it, how often, and its recent results"""
+
+    def __init__(self, name: str, fn: Callable[[], Any], interval: float):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.ok: Optional[bool] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.due_at = 0.0
+        self.running: Optional[Future] = None
+        self.started = 0.0
+        self.history = deque(maxlen=HEALTH_HISTORY)
+
+    def age(self, now: float) -> Optional[float]:
+        return now - self.checked_at if self.checked_at else None
+
+    def status(self, now: float) -> str:
+        if self.checked_at is None:
+            return "unknown"
+        if self.age(now) > STALE_AFTER_INTERVALS * self.interval:
+            return "stale"
+        return "healthy" if self.ok else "unhealthy"
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        latencies = [entry["latency_ms"] for entry in self.history]
+        age = self.age(now)
+        return {
+            "status": self.status(now),
+            "checked_at": _isoformat(self.checked_at),
+            "age_seconds": round(age, 3) if age is not None else None,
+            "interval_seconds": self.interval,
+            "latency_ms": latencies[-1] if latencies else None,
+            "latency_p50_ms": round(statistics.median(latencies), 2) if latencies else None,
+            "latency_max_ms": max(latencies) if latencies else None,
+            "error": self.error,
+            "history": list(self.history),
+        }
+
+
+class HealthMonitor:
+    """Runs the registered checks in a background thread and caches their results"""
+
+    def __init__(self):
+        self._checks: Dict[str, Check] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def register(self, name: str, fn: Callable[[], Any], interval: Optional[float] = None):
+        """Check `name` by calling `fn` (which raises when unhealthy) every `interval` seconds"""
+        with self._lock:
+            self._checks[name] = Check(name, fn, interval or HEALTH_CHECK_INTERVAL)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        # Each check has at most one call in flight, so one worker per check is enough
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self._checks), 1), thread_name_prefix="health-check")
+        self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+        self._thread.start()
+        logger.info(f"Health monitor started ({', '.join(self._checks)})")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=HEALTH_CHECK_TIMEOUT + 2)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            due = self._due()
+            if due:
+                self._run_checks(due)
+            with self._lock:
+                next_due = min((check.due_at for check in self._checks.values()), default=None)
+            delay = next_due - time.monotonic() if next_due is not None else HEALTH_CHECK_INTERVAL
+            self._stop.wait(max(delay, 0.05))
+
+    def _due(self) -> List[Check]:
+        now = time.monotonic()
+        with self._lock:
+            return [check for check in self._checks.values() if check.due_at <= now]
+
+    def _run_checks(self, checks: List[Check]):
+        """Run `checks` concurrently and record each result, or a failure after HEALTH_CHECK_TIMEOUT"""
+        futures: Dict[str, Future] = {}
+        for check in checks:
+            if check.running is not None and not check.running.done():
+                # A call that outlived its timeout is left to finish; never pile up another one
+                self._record(check, False, "previous check still running", time.perf_counter() - check.started)
+                continue
+            check.started = time.perf_counter()
+            check.running = futures[check.name] = self._executor.submit(_timed, check.fn)
+        wait(futures.values(), timeout=HEALTH_CHECK_TIMEOUT)
+        for check in checks:
+            future = futures.get(check.name)
+            if future is None:
+                continue
+            if future.done():
+                self._record(check, *future.result())
+            else:
+                self._record(check, False, f"timed out after {HEALTH_CHECK_TIMEOUT:g}s",
+                             time.perf_counter() - check.started)
+
+    def _record(self, check: Check, ok: bool, error: Optional[str], seconds: float):
+        latency_ms = round(seconds * 1000, 2)
+        with self._lock:
+            if ok != check.ok and check.ok is not None:
+                log = logger.info if ok else logger.warning
+                log(f"Health check {check.name} is now {'healthy' if ok else 'failing'}"
+                    + (f": {error}" if error else ""))
+            check.ok, check.error = ok, error
+            check.checked_at = time.time()
+            # Failing checks are retried on the short interval so recovery shows up quickly
+            check.due_at = time.monotonic() + (check.interval if ok else min(check.interval, HEALTH_CHECK_INTERVAL))
+            check.history.append({"at": _isoformat(check.checked_at), "ok": ok, "latency_ms": latency_ms})
+
+    def healthy(self, name: str) -> bool:
+        """Whether the last result for `name` passed and is still fresh"""
+        with self._lock:
+            check = self._checks.get(name)
+            return check is not None and check.status(time.time()) == "healthy"
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "checks": {name: check.snapshot(now) for name, check in self._checks.items()},
+            }
+
+
+# The process-wide monitor; the servers register their checks and start it on startup
+monitor = HealthMonitor()
+
+
+def check_database():
+    database.ping(HEALTH_CHECK_TIMEOUT)
+
+
+def register(name: str, fn: Callable[[], Any], interval: Optional[float] = None):
+    monitor.register(name, fn, interval)
+
+
+def start():
+    monitor.start()
+
+
+def stop():
+    monitor.stop()
+
+
+def report(service: str, **static_checks: bool) -> Dict[str, Any]:
+    """
+    The /health payload from cached results: "unhealthy" when the database
+    check fails, "degraded" when any other check does.
+    """
+    status = monitor.snapshot()
+    checks = {name: check["status"] == "healthy" for name, check in status["checks"].items()}
+    checks.update(static_checks)
+    ages = [check["age_seconds"] for check in status["checks"].values() if check["age_seconds"] is not None]
+    payload = {
+        "service": service,
+        "status": "unhealthy" if not checks.get("database") else "healthy" if all(checks.values()) else "degraded",
+        "timestamp": datetime.now().isoformat(),
+        "age_seconds": max(ages) if ages else None,
+        "checks": checks,
+        "monitor": status,
+    }
+    errors = {name: check["error"] for name, check in status["checks"].items() if check["error"]}
+    if errors:
+        payload["errors"] = errors
+    return payload
@@ -0,0 +1,115 @@
+"""
+Response compression and conditional requests.
+
+Responses larger than RESPONSE_COMPRESS_MIN_SIZE bytes are compressed: brotli
+when the brotli-asgi package is installed and the client accepts it, gzip
+otherwise. Cacheable responses carry an ETag, and a request whose
+If-None-Match matches it gets a 304 with no body. /schema is versioned by the
+hash of the schema snapshot and /chat results by the version of the tables
+they read (see data_version.py), so repeat dashboard loads are answered
+without re-running the question.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from fastapi import FastAPI, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+
+import data_version
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", 4))
+# Clients may keep a copy but must revalidate it with If-None-Match before use
+CACHE_CONTROL = "private, no-cache"
+
+
+def add_compression(app: FastAPI):
+    """Compress responses above the size threshold (brotli if available, else gzip)"""
+    try:
+        from brotli_asgi import BrotliMiddleware
+    except ImportError:
+        app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE, compresslevel=GZIP_LEVEL)
+        logger.info(f"gzip compression enabled for responses over {COMPRESS_MIN_SIZE} bytes")
+        return
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESS_MIN_SIZE, quality=BROTLI_QUALITY,
+                       gzip_fallback=True)
+    logger.info(f"brotli/gzip compression enabled for responses over {COMPRESS_MIN_SIZE} bytes")
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Weak ETag over `parts`; weak because the compressed and uncompressed
+    representations of a response share it.
+    """
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison of `etag` against the request's If-None-Match header"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def conditional_json(request: Request, payload: Any, etag: str) -> Response:
+    """304 when the client already has this version, else the JSON payload with its ETag"""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=jsonable_encoder(payload), headers=headers)
+
+
+class ResultCache:
+    """
+    Response payloads keyed by request, each valid for as long as the version
+    of the tables it was computed from is unchanged
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None,
+                 version: Callable[[Optional[List[str]]], Optional[str]] = data_version.current):
+        self.entries = LRUCache(max_size=max_size, ttl=ttl)
+        self.version = version
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """The cached {"etag", "payload"} for `key`, if its tables have not changed since"""
+        entry = self.entries.get(key)
+        if entry is None or self.version(entry["tables"]) != entry["version"]:
+            return None
+        return entry
+
+    def set(self, key: Hashable, version: Optional[str], payload: Dict[str, Any],
+            tables: Optional[List[str]] = None) -> Optional[str]:
+        """
+        Cache `payload` for `key`, computed from `tables` at `version` (taken
+        from the primary before running the query there), and return its ETag
+        (None when uncacheable)
+        """
+        if version is None:
+            return None
+        etag = make_etag(key, version)
+        self.entries.set(key, {"version": version, "tables": tables, "etag": etag, "payload": payload})
+        return etag
+
+    def stats(self) -> dict:
+        return self.entries.stats()
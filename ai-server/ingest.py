@@ -0,0 +1,661 @@
+"""
+Streaming, parallel, resumable bulk ingester for extracted-document exports.
+
+Exports such as apps/api/data/Analytics_Test_Data.json are a JSON array (or
+newline-delimited stream) of documents in Mongo extended JSON, each carrying
+the LLM extraction under extractedData.llmData.{invoice,vendor,customer,
+payment,summary,lineItems}. Real exports are gigabytes, so the file is never
+loaded whole: iter_documents() reads it in chunks and decodes one document at a
+time with JSONDecoder.raw_decode, converting $date / $numberLong / ... on the
+way. Every document is mapped onto vendors, customers, invoices, line_items
+and payments rows; the last three carry the document's organizationId (the
+tenant column of enable-tenant-rls.sql, which has to be applied first).
+
+The file is split at document boundaries into byte ranges that a process pool
+works through. Each batch is COPYed into staging tables and upserted in one
+transaction: vendors and customers by id, invoices by invoiceNumber (a later
+document with a known invoice number updates that invoice, the newest
+updatedAt wins) and by document _id, with the winning document's line items
+and payments replacing the old ones. The same transaction records how far the
+range has been loaded in ingest_checkpoints, so an interrupted run started
+again with the same file resumes where it stopped, and re-running a finished
+load changes nothing. The loader connections read and write every
+organization's rows (app.tenant_id = '*'), so ingesting also works as a role
+in ai_server_scoped.
+
+    python ingest.py ../apps/api/data/Analytics_Test_Data.json --workers 8
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import io
+import hashlib
+import logging
+import argparse
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psycopg
+from dotenv import load_dotenv
+
+import database
+import partitioning
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 1 << 20
+# A document that does not decode within this many buffered characters is malformed, not incomplete
+MAX_DOCUMENT_SIZE = 64 << 20
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 1000))
+# More chunks than workers keeps every process busy until the end
+CHUNKS_PER_WORKER = 4
+# Bytes examined at a time when looking for a document boundary to split at
+PLAN_WINDOW = 4 << 20
+# Upserts of the same new invoice number or vendor by two workers at once make one of them retry
+LOAD_RETRIES = 5
+PAYMENT_DUE_DAYS = 30
+
+# Insertion order respects the foreign keys
+TABLES = ("vendors", "customers", "invoices", "line_items", "payments")
+COLUMNS = {
+    "vendors": ("id", "name", "address", "city", "country", "category", "taxId", "createdAt", "updatedAt"),
+    "customers": ("id", "name", "address", "city", "country", "createdAt", "updatedAt"),
+    "invoices": ("id", "invoiceNumber", "vendorId", "customerId", "issueDate", "dueDate", "paidDate",
+                 "subtotal", "taxAmount", "totalAmount", "currency", "status", "description", "category",
+                 "paymentTerms", tenancy.TENANT_COLUMN, "createdAt", "updatedAt"),
+    "line_items": ("id", "invoiceId", "description", "quantity", "unitPrice", "totalPrice", "category",
+                   tenancy.TENANT_COLUMN, "createdAt", "updatedAt"),
+    "payments": ("id", "invoiceId", "amount", "currency", "method", "reference", "paidDate", "notes",
+                 tenancy.TENANT_COLUMN, "createdAt", "updatedAt"),
+}
+# Organization data; vendors and customers are shared
+TENANT_TABLES = ("invoices", "line_items", "payments")
+# Shared by many documents: upserted by id, newest updatedAt wins
+DIMENSIONS = ("vendors", "customers")
+
+CURRENCY_SYMBOLS = {"€": "EUR", "$": "USD", "£": "GBP", "CHF": "CHF", "Fr.": "CHF"}
+COUNTRY_CODES = {"DE": "Germany", "AT": "Austria", "CH": "Switzerland", "NL": "Netherlands", "FR": "France",
+                 "IT": "Italy", "ES": "Spain", "BE": "Belgium", "PL": "Poland", "GB": "United Kingdom",
+                 "UK": "United Kingdom", "US": "United States"}
+POSTAL_CITY_RE = re.compile(r"\b\d{4,5}\s+(\D.*)")
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%d.%m.%y")
+
+
+def extended_json(obj: Dict[str, Any]) -> Any:
+    """object_hook turning Mongo extended JSON wrappers into Python values"""
+    if len(obj) != 1:
+        return obj
+    key, value = next(iter(obj.items()))
+    if key == "$date":
+        # Canonical form nests the epoch milliseconds: {"$date": {"$numberLong": "..."}}
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if key in ("$numberLong", "$numberInt"):
+        return int(value)
+    if key == "$numberDouble":
+        return float(value)
+    if key == "$numberDecimal":
+        return Decimal(value)
+    if key == "$oid":
+        return value
+    return obj
+
+
+def iter_documents(path: str, start: int = 0,
+                   end: Optional[int] = None) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """
+    Yield (offset, next_offset, document) for the documents of a JSON array or
+    newline-delimited export that start in the byte range [start, end).
+    `start` must be 0 or a document boundary (see plan_chunks).
+    """
+    decoder = json.JSONDecoder(object_hook=extended_json)
+    with open(path, "rb") as raw:
+        raw.seek(start)
+        f = io.TextIOWrapper(raw, encoding="utf-8")
+        buffer, pos, eof = "", 0, False
+        # Byte offset of buffer[counted]; characters are encoded once to keep offsets exact
+        offset, counted = start, 0
+        while True:
+            # Skip the array brackets and separators between documents
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,[":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            if pos == len(buffer):
+                if eof:
+                    return
+                offset += len(buffer[counted:].encode("utf-8"))
+                buffer, pos, counted = f.read(READ_CHUNK_SIZE), 0, 0
+                eof = not buffer
+                continue
+            offset += len(buffer[counted:pos].encode("utf-8"))
+            counted = pos
+            if end is not None and offset >= end:
+                return
+            try:
+                document, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Most likely the document continues in the next chunk
+                if eof or len(buffer) - pos > MAX_DOCUMENT_SIZE:
+                    raise
+                more = f.read(READ_CHUNK_SIZE)
+                eof = not more
+                buffer, pos, counted = buffer[pos:] + more, 0, 0
+                continue
+            document_offset = offset
+            offset += len(buffer[counted:pos].encode("utf-8"))
+            counted = pos
+            yield document_offset, offset, document
+
+
+def _is_document(value: Any) -> bool:
+    return isinstance(value, dict) and "_id" in value and ("extractedData" in value or "filePath" in value)
+
+
+def _truncated(error: json.JSONDecodeError, text: str) -> bool:
+    """Did decoding fail because `text` ends mid-value (rather than because it is not JSON)?"""
+    return error.msg.startswith("Unterminated string") or error.pos >= len(text) - 1
+
+
+def _document_start_after(path: str, offset: int) -> int:
+    """Byte offset of the first top-level document starting at or after `offset` (file size if none)"""
+    size = os.path.getsize(path)
+    decoder = json.JSONDecoder()
+    window = PLAN_WINDOW
+    with open(path, "rb") as f:
+        while offset < size:
+            f.seek(offset)
+            raw = f.read(window)
+            # Do not start decoding in the middle of a multi-byte character
+            skip = 0
+            while skip < len(raw) and raw[skip] & 0xC0 == 0x80:
+                skip += 1
+            text = raw[skip:].decode("utf-8", errors="ignore")
+            complete = offset + len(raw) >= size
+            for match in re.finditer(r"\{", text):
+                index = match.start()
+                # Documents follow the array bracket, a comma, or the previous line's document
+                before = text[max(0, index - 256):index].rstrip()
+                if not before or before[-1] not in ",[}":
+                    continue
+                try:
+                    value, _ = decoder.raw_decode(text, index)
+                except json.JSONDecodeError as e:
+                    if _truncated(e, text) and not complete and window < MAX_DOCUMENT_SIZE:
+                        break
+                    continue
+                if _is_document(value):
+                    return offset + skip + len(text[:index].encode("utf-8"))
+            else:
+                # No document starts in this window; move on, keeping the tail in case one straddles it
+                if complete:
+                    return size
+                offset += max(len(raw) - 256, 1)
+                continue
+            window *= 2
+    return size
+
+
+def plan_chunks(path: str, count: int) -> List[Tuple[int, int]]:
+    """Split the file into about `count` byte ranges that start at document boundaries"""
+    size = os.path.getsize(path)
+    starts = {0}
+    for i in range(1, max(count, 1)):
+        starts.add(_document_start_after(path, size * i // count))
+    starts = sorted(start for start in starts if start < size)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _field(section: Optional[Dict[str, Any]], name: str) -> Any:
+    """Value of an extracted field (`{"value": ...}` wrapper), None when missing or blank"""
+    fields = (section or {}).get("value")
+    if not isinstance(fields, dict):
+        return None
+    entry = fields.get(name)
+    # Some exports flatten a field to its bare value
+    value = entry.get("value") if isinstance(entry, dict) else entry
+    return None if value == "" else value
+
+
+def _item_field(item: Any, name: str) -> Any:
+    """Value of a field of one line item (`{"value": ...}` wrapper)"""
+    if not isinstance(item, dict):
+        return None
+    entry = item.get(name)
+    return entry.get("value") if isinstance(entry, dict) else entry
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _number(value: Any) -> Optional[Decimal]:
+    """Decimal from an extracted amount; accepts numbers and "1.234,56"-style strings"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+    text = re.sub(r"[^\d,.\-]", "", str(value))
+    if "," in text:
+        # German notation: dots group thousands, the comma is the decimal separator
+        text = text.replace(".", "").replace(",", ".")
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        return None
+
+
+def _date(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    text = _text(value)
+    if text is None:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text[:10], fmt)
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _stable_id(prefix: str, name: str) -> str:
+    return f"{prefix}_{hashlib.sha1(name.strip().lower().encode('utf-8')).hexdigest()[:20]}"
+
+
+def _address_parts(address: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(city, country) from an address such as "Ringstraße 12, 12345 Testdorf, DE" """
+    if not address:
+        return None, None
+    parts = [part.strip() for part in re.split(r"[,\n]", address) if part.strip()]
+    match = next((m for m in map(POSTAL_CITY_RE.search, parts) if m), None)
+    city = match.group(1).strip() if match else None
+    last = parts[-1] if parts else ""
+    country = COUNTRY_CODES.get(last.upper(), last if len(last) > 2 and not any(c.isdigit() for c in last) else None)
+    return city, country
+
+
+def _invoice_status(value: Optional[str]) -> str:
+    value = (value or "").lower()
+    for status in ("paid", "overdue", "cancelled", "draft"):
+        if status in value:
+            return status.upper()
+    return "PENDING"
+
+
+def map_document(document: Dict[str, Any]) -> Optional[Dict[str, List[tuple]]]:
+    """Rows per table for one exported document, or None when it carries no invoice"""
+    llm = (document.get("extractedData") or {}).get("llmData") or {}
+    invoice, vendor, customer = llm.get("invoice"), llm.get("vendor"), llm.get("customer")
+    payment, summary = llm.get("payment"), llm.get("summary")
+    if not invoice:
+        return None
+
+    doc_id = str(document["_id"])
+    organization = _text(document.get("organizationId") or (document.get("metadata") or {}).get("organizationId"))
+    created = document.get("createdAt") if isinstance(document.get("createdAt"), datetime) else None
+    created = created or datetime.now(timezone.utc)
+    updated = document.get("updatedAt") if isinstance(document.get("updatedAt"), datetime) else created
+    rows: Dict[str, List[tuple]] = {table: [] for table in TABLES}
+
+    vendor_name = _text(_field(vendor, "vendorName")) or "Unknown Vendor"
+    vendor_id = _stable_id("vendor", vendor_name)
+    vendor_address = _text(_field(vendor, "vendorAddress"))
+    city, country = _address_parts(vendor_address)
+    rows["vendors"].append((vendor_id, vendor_name, vendor_address, city, country, "Services",
+                            _text(_field(vendor, "vendorTaxId")), created, updated))
+
+    customer_id = None
+    customer_name = _text(_field(customer, "customerName"))
+    if customer_name:
+        customer_id = _stable_id("customer", customer_name)
+        customer_address = _text(_field(customer, "customerAddress"))
+        city, country = _address_parts(customer_address)
+        rows["customers"].append((customer_id, customer_name, customer_address, city, country, created, updated))
+
+    total = _number(_field(summary, "invoiceTotal")) or Decimal(0)
+    subtotal = _number(_field(summary, "subTotal"))
+    tax = _number(_field(summary, "totalTax"))
+    if subtotal is None:
+        subtotal = total - (tax or Decimal(0))
+    if tax is None:
+        tax = total - subtotal
+    symbol = _text(_field(summary, "currencySymbol"))
+    currency = CURRENCY_SYMBOLS.get(symbol, symbol.upper() if symbol and symbol.isalpha() else "EUR")
+
+    issue_date = _date(_field(invoice, "invoiceDate")) or created
+    net_days = _number(_field(payment, "netDays"))
+    due_date = _date(_field(payment, "dueDate")) or \
+        issue_date + timedelta(days=int(net_days) if net_days else PAYMENT_DUE_DAYS)
+    status = _invoice_status(_text(_field(invoice, "status")) or document.get("status"))
+    paid_date = due_date if status == "PAID" else None
+    invoice_number = _text(_field(invoice, "invoiceId")) or f"DOC-{doc_id}"
+    description = _text(_field(invoice, "description")) or _text((document.get("metadata") or {}).get("title"))
+    rows["invoices"].append((doc_id, invoice_number, vendor_id, customer_id, issue_date, due_date, paid_date,
+                             subtotal, tax, total, currency, status, description, "General",
+                             _text(_field(payment, "paymentTerms")), organization, created, updated))
+
+    items = _field(llm.get("lineItems"), "items") or []
+    for n, item in enumerate(items if isinstance(items, list) else []):
+        quantity = _number(_item_field(item, "quantity")) or Decimal(1)
+        unit_price = _number(_item_field(item, "unitPrice")) or Decimal(0)
+        total_price = _number(_item_field(item, "totalPrice"))
+        if total_price is None:
+            total_price = quantity * unit_price
+        rows["line_items"].append((f"{doc_id}:{n}", doc_id, _text(_item_field(item, "description")) or "Item",
+                                   quantity, unit_price, total_price, "General", organization, created, updated))
+    if not rows["line_items"]:
+        rows["line_items"].append((f"{doc_id}:0", doc_id, description or "Service/Product", Decimal(1),
+                                   subtotal, subtotal, "General", organization, created, updated))
+
+    if status == "PAID":
+        rows["payments"].append((f"{doc_id}:payment", doc_id, total, currency, "BANK_TRANSFER",
+                                 _text(_field(payment, "bankAccountNumber")), paid_date,
+                                 "Auto-generated payment record", organization, created, updated))
+    return rows
+
+
+def _quoted(columns: Tuple[str, ...]) -> str:
+    return ", ".join(f'"{column}"' for column in columns)
+
+
+def _assignments(table: str) -> str:
+    """SET list of an upsert: every column except the key and the creation time"""
+    return ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in COLUMNS[table] if c not in ("id", "createdAt"))
+
+
+def connect() -> psycopg.Connection:
+    """Connection to DATABASE_URL that reads and writes every organization's rows (see enable-tenant-rls.sql)"""
+    conn = psycopg.connect(database.get_database_url())
+    tenancy.all_tenants(conn, local=False)
+    conn.commit()
+    return conn
+
+
+def source_key(path: str) -> str:
+    """Identifies an export by name, size and leading bytes, so a moved file still resumes"""
+    with open(path, "rb") as f:
+        head = hashlib.sha1(f.read(1 << 20)).hexdigest()[:16]
+    return f"{os.path.basename(path)}:{os.path.getsize(path)}:{head}"
+
+
+def ensure_checkpoints(conn: psycopg.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS ingest_checkpoints ("
+        " source TEXT NOT NULL, start_offset BIGINT NOT NULL, end_offset BIGINT NOT NULL,"
+        " next_offset BIGINT NOT NULL, documents BIGINT NOT NULL DEFAULT 0, done BOOLEAN NOT NULL DEFAULT FALSE,"
+        ' "updatedAt" TIMESTAMP NOT NULL DEFAULT now(), PRIMARY KEY (source, start_offset))'
+    )
+    conn.commit()
+
+
+class CopyLoader:
+    """COPYs batches into staging tables and upserts them, one transaction per batch"""
+
+    def __init__(self, conn: psycopg.Connection):
+        self.conn = conn
+        missing = [table for table in TENANT_TABLES if not conn.execute(
+            "SELECT 1 FROM pg_attribute WHERE attrelid = %s::regclass AND attname = %s AND NOT attisdropped",
+            (table, tenancy.TENANT_COLUMN)).fetchone()]
+        if missing:
+            raise RuntimeError(f'{", ".join(missing)} lack the "{tenancy.TENANT_COLUMN}" column:'
+                               " apply enable-tenant-rls.sql before ingesting")
+        self.rows = {table: 0 for table in TABLES}
+        # Conflict targets: a partitioned table's primary key includes its partition key
+        self.keys = {table: _quoted(tuple(partitioning.unique_key(conn, table))) for table in TABLES}
+        self.invoices_partitioned = partitioning.is_partitioned(conn, "invoices")
+        for table in TABLES:
+            conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS stage_{table} (LIKE {table} INCLUDING DEFAULTS)"
+                         " ON COMMIT DELETE ROWS")
+        # Staged document id -> id of the invoice it lands on, and the invoices actually written
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS stage_invoice_ids"
+                     " (doc_id TEXT PRIMARY KEY, invoice_id TEXT NOT NULL) ON COMMIT DELETE ROWS")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS applied_invoices"
+                     " (invoice_id TEXT PRIMARY KEY, doc_id TEXT NOT NULL) ON COMMIT DELETE ROWS")
+        conn.commit()
+
+    def _copy(self, cursor: psycopg.Cursor, table: str, rows: List[tuple]):
+        with cursor.copy(f"COPY stage_{table} ({_quoted(COLUMNS[table])}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+
+    def _upsert_dimension(self, cursor: psycopg.Cursor, table: str):
+        columns = _quoted(COLUMNS[table])
+        cursor.execute(
+            f"INSERT INTO {table} ({columns})"
+            f' SELECT DISTINCT ON (id) {columns} FROM stage_{table} ORDER BY id, "updatedAt" DESC'
+            f" ON CONFLICT ({self.keys[table]}) DO UPDATE SET {_assignments(table)}"
+            f' WHERE {table}."updatedAt" <= EXCLUDED."updatedAt"'
+        )
+        self.rows[table] += cursor.rowcount
+
+    def _upsert_invoices(self, cursor: psycopg.Cursor):
+        # A known invoice number keeps the id it was first stored under; otherwise the
+        # newest staged document carrying the number provides the id
+        cursor.execute(
+            "INSERT INTO stage_invoice_ids (doc_id, invoice_id)"
+            " SELECT DISTINCT ON (s.id) s.id, COALESCE(i.id, k.id) FROM stage_invoices s"
+            ' JOIN (SELECT DISTINCT ON ("invoiceNumber") "invoiceNumber", id FROM stage_invoices'
+            '       ORDER BY "invoiceNumber", "updatedAt" DESC, id DESC) k USING ("invoiceNumber")'
+            ' LEFT JOIN invoices i ON i."invoiceNumber" = s."invoiceNumber"'
+            " ORDER BY s.id"
+        )
+        rest = ", ".join(f's."{c}"' for c in COLUMNS["invoices"] if c != "id")
+        moved = newer = ""
+        if self.invoices_partitioned:
+            # A new issue date moves the invoice to another partition, where the
+            # upsert cannot see it: delete the old row unless it is the newer one
+            date_changed = 'i.id = s.invoice_id AND i."issueDate" IS DISTINCT FROM s."issueDate"'
+            moved = ('), moved AS ('
+                     f'  DELETE FROM invoices i USING winners s WHERE {date_changed}'
+                     '  AND i."updatedAt" <= s."updatedAt"')
+            newer = ('  WHERE NOT EXISTS (SELECT 1 FROM invoices i'
+                     f'  WHERE {date_changed} AND i."updatedAt" > s."updatedAt")')
+        cursor.execute(
+            "WITH winners AS ("
+            "  SELECT DISTINCT ON (m.invoice_id) m.invoice_id, s.* FROM stage_invoices s"
+            "  JOIN stage_invoice_ids m ON m.doc_id = s.id"
+            '  ORDER BY m.invoice_id, s."updatedAt" DESC, s.id DESC'
+            f"{moved}"
+            "), upserted AS ("
+            f'  INSERT INTO invoices ({_quoted(COLUMNS["invoices"])})'
+            f"  SELECT s.invoice_id, {rest} FROM winners s{newer} ORDER BY s.invoice_id"
+            f'  ON CONFLICT ({self.keys["invoices"]}) DO UPDATE SET {_assignments("invoices")}'
+            '  WHERE invoices."updatedAt" <= EXCLUDED."updatedAt"'
+            "  RETURNING id"
+            ")"
+            " INSERT INTO applied_invoices (invoice_id, doc_id)"
+            " SELECT u.id, w.id FROM upserted u JOIN winners w ON w.invoice_id = u.id"
+        )
+        self.rows["invoices"] += cursor.rowcount
+
+    def _replace_children(self, cursor: psycopg.Cursor, table: str):
+        """The winning document's line items / payments replace those of the invoice it updated"""
+        columns = COLUMNS[table]
+        cursor.execute(f'DELETE FROM {table} t USING applied_invoices a WHERE t."invoiceId" = a.invoice_id')
+        select = ", ".join("a.invoice_id" if c == "invoiceId" else f's."{c}"' for c in columns)
+        cursor.execute(
+            f"INSERT INTO {table} ({_quoted(columns)})"
+            f" SELECT DISTINCT ON (s.id) {select} FROM stage_{table} s"
+            f' JOIN applied_invoices a ON a.doc_id = s."invoiceId" ORDER BY s.id'
+            f" ON CONFLICT ({self.keys[table]}) DO UPDATE SET {_assignments(table)}"
+        )
+        self.rows[table] += cursor.rowcount
+
+    def load(self, batch: Dict[str, List[tuple]], checkpoint: Optional[tuple] = None):
+        """
+        Upsert one batch; `checkpoint` = (source, start_offset, next_offset, documents, done)
+        is recorded in the same transaction. Conflicts with concurrent workers are retried.
+        """
+        for attempt in range(LOAD_RETRIES):
+            try:
+                self._load(batch, checkpoint)
+                return
+            except (psycopg.errors.UniqueViolation, psycopg.errors.DeadlockDetected) as e:
+                if attempt == LOAD_RETRIES - 1:
+                    raise
+                logger.info(f"Batch conflicted with another worker, retrying: {e}")
+                time.sleep(0.05 * (attempt + 1))
+
+    def _load(self, batch: Dict[str, List[tuple]], checkpoint: Optional[tuple]):
+        counts = dict(self.rows)
+        try:
+            with self.conn.transaction(), self.conn.cursor() as cursor:
+                for table in TABLES:
+                    if batch[table]:
+                        self._copy(cursor, table, batch[table])
+                for table in DIMENSIONS:
+                    if batch[table]:
+                        self._upsert_dimension(cursor, table)
+                if batch["invoices"]:
+                    self._upsert_invoices(cursor)
+                    self._replace_children(cursor, "line_items")
+                    self._replace_children(cursor, "payments")
+                if checkpoint is not None:
+                    source, start, next_offset, documents, done = checkpoint
+                    cursor.execute(
+                        "UPDATE ingest_checkpoints SET next_offset = %s, documents = documents + %s,"
+                        ' done = %s, "updatedAt" = now() WHERE source = %s AND start_offset = %s',
+                        (next_offset, documents, done, source, start),
+                    )
+        except Exception:
+            self.rows = counts
+            raise
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident set size in MiB (of this process, or of its largest worker with RUSAGE_CHILDREN)"""
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def load_chunk(path: str, source: str, start: int, end: int, resume_from: int,
+               batch_size: int = BATCH_SIZE) -> Dict[str, Any]:
+    """Load the documents starting in [resume_from, end) of one planned chunk, checkpointing each batch"""
+    documents = skipped = pending = 0
+    batch = {table: [] for table in TABLES}
+    position = resume_from
+    with connect() as conn:
+        loader = CopyLoader(conn)
+        for _, next_offset, document in iter_documents(path, resume_from, end):
+            documents += 1
+            pending += 1
+            position = next_offset
+            try:
+                rows = map_document(document)
+            except Exception as e:
+                logger.warning(f"Skipping document {document.get('_id')}: {e}")
+                rows = None
+            if rows is None:
+                skipped += 1
+            else:
+                for table in TABLES:
+                    batch[table].extend(rows[table])
+
+            if pending >= batch_size:
+                loader.load(batch, (source, start, position, pending, False))
+                batch, pending = {table: [] for table in TABLES}, 0
+        loader.load(batch, (source, start, end, pending, True))
+    logger.info(f"Chunk {start}-{end} loaded: {documents} documents")
+    return {"documents": documents, "skipped": skipped, "rows": loader.rows}
+
+
+def _load_chunk(args: tuple) -> Dict[str, Any]:
+    return load_chunk(*args)
+
+
+def ingest(path: str, workers: int = 1, chunks: Optional[int] = None, batch_size: int = BATCH_SIZE,
+           restart: bool = False) -> Dict[str, Any]:
+    """
+    Load `path` with `workers` processes, resuming from ingest_checkpoints unless `restart`;
+    returns row counts, throughput and peak RSS.
+    """
+    started = time.perf_counter()
+    source = source_key(path)
+    with connect() as conn:
+        ensure_checkpoints(conn)
+        if restart:
+            conn.execute("DELETE FROM ingest_checkpoints WHERE source = %s", (source,))
+        plan = conn.execute(
+            "SELECT start_offset, end_offset, next_offset FROM ingest_checkpoints"
+            " WHERE source = %s AND NOT done ORDER BY start_offset", (source,)
+        ).fetchall()
+        planned = conn.execute("SELECT count(*) FROM ingest_checkpoints WHERE source = %s", (source,)).fetchone()[0]
+        if not planned:
+            ranges = plan_chunks(path, chunks or workers * CHUNKS_PER_WORKER)
+            with conn.cursor() as cursor:
+                cursor.executemany(
+                    "INSERT INTO ingest_checkpoints (source, start_offset, end_offset, next_offset)"
+                    " VALUES (%s, %s, %s, %s)",
+                    [(source, start, end, start) for start, end in ranges],
+                )
+            plan = [(start, end, start) for start, end in ranges]
+            logger.info(f"Planned {len(plan)} chunks for {source}")
+        else:
+            logger.info(f"Resuming {source}: {len(plan)} of {planned} chunks left")
+        conn.commit()
+
+    tasks = [(path, source, start, end, resume_from, batch_size) for start, end, resume_from in plan]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_load_chunk, tasks))
+    else:
+        results = [_load_chunk(task) for task in tasks]
+
+    elapsed = time.perf_counter() - started
+    rows = {table: sum(result["rows"][table] for result in results) for table in TABLES}
+    documents = sum(result["documents"] for result in results)
+    return {
+        "source": source,
+        "chunks": len(tasks),
+        "workers": workers,
+        "documents": documents,
+        "skipped": sum(result["skipped"] for result in results),
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(sum(rows.values()) / elapsed) if elapsed else None,
+        "documents_per_second": round(documents / elapsed) if elapsed else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "worker_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1) if workers > 1 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="document export (JSON array or newline-delimited)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="loader processes")
+    parser.add_argument("--chunks", type=int, help=f"byte ranges to split the file into (default workers x "
+                                                   f"{CHUNKS_PER_WORKER})")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="documents per transaction")
+    parser.add_argument("--restart", action="store_true", help="ignore this file's checkpoints and start over")
+    parser.add_argument("--truncate", action="store_true",
+                        help="empty the invoice tables and all checkpoints first (CASCADE: also rows referencing them)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    if args.truncate:
+        with connect() as conn:
+            ensure_checkpoints(conn)
+            conn.execute(f"TRUNCATE {', '.join(reversed(TABLES))}, ingest_checkpoints CASCADE")
+    report = ingest(args.path, args.workers, args.chunks, args.batch_size, args.restart)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
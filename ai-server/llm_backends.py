@@ -0,0 +1,315 @@
+"""
+Pluggable LLM backends for SQL generation.
+
+A backend turns a (system prompt, user prompt) pair into a completion dict with
+the generated text and its token usage. The remote Groq backend answers one
+prompt per API call. The local backend runs an ONNX export of a text-to-SQL
+model on this machine's CPU and completes a whole batch of prompts in one
+padded forward pass; micro_batcher.MicroBatcher feeds it concurrent questions.
+
+Select the backend with LLM_BACKEND=groq|local.
+"""
+
+import abc
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_backends: Dict[str, "LLMBackend"] = {}
+_backends_lock = threading.Lock()
+
+
+class BackendUnavailable(Exception):
+    """The backend is not configured or its dependencies are not installed"""
+
+
+def _completion(text: str, prompt_tokens: int, completion_tokens: int, started: float) -> Dict[str, Any]:
+    return {
+        "text": text,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "latency": time.perf_counter() - started,
+    }
+
+
+class LLMBackend(abc.ABC):
+    """Interface shared by all backends; subclasses implement complete()"""
+
+    name = "base"
+    supports_batching = False
+    supports_streaming = False
+
+    def is_configured(self) -> bool:
+        return False
+
+    def warm_up(self):
+        """Import the SDK and build the client (or load the model) ahead of the first request"""
+
+    def ping(self, timeout: float = 2.0):
+        """Cheapest call that shows the backend can serve; raises when it cannot"""
+        if not self.is_configured():
+            raise BackendUnavailable(f"{self.name} backend not configured")
+
+    @abc.abstractmethod
+    def complete(self, system: str, prompt: str, max_tokens: int = 500,
+                 temperature: float = 0.1) -> Dict[str, Any]:
+        """{"text", "prompt_tokens", "completion_tokens", "latency"} for one prompt"""
+
+    def complete_batch(self, prompts: List[Dict[str, str]], max_tokens: int = 500,
+                       temperature: float = 0.1) -> List[Dict[str, Any]]:
+        """Complete several {"system", "prompt"} pairs; one call each unless overridden"""
+        return [self.complete(p["system"], p["prompt"], max_tokens, temperature) for p in prompts]
+
+    def stream(self, system: str, prompt: str, max_tokens: int = 500,
+               temperature: float = 0.1) -> Iterator[str]:
+        """Yield the completion text as it is generated; closing the iterator cancels it"""
+        yield self.complete(system, prompt, max_tokens, temperature)["text"]
+
+
+class GroqBackend(LLMBackend):
+    """Groq chat completions API"""
+
+    name = "groq"
+    supports_streaming = True
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None):
+        self.api_key = api_key or os.getenv("GROQ_API_KEY")
+        self.model = model or os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile")
+        self._client = None
+
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def client(self):
+        if self._client is None:
+            if not self.api_key:
+                raise BackendUnavailable("Groq API not configured")
+            try:
+                from groq import Groq
+            except ImportError:
+                raise BackendUnavailable("Groq package not available. Install with: pip install groq")
+            self._client = Groq(api_key=self.api_key)
+        return self._client
+
+    def warm_up(self):
+        if self.is_configured():
+            self.client
+
+    def ping(self, timeout: float = 2.0):
+        # Listing models checks reachability and the key without spending tokens;
+        # no retries, the monitor runs again soon enough
+        self.client.with_options(max_retries=0, timeout=timeout).models.list()
+
+    def complete(self, system: str, prompt: str, max_tokens: int = 500,
+                 temperature: float = 0.1) -> Dict[str, Any]:
+        started = time.perf_counter()
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        usage = getattr(response, "usage", None)
+        return _completion(
+            response.choices[0].message.content,
+            getattr(usage, "prompt_tokens", 0) or 0,
+            getattr(usage, "completion_tokens", 0) or 0,
+            started,
+        )
+
+    def stream(self, system: str, prompt: str, max_tokens: int = 500,
+               temperature: float = 0.1) -> Iterator[str]:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True
+        )
+        try:
+            for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            # Dropping the connection tells Groq to stop generating
+            http_response = getattr(response, "response", None)
+            if http_response is not None:
+                http_response.close()
+
+
+class VannaBackend(LLMBackend):
+    """Vanna's hosted text-to-SQL model; it builds its own prompt, so `system` is ignored"""
+
+    name = "vanna"
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None):
+        self.api_key = api_key or os.getenv("VANNA_API_KEY")
+        self.model = model or os.getenv("VANNA_MODEL", "flowbitai_analytics")
+        self._client = None
+
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def client(self):
+        if self._client is None:
+            if not self.api_key:
+                raise BackendUnavailable("VANNA_API_KEY not configured")
+            try:
+                from vanna.remote import VannaDefault
+            except ImportError:
+                raise BackendUnavailable("Vanna package not available. Install with: pip install vanna")
+            self._client = VannaDefault(model=self.model, api_key=self.api_key)
+        return self._client
+
+    def warm_up(self):
+        if self.is_configured():
+            self.client
+
+    def ping(self, timeout: float = 2.0):
+        # Vanna has no free endpoint; a built client is as far as a probe should go
+        self.client
+
+    def complete(self, system: str, prompt: str, max_tokens: int = 500,
+                 temperature: float = 0.1) -> Dict[str, Any]:
+        started = time.perf_counter()
+        return _completion(self.client.generate_sql(prompt), 0, 0, started)
+
+
+class OnnxBackend(LLMBackend):
+    """
+    Local causal LM exported to ONNX, run with onnxruntime on CPU.
+
+    LOCAL_LLM_MODEL is a directory (or hub id) holding the ONNX export and its
+    tokenizer, e.g. the output of `optimum-cli export onnx --model <model> <dir>`.
+    """
+
+    name = "local"
+    supports_batching = True
+
+    def __init__(self, model: Optional[str] = None, threads: Optional[int] = None):
+        self.model_path = model or os.getenv("LOCAL_LLM_MODEL")
+        self.threads = threads or int(os.getenv("LOCAL_LLM_THREADS", 0))
+        self._model = None
+        self._tokenizer = None
+        self._load_lock = threading.Lock()
+        # One forward pass at a time; the CPU is already saturated by a single one
+        self._model_lock = threading.Lock()
+
+    def is_configured(self) -> bool:
+        return bool(self.model_path)
+
+    def _load(self):
+        with self._load_lock:
+            if self._model is not None:
+                return
+            if not self.model_path:
+                raise BackendUnavailable("LOCAL_LLM_MODEL is not set")
+            try:
+                import onnxruntime
+                from optimum.onnxruntime import ORTModelForCausalLM
+                from transformers import AutoTokenizer
+            except ImportError:
+                raise BackendUnavailable(
+                    "Local backend needs onnxruntime, optimum and transformers. "
+                    "Install with: pip install optimum[onnxruntime] transformers"
+                )
+
+            options = onnxruntime.SessionOptions()
+            if self.threads:
+                options.intra_op_num_threads = self.threads
+            logger.info(f"Loading local ONNX model from {self.model_path}")
+            tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+            # Left padding keeps every prompt's last token aligned for batched generation
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            self._model = ORTModelForCausalLM.from_pretrained(
+                self.model_path, provider="CPUExecutionProvider", session_options=options
+            )
+            self._tokenizer = tokenizer
+
+    def warm_up(self):
+        if self.is_configured():
+            self._load()
+
+    def ping(self, timeout: float = 2.0):
+        # Loading is the warm-up's job; a probe only looks
+        if self._model is None:
+            raise BackendUnavailable("Local model not loaded yet")
+
+    def _render(self, system: str, prompt: str) -> str:
+        if getattr(self._tokenizer, "chat_template", None):
+            messages = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+            return self._tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return f"{system}\n\n{prompt}\n"
+
+    def complete(self, system: str, prompt: str, max_tokens: int = 500,
+                 temperature: float = 0.1) -> Dict[str, Any]:
+        return self.complete_batch([{"system": system, "prompt": prompt}], max_tokens, temperature)[0]
+
+    def complete_batch(self, prompts: List[Dict[str, str]], max_tokens: int = 500,
+                       temperature: float = 0.1) -> List[Dict[str, Any]]:
+        """Generate completions for all prompts in one padded forward pass"""
+        self._load()
+        started = time.perf_counter()
+        texts = [self._render(p["system"], p["prompt"]) for p in prompts]
+        inputs = self._tokenizer(texts, return_tensors="pt", padding=True)
+        sampling = {"do_sample": True, "temperature": temperature} if temperature > 0 else {"do_sample": False}
+        with self._model_lock:
+            output = self._model.generate(
+                **inputs, max_new_tokens=max_tokens, pad_token_id=self._tokenizer.pad_token_id, **sampling
+            )
+
+        prompt_length = inputs["input_ids"].shape[1]
+        prompt_tokens = inputs["attention_mask"].sum(dim=1).tolist()
+        pad_id = self._tokenizer.pad_token_id
+        completions = []
+        for row, used in zip(output, prompt_tokens):
+            generated = row[prompt_length:]
+            completions.append(_completion(
+                self._tokenizer.decode(generated, skip_special_tokens=True),
+                int(used),
+                int((generated != pad_id).sum()),
+                started,
+            ))
+        logger.info(f"Local model completed a batch of {len(prompts)} in {time.perf_counter() - started:.2f}s")
+        return completions
+
+
+BACKENDS = {
+    GroqBackend.name: GroqBackend,
+    VannaBackend.name: VannaBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def get_backend(spec: Optional[str] = None) -> LLMBackend:
+    """
+    Shared backend instance for a spec such as "groq", "groq:llama-3.1-8b-instant"
+    or "local:/models/text2sql" (defaults to the LLM_BACKEND setting).
+    """
+    spec = (spec or os.getenv("LLM_BACKEND", "groq")).strip()
+    with _backends_lock:
+        backend = _backends.get(spec)
+        if backend is None:
+            kind, _, model = spec.partition(":")
+            if kind not in BACKENDS:
+                raise BackendUnavailable(f"Unknown LLM backend '{kind}', expected one of: {', '.join(BACKENDS)}")
+            backend = BACKENDS[kind](model=model or None)
+            if model:
+                backend.name = spec
+            _backends[spec] = backend
+        return backend
@@ -0,0 +1,282 @@
+"""
+Latency-aware routing over several LLM backends.
+
+LLM_ROUTER_BACKENDS lists the backends to route over, in order of preference,
+e.g. "groq:llama-3.1-70b-versatile,groq:llama-3.1-8b-instant,vanna,local".
+For every backend the router keeps an EWMA of latency and error rate plus a
+window of recent latencies, and sends each request to the best-scoring one.
+
+If that request is still running after the backend's p95 latency, a hedged
+copy goes to the next-best backend; whichever answers first wins and the other
+is cancelled (streams are closed, queued calls dropped). A backend that fails
+LLM_BREAKER_FAILURES times in a row is taken out of rotation for
+LLM_BREAKER_COOLDOWN seconds, then gets a single trial request before it is
+trusted again.
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from llm_backends import BackendUnavailable, LLMBackend, get_backend
+from micro_batcher import batched
+from rate_limiter import RateLimited, rate_limited
+from sql_stream import StreamCancelled, stream_sql
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", 0.2))
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_MS", 2000)) / 1000
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_MS", 200)) / 1000
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+LATENCY_WINDOW = 200
+# Latency samples needed before a backend's own p95 replaces the default hedge delay
+MIN_P95_SAMPLES = 20
+
+
+class _BackendState:
+    def __init__(self, backend: LLMBackend):
+        self.backend = backend
+        self.name = backend.name
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def breaker_state(self, now: float) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if now - self.opened_at >= BREAKER_COOLDOWN else "open"
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < MIN_P95_SAMPLES:
+            return None
+        return float(np.percentile(self.latencies, 95))
+
+    def score(self) -> float:
+        # Untried backends score 0 so each one gets measured early on
+        if self.ewma_latency is None:
+            return 0.0
+        return self.ewma_latency / max(1.0 - self.ewma_error, 0.05)
+
+
+class LLMRouter:
+    """Routes completions to the fastest healthy backend, hedging slow requests"""
+
+    name = "router"
+    supports_batching = False
+    supports_streaming = False
+
+    def __init__(self, backends: List[LLMBackend], workers: Optional[int] = None):
+        self.states = [_BackendState(backend) for backend in backends]
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv("LLM_ROUTER_WORKERS", 16)), thread_name_prefix="llm-route"
+        )
+
+    def is_configured(self) -> bool:
+        return any(state.backend.is_configured() for state in self.states)
+
+    def warm_up(self):
+        # One backend that cannot start must not keep the others cold
+        for state in self.states:
+            try:
+                state.backend.warm_up()
+            except Exception as e:
+                logger.warning(f"Warm-up of LLM backend '{state.name}' failed: {e}")
+
+    def ping(self, timeout: float = 2.0):
+        # Healthy while any backend can serve; the breakers route around the others
+        errors = []
+        for state in self.states:
+            try:
+                state.backend.ping(timeout)
+                return
+            except Exception as e:
+                errors.append(f"{state.name}: {e}")
+        raise BackendUnavailable("; ".join(errors))
+
+    def _candidates(self) -> List[_BackendState]:
+        now = time.monotonic()
+        with self._lock:
+            usable = []
+            for state in self.states:
+                if not state.backend.is_configured():
+                    continue
+                breaker = state.breaker_state(now)
+                if breaker == "open" or (breaker == "half_open" and state.trial_in_flight):
+                    continue
+                usable.append(state)
+            return sorted(usable, key=_BackendState.score)
+
+    def _hedge_delay(self, state: _BackendState) -> float:
+        p95 = state.p95()
+        return HEDGE_DEFAULT_DELAY if p95 is None else max(p95, HEDGE_MIN_DELAY)
+
+    def _record_latency(self, state: _BackendState, latency: float):
+        state.latencies.append(latency)
+        if state.ewma_latency is None:
+            state.ewma_latency = latency
+        else:
+            state.ewma_latency += EWMA_ALPHA * (latency - state.ewma_latency)
+
+    def _record_success(self, state: _BackendState, latency: float):
+        with self._lock:
+            self._record_latency(state, latency)
+            state.ewma_error *= 1 - EWMA_ALPHA
+            state.consecutive_failures = 0
+            state.opened_at = None
+            state.trial_in_flight = False
+
+    def _record_failure(self, state: _BackendState):
+        with self._lock:
+            state.errors += 1
+            state.ewma_error += EWMA_ALPHA * (1 - state.ewma_error)
+            state.consecutive_failures += 1
+            # A failed trial re-opens the breaker straight away
+            if state.trial_in_flight or state.consecutive_failures >= BREAKER_FAILURES:
+                if state.opened_at is None or state.trial_in_flight:
+                    logger.warning(f"Circuit opened for LLM backend '{state.name}'")
+                state.opened_at = time.monotonic()
+            state.trial_in_flight = False
+
+    def _record_shed(self, state: _BackendState):
+        # Our own admission control said no: the backend itself may be perfectly healthy
+        with self._lock:
+            state.trial_in_flight = False
+
+    def _record_abandoned(self, state: _BackendState, elapsed: float):
+        # The loser of a hedge took at least this long; that is still useful signal
+        with self._lock:
+            self._record_latency(state, elapsed)
+            state.trial_in_flight = False
+
+    def _call(self, state: _BackendState, system: str, prompt: str, max_tokens: int, temperature: float,
+              cancel: threading.Event) -> Dict[str, Any]:
+        if cancel.is_set():
+            raise StreamCancelled("Cancelled before it started")
+        backend = state.backend
+        if backend.supports_streaming:
+            return stream_sql(backend, system, prompt, max_tokens, temperature, cancel=cancel)
+        return backend.complete(system, prompt, max_tokens, temperature)
+
+    def complete(self, system: str, prompt: str, max_tokens: int = 500,
+                 temperature: float = 0.1) -> Dict[str, Any]:
+        candidates = self._candidates()
+        if not candidates:
+            raise BackendUnavailable("No LLM backend available (not configured or circuit open)")
+
+        attempts = {}
+        errors = []
+        shed: List[float] = []
+
+        def launch(state: _BackendState):
+            cancel = threading.Event()
+            with self._lock:
+                state.requests += 1
+                if state.opened_at is not None:
+                    state.trial_in_flight = True
+            future = self._executor.submit(contextvars.copy_context().run, self._call,
+                                           state, system, prompt, max_tokens, temperature, cancel)
+            attempts[future] = (state, cancel, time.perf_counter())
+
+        primary = candidates.pop(0)
+        launch(primary)
+        primary_started = time.perf_counter()
+        hedged = False
+        backup = None
+        while attempts:
+            timeout = None
+            if not hedged and candidates:
+                timeout = max(0.0, self._hedge_delay(primary) - (time.perf_counter() - primary_started))
+            done, _ = wait(list(attempts), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # The primary is past its p95 budget: race a copy on the next-best backend
+                hedged = True
+                backup = candidates.pop(0)
+                with self._lock:
+                    backup.hedges += 1
+                logger.info(f"Hedging '{primary.name}' with '{backup.name}'")
+                launch(backup)
+                continue
+
+            for future in done:
+                state, _, started = attempts.pop(future)
+                try:
+                    result = future.result()
+                except StreamCancelled:
+                    # Abandoned on purpose: neither a result nor a failure of the backend
+                    continue
+                except Exception as e:
+                    if isinstance(e, RateLimited):
+                        # Shed locally: try the next backend, but keep this one's breaker closed
+                        self._record_shed(state)
+                        shed.append(e.retry_after)
+                    else:
+                        self._record_failure(state)
+                    errors.append(f"{state.name}: {e}")
+                    logger.warning(f"LLM backend '{state.name}' failed: {e}")
+                    if not attempts and candidates:
+                        # Fail over right away instead of waiting for a hedge
+                        hedged = True
+                        launch(candidates.pop(0))
+                    continue
+
+                self._record_success(state, time.perf_counter() - started)
+                for loser, (loser_state, loser_cancel, loser_started) in attempts.items():
+                    loser_cancel.set()
+                    loser.cancel()
+                    self._record_abandoned(loser_state, time.perf_counter() - loser_started)
+                if state is backup:
+                    with self._lock:
+                        state.hedges_won += 1
+                result["backend"] = state.name
+                return result
+
+        if shed and len(shed) == len(errors):
+            raise RateLimited("All LLM backends are at their rate limit: " + "; ".join(errors), min(shed))
+        raise BackendUnavailable("All LLM backends failed: " + "; ".join(errors))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Per-backend routing state for /metrics"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                state.name: {
+                    "circuit": state.breaker_state(now),
+                    "ewma_latency": round(state.ewma_latency, 4) if state.ewma_latency is not None else None,
+                    "ewma_error_rate": round(state.ewma_error, 4),
+                    "p95_latency": round(state.p95(), 4) if state.p95() is not None else None,
+                    "hedge_delay": round(self._hedge_delay(state), 4),
+                    "requests": state.requests,
+                    "errors": state.errors,
+                    "hedges": state.hedges,
+                    "hedges_won": state.hedges_won,
+                }
+                for state in self.states
+            }
+
+
+def build_llm_client():
+    """
+    The router when LLM_ROUTER_BACKENDS lists several backends, else the single
+    LLM_BACKEND; providers with RPM/TPM limits get admission control.
+    """
+    specs = [spec.strip() for spec in os.getenv("LLM_ROUTER_BACKENDS", "").split(",") if spec.strip()]
+    clients = [batched(rate_limited(get_backend(spec))) for spec in specs or [None]]
+    return LLMRouter(clients) if len(clients) > 1 else clients[0]
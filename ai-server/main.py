@@ -1,21 +1,33 @@
 import os
 import logging
 import traceback
-from typing import Dict, List, Any
+from typing import Dict, List
 from datetime import datetime
 
-import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import psycopg
 from dotenv import load_dotenv
 
-try:
-    from groq import Groq
-    GROQ_AVAILABLE = True
-except ImportError:
-    GROQ_AVAILABLE = False
-    print("Groq package not available. Install with: pip install groq")
+import analytics_replica
+import change_feed
+import database
+import data_version
+import health_monitor
+from conversations import ConversationStore, follow_up_prompt, is_follow_up, session_id_from
+from http_cache import ResultCache, add_compression, conditional_json, make_etag
+import metrics
+import rate_limiter
+import sargable
+import tenancy
+from llm_router import LLMRouter, build_llm_client
+from pagination import check_secret, clamp_page_size, decode_page_token
+from query_plans import plan_cache_stats
+from readiness import liveness, readiness, warm_up
+from result_stream import collect_result
+from sql_refine import refine_sql
+from sql_stream import clean_sql, stream_sql
+from sql_templates import match_template, render_sql
+from stage_executor import ClientDisconnected, run_stage, shutdown_executor
 
 # Load environment variables
 load_dotenv()
@@ -39,17 +51,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# gzip (or brotli) for large responses
+add_compression(app)
+tenancy.add_tenant_middleware(app)
+
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL")
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile")
+SQL_GENERATION_TIMEOUT = float(os.getenv("SQL_GENERATION_TIMEOUT", 60))
+SQL_EXECUTION_TIMEOUT = float(os.getenv("SQL_EXECUTION_TIMEOUT", 60))
+
+# LLM used for SQL generation (Groq by default, see llm_backends.py); batching
+# backends get micro-batches, several LLM_ROUTER_BACKENDS get a latency-aware router.
+# Its SDK client (or local model) is only built on first use or by the startup warm-up
+llm_backend = build_llm_client()
+
+# Probes are answered from these background checks (see health_monitor.py)
+health_monitor.register("database", health_monitor.check_database)
+health_monitor.register("llm_backend", lambda: llm_backend.ping(health_monitor.HEALTH_CHECK_TIMEOUT),
+                        interval=health_monitor.HEALTH_LLM_CHECK_INTERVAL)
+
+# Recent turns per session, for follow-up questions
+conversations = ConversationStore()
 
-# Initialize Groq client
-groq_client = None
-if GROQ_API_KEY:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+# /chat payloads that do not depend on the conversation, valid while the data version holds
+chat_cache = ResultCache(max_size=int(os.getenv("CHAT_CACHE_SIZE", 256)),
+                         ttl=float(os.getenv("CHAT_CACHE_TTL", 600)))
 
 # Type definitions for request/response (no Pydantic needed)
 def validate_chat_request(data: dict) -> dict:
@@ -58,21 +87,36 @@ def validate_chat_request(data: dict) -> dict:
         raise ValueError("Request must be a JSON object")
     if "question" not in data or not isinstance(data["question"], str):
         raise ValueError("Missing or invalid 'question' field")
+    page_token = data.get("page_token")
+    if page_token is not None and not isinstance(page_token, str):
+        raise ValueError("Invalid 'page_token' field")
+    context = data.get("context") or {}
+    if not isinstance(context, dict):
+        raise ValueError("'context' must be an object")
+    view = data.get("view", "auto")
+    if view not in ("auto", "table", "chart"):
+        raise ValueError("'view' must be one of: auto, table, chart")
     return {
         "question": data["question"].strip(),
-        "context": data.get("context", {})
+        "context": context,
+        "page_size": clamp_page_size(data.get("page_size")),
+        "page_token": page_token,
+        "view": view
     }
 
 def create_chat_response(question: str, sql: str = None, data: List[Dict] = None, 
-                        chart_config: Dict = None, error: str = None, explanation: str = None) -> dict:
+                        chart_config: Dict = None, error: str = None, explanation: str = None,
+                        page: Dict = None, session_id: str = None) -> dict:
     """Create chat response dictionary"""
     return {
         "question": question,
+        "session_id": session_id,
         "sql": sql,
         "data": data,
         "chart_config": chart_config,
         "error": error,
-        "explanation": explanation
+        "explanation": explanation,
+        "page": page
     }
 
 class DatabaseSchema:
@@ -139,57 +183,11 @@ class DatabaseSchema:
         - Monthly trends: GROUP BY EXTRACT(YEAR FROM issue_date), EXTRACT(MONTH FROM issue_date)
         """
 
-def get_db_connection():
-    """Create database connection using psycopg3"""
-    try:
-        if not DATABASE_URL:
-            raise ValueError("DATABASE_URL not configured")
-        
-        # Convert from postgres:// to postgresql:// if needed
-        db_url = DATABASE_URL.replace("postgresql+psycopg://", "postgresql://")
-        
-        conn = psycopg.connect(db_url)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        raise HTTPException(status_code=500, detail="Database connection failed")
-
-def execute_sql_query(sql: str) -> List[Dict[str, Any]]:
-    """Execute SQL query and return results"""
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Execute query
-        if sql.strip().upper().startswith('SELECT'):
-            cursor.execute(sql)
-            results = cursor.fetchall()
-            # Get column names
-            columns = [desc[0] for desc in cursor.description]
-            # Convert to list of dictionaries
-            return [dict(zip(columns, row)) for row in results]
-        else:
-            cursor.execute(sql)
-            conn.commit()
-            return [{"message": "Query executed successfully"}]
-            
-    except Exception as e:
-        logger.error(f"SQL execution error: {e}")
-        raise Exception(f"SQL execution failed: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
-
-def generate_sql_with_groq(question: str) -> str:
-    """Generate SQL using Groq LLM"""
-    try:
-        if not groq_client:
-            raise Exception("Groq API not configured")
-        
-        schema_info = DatabaseSchema.get_schema_info()
-        
-        system_prompt = f"""
+def sql_system_prompt() -> str:
+    """System prompt shared by every SQL generation request"""
+    schema_info = DatabaseSchema.get_schema_info()
+    
+    return f"""
         You are an expert SQL analyst for a financial analytics database. 
         Generate ONLY valid PostgreSQL SQL queries based on the user's question.
         
@@ -202,6 +200,7 @@ def generate_sql_with_groq(question: str) -> str:
         4. ALWAYS use double quotes around camelCase column names
         5. For aggregations, include proper GROUP BY clauses
         6. Use LIMIT clauses for large result sets (default LIMIT 100)
+        7. Filter dates with ranges on the bare column ("issueDate" >= '2024-01-01' AND "issueDate" < '2025-01-01'), not EXTRACT on it
         
         CORRECT COLUMN EXAMPLES:
         - "totalAmount" NOT total_amount
@@ -213,61 +212,33 @@ def generate_sql_with_groq(question: str) -> str:
         - "spending by category" → SELECT category, SUM("totalAmount") as total_spend FROM invoices WHERE status = 'PAID' GROUP BY category ORDER BY total_spend DESC
         - "top vendors" → SELECT v.name, SUM(i."totalAmount") as total_spend FROM vendors v JOIN invoices i ON v.id = i."vendorId" WHERE i.status = 'PAID' GROUP BY v.id, v.name ORDER BY total_spend DESC LIMIT 5
         """
+
+def generate_sql_with_groq(question: str, previous: Dict = None) -> str:
+    """
+    Generate SQL with the configured LLM backend (Groq unless LLM_BACKEND says otherwise).
+    For a follow-up, `previous` is the last turn and only its SQL plus the change is sent.
+    """
+    try:
+        if not llm_backend.is_configured():
+            raise Exception(f"LLM backend '{llm_backend.name}' not configured")
         
-        response = groq_client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": question}
-            ],
-            max_tokens=500,
-            temperature=0.1
-        )
-        
-        sql = response.choices[0].message.content.strip()
+        system_prompt = sql_system_prompt()
+        prompt = follow_up_prompt(previous, question) if previous else question
+        if llm_backend.supports_streaming:
+            # Stop reading (and paying for) tokens as soon as the statement is complete
+            completion = stream_sql(llm_backend, system_prompt, prompt, max_tokens=500, temperature=0.1)
+        else:
+            completion = llm_backend.complete(system_prompt, prompt, max_tokens=500, temperature=0.1)
         
-        # Clean up the SQL (remove markdown if present)
-        if sql.startswith("```sql"):
-            sql = sql.replace("```sql", "").replace("```", "").strip()
-        elif sql.startswith("```"):
-            sql = sql.replace("```", "").strip()
+        # Strip markdown fences and any chatter around the statement
+        sql = clean_sql(completion["text"])
         
         return sql
         
     except Exception as e:
-        logger.error(f"Groq SQL generation error: {e}")
+        logger.error(f"{llm_backend.name} SQL generation error: {e}")
         raise Exception(f"Failed to generate SQL: {str(e)}")
 
-def generate_chart_config(question: str, data: List[Dict]) -> Dict:
-    """Generate chart configuration based on question and data"""
-    if not data:
-        return {}
-    
-    # Determine chart type based on question keywords and data structure
-    question_lower = question.lower()
-    columns = list(data[0].keys()) if data else []
-    
-    chart_config = {
-        "type": "table",  # default
-        "data": data,
-        "title": question
-    }
-    
-    # Detect chart types based on keywords and data structure
-    if any(word in question_lower for word in ['trend', 'over time', 'monthly', 'yearly']):
-        chart_config["type"] = "line"
-    elif any(word in question_lower for word in ['top', 'best', 'highest', 'vendors', 'categories']):
-        chart_config["type"] = "bar"
-    elif any(word in question_lower for word in ['distribution', 'breakdown', 'percentage']):
-        chart_config["type"] = "pie"
-    
-    # Set axes based on column names
-    if len(columns) >= 2:
-        chart_config["x_axis"] = columns[0]
-        chart_config["y_axis"] = columns[1]
-    
-    return chart_config
-
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -276,12 +247,13 @@ async def root():
         "version": "1.0.0",
         "status": "running",
         "timestamp": datetime.now().isoformat(),
-        "groq_configured": groq_client is not None,
+        "llm_backend": llm_backend.name,
+        "groq_configured": llm_backend.name == "groq" and llm_backend.is_configured(),
         "database_configured": DATABASE_URL is not None
     }
 
 @app.post("/chat")
-async def chat_with_data(request: dict) -> dict:
+async def chat_with_data(request: dict, http_request: Request):
     """Process natural language questions and return SQL + data"""
     try:
         # Validate request
@@ -292,31 +264,93 @@ async def chat_with_data(request: dict) -> dict:
             raise HTTPException(status_code=400, detail="Question cannot be empty")
         
         logger.info(f"Processing question: {question}")
+        session_id = session_id_from(validated_request["context"])
+        # Conversation state and cached results are kept apart per organization
+        conversation_key = tenancy.partition_key(session_id)
+        new_turn = False
+        previous = None
+        if not validated_request["page_token"]:
+            previous = conversations.last_turn(conversation_key)
+            if previous and not is_follow_up(question):
+                previous = None
+        
+        # Answers that do not depend on the conversation are cached until a table they read
+        # changes; a client sending the matching If-None-Match gets a 304 and no body
+        cache_key = None if previous else tenancy.partition_key(
+            (question, validated_request["page_size"], validated_request["page_token"], validated_request["view"]))
+        # Validating an entry may read the data version from Postgres, so it runs off the event loop
+        cached = await run_stage("check_cache", chat_cache.get, cache_key,
+                                 timeout=SQL_EXECUTION_TIMEOUT) if cache_key else None
+        if cached:
+            logger.info(f"Serving cached result for data version {cached['version']}")
+            if not validated_request["page_token"]:
+                conversations.add_turn(conversation_key, question, cached["payload"]["sql"])
+            return conditional_json(http_request, {**cached["payload"], "session_id": session_id}, cached["etag"])
         
-        # Generate SQL query
-        sql = generate_sql_with_groq(question)
-        logger.info(f"Generated SQL: {sql}")
+        if validated_request["page_token"]:
+            # Later pages re-run the SQL that produced the first one; no LLM involved
+            token = decode_page_token(validated_request["page_token"])
+            sql, params, offset = token["sql"], token["params"] or None, token["offset"]
+            view = "table"
+        else:
+            offset, view = 0, validated_request["view"]
+            new_turn = True
+            # Known question shapes skip the LLM entirely
+            template = match_template(question) if not previous else None
+            # Simple follow-ups are applied to the previous SQL's AST locally
+            refined = refine_sql(previous["sql"], question) if previous else None
+            if template:
+                sql, params = template["sql"], template["params"]
+                logger.info(f"Matched template '{template['intent']}' with params {params}")
+            elif refined:
+                sql, params = refined, None
+                logger.info(f"Refined previous SQL locally: {sql}")
+            else:
+                # Generate SQL query off the event loop so concurrent questions can share a batch;
+                # follow-ups send only the previous SQL and the requested change
+                sql = await run_stage("generate_sql", generate_sql_with_groq, question, previous,
+                                      timeout=SQL_GENERATION_TIMEOUT)
+                params = None
+                logger.info(f"Generated SQL{' (follow-up)' if previous else ''}: {sql}")
         
-        # Execute SQL query
-        data = execute_sql_query(sql)
-        logger.info(f"Query returned {len(data)} rows")
+        # Version the tables before reading them, so a concurrent write invalidates the entry
+        tables = data_version.referenced_tables(sql) if cache_key else None
+        version = await run_stage("data_version", data_version.current, tables,
+                                  timeout=SQL_EXECUTION_TIMEOUT) if cache_key else None
         
-        # Generate chart configuration
-        chart_config = generate_chart_config(question, data)
+        # Stream the result (one page of rows plus a bounded, chart-ready summary) off the event loop
+        result = await run_stage("run_sql", collect_result, question, sql, params, validated_request["page_size"],
+                                 offset, view, timeout=SQL_EXECUTION_TIMEOUT, request=http_request)
+        data, page = result["data"], result["page"]
+        # A read replica may not have the writes counted in `version` yet, so its results are not cached
+        if result["from_replica"]:
+            version = None
+        total_rows = page["total_rows"] if page["total_rows"] is not None else len(data)
+        logger.info(f"Query returned {total_rows} rows ({len(data)} in this page)")
+        
+        if new_turn:
+            conversations.add_turn(conversation_key, question, render_sql(sql, params))
         
         # Generate explanation
-        explanation = f"Generated SQL query based on your question about {question.lower()}. Found {len(data)} result(s)."
+        explanation = f"Generated SQL query based on your question about {question.lower()}. Found {total_rows} result(s)."
         
-        return create_chat_response(
+        response = create_chat_response(
             question=question,
-            sql=sql,
+            sql=render_sql(sql, params),
             data=data,
-            chart_config=chart_config,
-            explanation=explanation
+            chart_config=result["chart_config"],
+            explanation=explanation,
+            page=page,
+            session_id=session_id
         )
+        etag = chat_cache.set(cache_key, version, response, tables) if cache_key else None
+        return conditional_json(http_request, response, etag) if etag else response
         
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
+    except ClientDisconnected as e:
+        # Nobody is listening any more; skip the remaining stages
+        return create_chat_response(question=request.get("question", ""), error=f"Client disconnected during '{e}'")
     except Exception as e:
         logger.error(f"Chat processing error: {traceback.format_exc()}")
         return create_chat_response(
@@ -324,39 +358,74 @@ async def chat_with_data(request: dict) -> dict:
             error=str(e)
         )
 
+SCHEMA_TABLES = ["vendors", "customers", "invoices", "line_items", "payments", "documents", "analytics"]
+# The schema snapshot only changes with a deploy, so its hash is the version
+SCHEMA_ETAG = make_etag(DatabaseSchema.get_schema_info(), SCHEMA_TABLES)
+
 @app.get("/schema")
-async def get_schema():
-    """Get database schema information"""
-    return {
+async def get_schema(http_request: Request):
+    """Get database schema information (304 when If-None-Match is current)"""
+    return conditional_json(http_request, {
         "schema": DatabaseSchema.get_schema_info(),
-        "tables": ["vendors", "customers", "invoices", "line_items", "payments", "documents", "analytics"]
+        "tables": SCHEMA_TABLES
+    }, SCHEMA_ETAG)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Runtime metrics for query execution"""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "plan_cache": plan_cache_stats.snapshot(),
+        "chat_cache": chat_cache.stats(),
+        "change_feed": change_feed.feed.snapshot(),
+        "analytics_replica": analytics_replica.replica.snapshot(),
+        "data_sources": database.sources_snapshot(),
+        "sargable_rewrites": sargable.snapshot(),
+        "histograms": metrics.snapshot(),
+        "llm_router": llm_backend.snapshot() if isinstance(llm_backend, LLMRouter) else None,
+        "llm_admission": rate_limiter.snapshot(),
+        "warm_up": warm_up.snapshot()
     }
 
+@app.on_event("startup")
+async def startup_event():
+    """Warm up the LLM client and the pool, start health checks, follow table changes and load the DuckDB replica"""
+    # A placeholder PAGE_TOKEN_SECRET stops the server here
+    check_secret()
+    warm_up.run("llm_backend", llm_backend.warm_up)
+    warm_up.run("database", database.warm_up)
+    health_monitor.start()
+    change_feed.start()
+    analytics_replica.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled database connections, stage workers and the session store"""
+    health_monitor.stop()
+    analytics_replica.stop()
+    change_feed.stop()
+    database.close_pool()
+    shutdown_executor()
+    conversations.close()
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness probe: answers as soon as the worker is up"""
+    return liveness("FlowbitAI Vanna Analytics Server")
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the warm-up is done and the last database check passed"""
+    return readiness("FlowbitAI Vanna Analytics Server")
+
 @app.get("/health")
 async def health_check():
-    """Detailed health check"""
-    health_status = {
-        "service": "FlowbitAI Vanna Analytics Server",
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "checks": {
-            "groq_api": groq_client is not None,
-            "database": False
-        }
-    }
-    
-    # Test database connection
-    try:
-        conn = get_db_connection()
-        conn.close()
-        health_status["checks"]["database"] = True
-    except Exception as e:
-        health_status["checks"]["database"] = False
-        health_status["errors"] = {"database": str(e)}
-    
-    return health_status
+    """Detailed health check: the monitor's cached results, their age and recent latencies"""
+    return health_monitor.report("FlowbitAI Vanna Analytics Server")
 
 if __name__ == "__main__":
+    import uvicorn
+
     port = int(os.getenv("PORT", 8000))
     host = os.getenv("HOST", "0.0.0.0")
     
@@ -8,6 +8,8 @@ from dotenv import load_dotenv
 from typing import Optional, Dict, Any
 import asyncio
 
+import database
+
 # Load environment variables
 load_dotenv()
 
@@ -82,13 +84,7 @@ def init_services():
         )
         
         # Connect to PostgreSQL database
-        vanna_instance.connect_to_postgres(
-            host=database_url.split('@')[1].split(':')[0] if '@' in database_url else 'localhost',
-            dbname=database_url.split('/')[-1],
-            user=database_url.split('://')[1].split(':')[0] if '://' in database_url else 'postgres',
-            password=database_url.split('://')[1].split('@')[0].split(':')[1] if '://' in database_url else '',
-            port=int(database_url.split('@')[1].split(':')[1].split('/')[0]) if '@' in database_url else 5432
-        )
+        vanna_instance.connect_to_postgres(**database.parse_database_url(database_url))
         
         logger.info("Vanna instance initialized and connected to database")
         
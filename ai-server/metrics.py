@@ -0,0 +1,78 @@
+"""
+Lightweight in-process histograms for the /metrics endpoint.
+
+Histograms are registered by name and reported as cumulative bucket counts
+(Prometheus-style "le" buckets) plus count, sum and bucket-resolution
+percentiles, so the endpoint stays plain JSON with no client library.
+"""
+
+import bisect
+import threading
+from typing import Any, Dict, List, Sequence
+
+# Seconds; fits queue waits as well as whole LLM calls
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+
+_histograms: Dict[str, "Histogram"] = {}
+_registry_lock = threading.Lock()
+
+
+class Histogram:
+    """Fixed-bucket histogram, safe to observe from any thread"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets: List[float] = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def _percentile(self, counts: List[int], total: int, pct: float) -> float:
+        target = pct / 100 * total
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts, total, value_sum = list(self._counts), self.count, self.sum
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            cumulative[f"le_{bound:g}"] = running
+        cumulative["le_inf"] = total
+        return {
+            "count": total,
+            "sum": round(value_sum, 6),
+            "mean": round(value_sum / total, 6) if total else 0.0,
+            "p50": self._percentile(counts, total, 50) if total else None,
+            "p95": self._percentile(counts, total, 95) if total else None,
+            "buckets": cumulative,
+        }
+
+
+def histogram(name: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    """Get or create the histogram registered under `name`"""
+    with _registry_lock:
+        found = _histograms.get(name)
+        if found is None:
+            found = _histograms[name] = Histogram(buckets)
+        return found
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """All registered histograms, keyed by name"""
+    with _registry_lock:
+        registered = dict(_histograms)
+    return {name: h.snapshot() for name, h in sorted(registered.items())}
@@ -0,0 +1,127 @@
+"""
+Dynamic micro-batching of concurrent LLM completions.
+
+Each /chat question used to become its own completion call. MicroBatcher holds
+incoming prompts for a short window (LLM_BATCH_WINDOW_MS, measured from the
+oldest waiting prompt) or until LLM_MAX_BATCH_SIZE prompts with the same system
+prompt are waiting, then hands them to the backend's complete_batch() in one go.
+
+Prompts are grouped by system prompt (and generation settings), so every batch
+shares one byte-identical prefix. Backends with a prefix / KV cache only
+compute the long schema prompt once per batch.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+from llm_backends import LLMBackend
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    def __init__(self, key: Tuple, system: str, prompt: str):
+        self.key = key
+        self.system = system
+        self.prompt = prompt
+        self.enqueued = time.perf_counter()
+        self.event = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    """Collects concurrent complete() calls into batches for a batching backend"""
+
+    supports_batching = True
+    # A batch finishes together, so there is nothing to stream per prompt
+    supports_streaming = False
+
+    def __init__(self, backend: LLMBackend, window: Optional[float] = None, max_batch: Optional[int] = None):
+        self.backend = backend
+        self.name = backend.name
+        self.window = window if window is not None else float(os.getenv("LLM_BATCH_WINDOW_MS", 10)) / 1000
+        self.max_batch = max_batch or int(os.getenv("LLM_MAX_BATCH_SIZE", 8))
+        self._queue: List[_Pending] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.batch_sizes = metrics.histogram(f"llm_batch_size.{backend.name}", metrics.SIZE_BUCKETS)
+        self.queue_waits = metrics.histogram(f"llm_batch_queue_wait_seconds.{backend.name}")
+
+    def is_configured(self) -> bool:
+        return self.backend.is_configured()
+
+    def warm_up(self):
+        self.backend.warm_up()
+
+    def ping(self, timeout: float = 2.0):
+        self.backend.ping(timeout)
+
+    def complete(self, system: str, prompt: str, max_tokens: int = 500,
+                 temperature: float = 0.1) -> Dict[str, Any]:
+        """Queue one prompt and block until its batch has been completed"""
+        item = _Pending((system, max_tokens, temperature), system, prompt)
+        with self._cond:
+            self._queue.append(item)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        item.event.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _group_size(self, key: Tuple) -> int:
+        return sum(1 for p in self._queue if p.key == key)
+
+    def _next_batch(self) -> List[_Pending]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            # The oldest prompt decides which group goes next and how long we may wait
+            oldest = self._queue[0]
+            deadline = oldest.enqueued + self.window
+            while self._group_size(oldest.key) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [p for p in self._queue if p.key == oldest.key][:self.max_batch]
+            picked = set(map(id, batch))
+            self._queue = [p for p in self._queue if id(p) not in picked]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            dispatched = time.perf_counter()
+            self.batch_sizes.observe(len(batch))
+            for pending in batch:
+                self.queue_waits.observe(dispatched - pending.enqueued)
+
+            system, max_tokens, temperature = batch[0].key
+            try:
+                results = self.backend.complete_batch(
+                    [{"system": system, "prompt": p.prompt} for p in batch], max_tokens, temperature
+                )
+                for pending, result in zip(batch, results):
+                    result["latency"] = time.perf_counter() - pending.enqueued
+                    pending.result = result
+            except Exception as e:
+                logger.warning(f"Batch of {len(batch)} failed on '{self.name}': {e}")
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.event.set()
+
+
+def batched(backend: LLMBackend):
+    """Wrap backends that can batch in a MicroBatcher; others are returned as is"""
+    return MicroBatcher(backend) if backend.supports_batching else backend
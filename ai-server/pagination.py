@@ -0,0 +1,90 @@
+"""
+Opaque, signed page tokens for paginated /chat results.
+
+A token carries the SQL that produced the result and the row offset of the next
+page, so fetching another page never goes back to the LLM. Tokens are signed
+with HMAC so a client cannot hand us arbitrary SQL through one. Set
+PAGE_TOKEN_SECRET when running several workers so they all accept each other's
+tokens; otherwise a per-process secret is used. A configured secret must be at
+least 32 characters and not a placeholder, since anyone who knows it can
+sign tokens that run arbitrary SQL.
+"""
+
+import os
+import hmac
+import json
+import base64
+import hashlib
+import secrets
+from typing import Any, Dict, Optional
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 500))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 5000))
+
+MIN_SECRET_LENGTH = 32
+# Parts of values copied from examples and docs instead of generated
+PLACEHOLDER_MARKERS = ("change_me", "changeme", "your_", "placeholder", "example")
+
+_secret = None
+
+
+def _get_secret() -> bytes:
+    global _secret
+    if _secret is None:
+        configured = os.getenv("PAGE_TOKEN_SECRET", "").strip()
+        if any(marker in configured.lower() for marker in PLACEHOLDER_MARKERS):
+            raise RuntimeError("PAGE_TOKEN_SECRET is a placeholder. Generate one with:"
+                               " python -c \"import secrets; print(secrets.token_urlsafe(48))\"")
+        if configured and len(configured) < MIN_SECRET_LENGTH:
+            raise RuntimeError(f"PAGE_TOKEN_SECRET must be at least {MIN_SECRET_LENGTH} characters")
+        _secret = configured.encode("utf-8") if configured else secrets.token_bytes(32)
+    return _secret
+
+
+def check_secret():
+    """Raise RuntimeError on startup instead of on the first paginated request"""
+    _get_secret()
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def encode_page_token(sql: str, params: Optional[Dict[str, Any]], offset: int) -> str:
+    """Build the token for the page starting at `offset`"""
+    payload = json.dumps({"sql": sql, "params": params or {}, "offset": offset},
+                         separators=(",", ":"), default=str).encode("utf-8")
+    signature = hmac.new(_get_secret(), payload, hashlib.sha256).digest()[:16]
+    return _b64encode(payload) + "." + _b64encode(signature)
+
+
+def decode_page_token(token: str) -> Dict[str, Any]:
+    """Verify and unpack a token; raises ValueError if it was tampered with"""
+    try:
+        payload_part, signature_part = token.split(".", 1)
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (ValueError, TypeError):
+        raise ValueError("Malformed page_token")
+
+    expected = hmac.new(_get_secret(), payload, hashlib.sha256).digest()[:16]
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError("Invalid or expired page_token")
+
+    data = json.loads(payload)
+    if not isinstance(data.get("offset"), int) or data["offset"] < 0:
+        raise ValueError("Invalid page_token offset")
+    return data
+
+
+def clamp_page_size(page_size: Any) -> int:
+    """Validate a requested page size"""
+    if page_size is None:
+        return DEFAULT_PAGE_SIZE
+    if isinstance(page_size, bool) or not isinstance(page_size, int) or page_size < 1:
+        raise ValueError("'page_size' must be a positive integer")
+    return min(page_size, MAX_PAGE_SIZE)
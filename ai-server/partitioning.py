@@ -0,0 +1,471 @@
+"""
+Monthly range partitioning of the time-ordered analytics tables.
+
+Most generated SQL filters or buckets invoices by "issueDate" (and payments by
+"paidDate"), so as those tables grow every such query reads more. Declaratively
+partitioned by month, a query for one quarter only reads three partitions, as
+long as its predicates are ranges on the bare column (sargable.py rewrites the
+EXTRACT(YEAR FROM ...) filters the LLM writes into such ranges).
+
+migrate() converts a plain table in one transaction (writes wait, reads keep
+working until the final swap):
+
+  - a partitioned copy is created with the same columns, defaults and checks,
+    one partition per month from the first row's month to PARTITION_MONTHS_AHEAD
+    months from now, and a default partition for anything outside that range
+  - rows are copied, then indexes, outgoing foreign keys, triggers (the change
+    feed's), row level security policies, grants and the owner are recreated,
+    and sequences owned by the old table's serial columns move to the new one
+  - primary keys and unique constraints get the partition key appended, as
+    Postgres requires (invoices: PRIMARY KEY (id, "issueDate")); foreign keys
+    pointing at the table (line_items / payments -> invoices) can no longer
+    reference "invoiceId" alone, so they are replaced by triggers enforcing the
+    same link and ON DELETE / ON UPDATE actions (see FOREIGN_KEY_FUNCTIONS);
+    with drop_foreign_keys they are dropped instead
+  - the old table is kept as <table>_unpartitioned unless drop_old is set
+
+maintain() (run it from cron) adds the partitions for the coming months and
+moves rows that landed in the default partition into their own month, except
+rows older than the first monthly partition (or `since`), which stay there.
+
+    python partitioning.py --status
+    python partitioning.py --migrate invoices payments --dry-run
+    python partitioning.py --migrate invoices payments --drop-old
+    python partitioning.py --maintain
+"""
+
+import os
+import re
+import sys
+import logging
+import argparse
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg
+from dotenv import load_dotenv
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# Table -> the timestamp column its partitions are ranges of
+PARTITION_KEYS = {"invoices": "issueDate", "payments": "paidDate"}
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+OLD_SUFFIX = "_unpartitioned"
+_PARTITION_RE = re.compile(r"_p(\d{4})_(\d{2})$")
+
+# Trigger functions standing in for a single-column foreign key to a partitioned
+# table, whose unique keys all include the partition key. The child side checks
+# that the referenced row exists (locking it like a foreign key does); the parent
+# side applies the constraint's ON DELETE / ON UPDATE action once no row with the
+# old key is left, so a row moving to another partition (delete + insert in one
+# statement) keeps its children.
+FOREIGN_KEY_FUNCTIONS = [
+    """CREATE OR REPLACE FUNCTION public.partitioning_fk_check() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    -- parent table, parent column, child column, constraint name
+    null_key BOOLEAN;
+    found BOOLEAN;
+BEGIN
+    EXECUTE format('SELECT ($1).%I IS NULL', TG_ARGV[2]) INTO null_key USING NEW;
+    IF null_key THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('SELECT EXISTS (SELECT FROM (SELECT 1 FROM %s WHERE %I = ($1).%I FOR KEY SHARE) r)',
+                   TG_ARGV[0], TG_ARGV[1], TG_ARGV[2]) INTO found USING NEW;
+    IF NOT found THEN
+        RAISE foreign_key_violation USING
+            MESSAGE = format('insert or update on table "%s" violates foreign key constraint "%s"',
+                             TG_TABLE_NAME, TG_ARGV[3]),
+            DETAIL = format('Key (%s) is not present in table "%s".', TG_ARGV[2], TG_ARGV[0]);
+    END IF;
+    RETURN NULL;
+END
+$$""",
+    """CREATE OR REPLACE FUNCTION public.partitioning_fk_action() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    -- parent table, parent column, child table, child column, on delete, on update, constraint name
+    action TEXT := CASE TG_OP WHEN 'DELETE' THEN TG_ARGV[4] ELSE TG_ARGV[5] END;
+    unchanged BOOLEAN;
+    found BOOLEAN;
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        EXECUTE format('SELECT ($1).%I IS NOT DISTINCT FROM ($2).%I', TG_ARGV[1], TG_ARGV[1])
+            INTO unchanged USING OLD, NEW;
+        IF unchanged THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    -- Still there: the row moved to another partition, or another row has the key
+    EXECUTE format('SELECT EXISTS (SELECT FROM %s WHERE %I = ($1).%I)', TG_ARGV[0], TG_ARGV[1], TG_ARGV[1])
+        INTO found USING OLD;
+    IF found THEN
+        RETURN NULL;
+    END IF;
+    IF action = 'c' AND TG_OP = 'DELETE' THEN
+        EXECUTE format('DELETE FROM %s WHERE %I = ($1).%I', TG_ARGV[2], TG_ARGV[3], TG_ARGV[1]) USING OLD;
+    ELSIF action = 'c' THEN
+        EXECUTE format('UPDATE %s SET %I = ($2).%I WHERE %I = ($1).%I',
+                       TG_ARGV[2], TG_ARGV[3], TG_ARGV[1], TG_ARGV[3], TG_ARGV[1]) USING OLD, NEW;
+    ELSIF action IN ('n', 'd') THEN
+        EXECUTE format('UPDATE %s SET %I = %s WHERE %I = ($1).%I', TG_ARGV[2], TG_ARGV[3],
+                       CASE action WHEN 'n' THEN 'NULL' ELSE 'DEFAULT' END, TG_ARGV[3], TG_ARGV[1]) USING OLD;
+    ELSE
+        EXECUTE format('SELECT EXISTS (SELECT FROM %s WHERE %I = ($1).%I)', TG_ARGV[2], TG_ARGV[3], TG_ARGV[1])
+            INTO found USING OLD;
+        IF found THEN
+            RAISE foreign_key_violation USING
+                MESSAGE = format('update or delete on table "%s" violates foreign key constraint "%s" on table "%s"',
+                                 TG_ARGV[0], TG_ARGV[6], TG_ARGV[2]),
+                DETAIL = format('Key (%s) is still referenced from table "%s".', TG_ARGV[1], TG_ARGV[2]);
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$""",
+]
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value: Any) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+def is_partitioned(conn: psycopg.Connection, table: str) -> bool:
+    row = conn.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (f"public.{table}",)).fetchone()
+    return row is not None and row[0] == "p"
+
+
+def unique_key(conn: psycopg.Connection, table: str) -> List[str]:
+    """Columns of the table's primary key: ["id"], or ["id", <partition key>] once partitioned"""
+    rows = conn.execute(
+        "SELECT a.attname FROM pg_constraint c"
+        " JOIN LATERAL unnest(c.conkey) WITH ORDINALITY k(attnum, n) ON true"
+        " JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum"
+        " WHERE c.conrelid = to_regclass(%s) AND c.contype = 'p' ORDER BY k.n",
+        (f"public.{table}",),
+    ).fetchall()
+    return [name for (name,) in rows] or ["id"]
+
+
+def _month_bounds(conn: psycopg.Connection, table: str, key: str) -> Tuple[Optional[date], Optional[date]]:
+    return conn.execute(
+        f"SELECT date_trunc('month', min({_ident(key)}))::date, date_trunc('month', max({_ident(key)}))::date"
+        f" FROM public.{table}"
+    ).fetchone()
+
+
+def _months(first: date, last: date) -> List[date]:
+    months, month = [], first
+    while month <= last:
+        months.append(month)
+        month = _add_months(month, 1)
+    return months
+
+
+def _partition_ddl(table: str, key: str, month: date) -> str:
+    return (
+        f"CREATE TABLE public.{_partition_name(table, month)} PARTITION OF public.{table}"
+        f" FOR VALUES FROM ({_literal(month)}) TO ({_literal(_add_months(month, 1))})"
+    )
+
+
+def migration_plan(conn: psycopg.Connection, table: str, since: Optional[date] = None,
+                   months_ahead: int = PARTITION_MONTHS_AHEAD, drop_old: bool = False,
+                   drop_foreign_keys: bool = False) -> List[str]:
+    """
+    The statements that turn `table` into a monthly partitioned table, read from the catalog.
+    Foreign keys referencing it become triggers, or are dropped with `drop_foreign_keys`.
+    """
+    key = PARTITION_KEYS[table]
+    oid = conn.execute("SELECT to_regclass(%s)::oid", (f"public.{table}",)).fetchone()[0]
+    if oid is None:
+        raise ValueError(f"Table {table} does not exist")
+    old = f"{table}{OLD_SUFFIX}"
+
+    owner, rls, force_rls = conn.execute(
+        "SELECT pg_get_userbyid(relowner), relrowsecurity, relforcerowsecurity FROM pg_class WHERE oid = %s",
+        (oid,),
+    ).fetchone()
+    # Primary key and unique constraints: recreated with the partition key appended
+    constraints = conn.execute(
+        "SELECT c.conname, c.contype, c.conindid, pg_get_constraintdef(c.oid),"
+        "       array(SELECT a.attname FROM unnest(c.conkey) WITH ORDINALITY k(attnum, n)"
+        "             JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum ORDER BY k.n)"
+        " FROM pg_constraint c WHERE c.conrelid = %s AND c.contype IN ('p', 'u', 'f') ORDER BY c.contype DESC",
+        (oid,),
+    ).fetchall()
+    constraint_indexes = {indid for _, kind, indid, _, _ in constraints if kind in ("p", "u")}
+    indexes = conn.execute(
+        "SELECT c.relname, i.indexrelid, pg_get_indexdef(i.indexrelid), i.indisunique"
+        " FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE i.indrelid = %s",
+        (oid,),
+    ).fetchall()
+    referencing = conn.execute(
+        "SELECT c.conrelid::regclass::text, c.conname, c.confdeltype, c.confupdtype,"
+        "       array(SELECT attname FROM pg_attribute WHERE attrelid = c.conrelid AND attnum = ANY(c.conkey)),"
+        "       array(SELECT attname FROM pg_attribute WHERE attrelid = c.confrelid AND attnum = ANY(c.confkey))"
+        " FROM pg_constraint c WHERE c.confrelid = %s AND c.contype = 'f' ORDER BY c.conname",
+        (oid,),
+    ).fetchall()
+    if not drop_foreign_keys:
+        composite = [f"{child}.{name}" for child, name, _, _, columns, _ in referencing if len(columns) != 1]
+        if composite:
+            raise ValueError(f"Multi-column foreign keys to {table} cannot be kept: {', '.join(composite)};"
+                             " pass drop_foreign_keys (--drop-foreign-keys) to drop them")
+    triggers = conn.execute(
+        "SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s AND NOT tgisinternal",
+        (oid,),
+    ).fetchall()
+    policies = conn.execute(
+        "SELECT policyname, permissive, roles::text[], cmd, qual, with_check FROM pg_policies"
+        " WHERE schemaname = 'public' AND tablename = %s",
+        (table,),
+    ).fetchall()
+    # Serial columns: the copy's defaults still call these sequences' nextval(), but they are
+    # owned by the old table's columns and would be dropped (or left behind) with it
+    sequences = conn.execute(
+        "SELECT d.objid::regclass::text, a.attname FROM pg_depend d"
+        " JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'"
+        " JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid"
+        " WHERE d.classid = 'pg_class'::regclass AND d.refclassid = 'pg_class'::regclass"
+        "   AND d.refobjid = %s AND d.deptype = 'a'",
+        (oid,),
+    ).fetchall()
+    grants = conn.execute(
+        "SELECT a.privilege_type, CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END"
+        " FROM pg_class c, aclexplode(c.relacl) a WHERE c.oid = %s AND a.grantee <> c.relowner",
+        (oid,),
+    ).fetchall()
+
+    first, last = _month_bounds(conn, table, key)
+    this_month = date.today().replace(day=1)
+    first = max(first or this_month, since.replace(day=1)) if since else (first or this_month)
+    last = max(last or this_month, _add_months(this_month, months_ahead))
+
+    plan = [f"LOCK TABLE public.{table} IN EXCLUSIVE MODE"]
+    if referencing and not drop_foreign_keys:
+        plan.extend(FOREIGN_KEY_FUNCTIONS)
+    for child, name, _, _, (column,), (parent_column,) in referencing:
+        # The new table's keys include the partition key, so no foreign key can reference parent_column alone
+        plan.append(f"ALTER TABLE {child} DROP CONSTRAINT {_ident(name)}")
+        if drop_foreign_keys:
+            logger.warning(f"Dropping foreign key {child}.{name} to {table}: the link is no longer enforced")
+            continue
+        plan.append(
+            f"CREATE TRIGGER {_ident((name + '_check')[:63])} AFTER INSERT OR UPDATE OF {_ident(column)}"
+            f" ON {child} FOR EACH ROW EXECUTE FUNCTION public.partitioning_fk_check"
+            f"({', '.join(map(_literal, (f'public.{table}', parent_column, column, name)))})"
+        )
+    for name, _ in triggers:
+        plan.append(f"DROP TRIGGER {_ident(name)} ON public.{table}")
+    # The old table and its indexes move out of the way of the names the new ones take
+    plan.append(f"ALTER TABLE public.{table} RENAME TO {old}")
+    for name, *_ in indexes:
+        plan.append(f"ALTER INDEX public.{_ident(name)} RENAME TO {_ident((name + OLD_SUFFIX)[:63])}")
+
+    plan.append(
+        f"CREATE TABLE public.{table} (LIKE public.{old} INCLUDING ALL EXCLUDING INDEXES)"
+        f" PARTITION BY RANGE ({_ident(key)})"
+    )
+    plan.extend(_partition_ddl(table, key, month) for month in _months(first, last))
+    plan.append(f"CREATE TABLE public.{table}_default PARTITION OF public.{table} DEFAULT")
+    plan.append(f"INSERT INTO public.{table} SELECT * FROM public.{old}")
+
+    for name, kind, _, definition, columns in constraints:
+        if kind == "f":
+            plan.append(f"ALTER TABLE public.{table} ADD CONSTRAINT {_ident(name)} {definition}")
+            continue
+        columns = list(columns) + ([key] if key not in columns else [])
+        kind_sql = "PRIMARY KEY" if kind == "p" else "UNIQUE"
+        plan.append(f"ALTER TABLE public.{table} ADD CONSTRAINT {_ident(name)} {kind_sql} "
+                    f"({', '.join(_ident(c) for c in columns)})")
+    for name, index_oid, definition, unique in indexes:
+        if index_oid in constraint_indexes:
+            continue
+        if unique:
+            # A unique index without the partition key is not possible on a partitioned table
+            logger.warning(f"Unique index {name} on {table} is not recreated; add {key} to it by hand if needed")
+            continue
+        # The definition names the table as public.<table>, which is now the partitioned one
+        plan.append(definition)
+
+    for _, definition in triggers:
+        plan.append(definition)
+    for child, name, on_delete, on_update, (column,), (parent_column,) in ([] if drop_foreign_keys else referencing):
+        arguments = (f"public.{table}", parent_column, child, column, on_delete, on_update, name)
+        plan.append(
+            f"CREATE TRIGGER {_ident((name + '_action')[:63])} AFTER DELETE OR UPDATE OF {_ident(parent_column)}"
+            f" ON public.{table} FOR EACH ROW EXECUTE FUNCTION public.partitioning_fk_action"
+            f"({', '.join(map(_literal, arguments))})"
+        )
+    for name, permissive, roles, cmd, qual, with_check in policies:
+        policy = (f"CREATE POLICY {_ident(name)} ON public.{table} AS {permissive} FOR {cmd}"
+                  f" TO {', '.join(r if r == 'public' else _ident(r) for r in roles)}")
+        if qual:
+            policy += f" USING ({qual})"
+        if with_check:
+            policy += f" WITH CHECK ({with_check})"
+        plan.append(policy)
+    if rls:
+        plan.append(f"ALTER TABLE public.{table} ENABLE ROW LEVEL SECURITY")
+    if force_rls:
+        plan.append(f"ALTER TABLE public.{table} FORCE ROW LEVEL SECURITY")
+    for privilege, grantee in grants:
+        plan.append(f"GRANT {privilege} ON public.{table} TO {grantee}")
+    plan.append(f"ALTER TABLE public.{table} OWNER TO {_ident(owner)}")
+    for sequence, column in sequences:
+        plan.append(f"ALTER SEQUENCE {sequence} OWNED BY public.{table}.{_ident(column)}")
+    if drop_old:
+        plan.append(f"DROP TABLE public.{old}")
+    return plan
+
+
+def migrate(conn: psycopg.Connection, table: str, since: Optional[date] = None,
+            months_ahead: int = PARTITION_MONTHS_AHEAD, drop_old: bool = False, dry_run: bool = False,
+            drop_foreign_keys: bool = False) -> List[str]:
+    """Partition `table` by month of its PARTITION_KEYS column, in one transaction"""
+    if is_partitioned(conn, table):
+        logger.info(f"{table} is already partitioned")
+        return []
+    plan = migration_plan(conn, table, since, months_ahead, drop_old, drop_foreign_keys)
+    if dry_run:
+        conn.rollback()
+        return plan
+    with conn.transaction():
+        for statement in plan:
+            logger.debug(statement)
+            conn.execute(statement)
+    conn.execute(f"ANALYZE public.{table}")
+    conn.commit()
+    logger.info(f"{table} partitioned by month of {PARTITION_KEYS[table]}")
+    return plan
+
+
+def _partitions(conn: psycopg.Connection, table: str) -> List[str]:
+    rows = conn.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+        " WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname",
+        (f"public.{table}",),
+    ).fetchall()
+    return [name for (name,) in rows]
+
+
+def add_partition(conn: psycopg.Connection, table: str, month: date) -> bool:
+    """Create the partition for `month`, moving its rows out of the default partition first"""
+    name, key = _partition_name(table, month), PARTITION_KEYS[table]
+    if name in _partitions(conn, table):
+        return False
+    default = f"{table}_default"
+    bounds = f"{_ident(key)} >= {_literal(month)} AND {_ident(key)} < {_literal(_add_months(month, 1))}"
+    with conn.transaction():
+        stray = conn.execute(f"SELECT count(*) FROM public.{default} WHERE {bounds}").fetchone()[0]
+        if not stray:
+            conn.execute(_partition_ddl(table, key, month))
+        else:
+            # The default partition may not hold rows of a new partition's range while it is attached
+            conn.execute(f"ALTER TABLE public.{table} DETACH PARTITION public.{default}")
+            conn.execute(_partition_ddl(table, key, month))
+            conn.execute(f"INSERT INTO public.{table} SELECT * FROM public.{default} WHERE {bounds}")
+            conn.execute(f"DELETE FROM public.{default} WHERE {bounds}")
+            conn.execute(f"ALTER TABLE public.{table} ATTACH PARTITION public.{default} DEFAULT")
+            logger.info(f"Moved {stray} rows of {month:%Y-%m} from {default} to {name}")
+    logger.info(f"Created partition {name}")
+    return True
+
+
+def _first_month(conn: psycopg.Connection, table: str) -> Optional[date]:
+    """Month of the earliest monthly partition of `table`"""
+    months = [date(int(m.group(1)), int(m.group(2)), 1)
+              for m in map(_PARTITION_RE.search, _partitions(conn, table)) if m]
+    return min(months, default=None)
+
+
+def maintain(conn: psycopg.Connection, months_ahead: int = PARTITION_MONTHS_AHEAD,
+             since: Optional[date] = None) -> Dict[str, int]:
+    """
+    Partitions for the coming months and for rows that fell into the default partitions;
+    rows before `since` (default: the first monthly partition, see migrate's `since`) stay there
+    """
+    created: Dict[str, int] = {}
+    this_month = date.today().replace(day=1)
+    for table, key in PARTITION_KEYS.items():
+        if not is_partitioned(conn, table):
+            continue
+        months = set(_months(this_month, _add_months(this_month, months_ahead)))
+        first = since.replace(day=1) if since else _first_month(conn, table)
+        rows = conn.execute(
+            f"SELECT DISTINCT date_trunc('month', {_ident(key)})::date FROM public.{table}_default"
+            f" WHERE {_ident(key)} IS NOT NULL" + (f" AND {_ident(key)} >= %s" if first else ""),
+            (first,) if first else None,
+        ).fetchall()
+        months.update(month for (month,) in rows)
+        created[table] = sum(add_partition(conn, table, month) for month in sorted(months))
+    return created
+
+
+def status(conn: psycopg.Connection) -> Dict[str, Dict[str, Any]]:
+    result = {}
+    for table, key in PARTITION_KEYS.items():
+        partitioned = is_partitioned(conn, table)
+        entry = {"partition_key": key, "partitioned": partitioned}
+        if partitioned:
+            partitions = _partitions(conn, table)
+            monthly = [p for p in partitions if p != f"{table}_default"]
+            entry["partitions"] = len(partitions)
+            entry["first"], entry["last"] = (monthly[0], monthly[-1]) if monthly else (None, None)
+            entry["rows_in_default"] = conn.execute(f"SELECT count(*) FROM public.{table}_default").fetchone()[0]
+        result[table] = entry
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", action="store_true", help="show which tables are partitioned")
+    parser.add_argument("--migrate", nargs="+", choices=sorted(PARTITION_KEYS), metavar="TABLE",
+                        help=f"partition these tables ({', '.join(PARTITION_KEYS)})")
+    parser.add_argument("--since", type=lambda s: date.fromisoformat(f"{s}-01"), metavar="YYYY-MM",
+                        help="first monthly partition; older rows go to (and with --maintain stay in) the default"
+                             " partition")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    parser.add_argument("--drop-old", action="store_true", help=f"drop <table>{OLD_SUFFIX} after migrating")
+    parser.add_argument("--drop-foreign-keys", action="store_true",
+                        help="drop the foreign keys referencing a migrated table instead of enforcing them by trigger")
+    parser.add_argument("--dry-run", action="store_true", help="print the migration statements only")
+    parser.add_argument("--maintain", action="store_true", help="create upcoming partitions (run daily)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    if not (args.status or args.migrate or args.maintain):
+        parser.print_help()
+        sys.exit(1)
+    with psycopg.connect(database.get_database_url()) as conn:
+        # payments reference invoices, so invoices goes first
+        for table in sorted(args.migrate or [], key=list(PARTITION_KEYS).index):
+            plan = migrate(conn, table, args.since, args.months_ahead, args.drop_old, args.dry_run,
+                           args.drop_foreign_keys)
+            if args.dry_run:
+                print(";\n".join(plan) + ";")
+        if args.maintain:
+            print(f"Partitions created: {maintain(conn, args.months_ahead, args.since)}")
+        if args.status:
+            for table, entry in status(conn).items():
+                print(f"{table}: {entry}")
+
+
+if __name__ == "__main__":
+    main()
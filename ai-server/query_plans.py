@@ -0,0 +1,203 @@
+"""
+SQL fingerprinting and prepared-statement reuse.
+
+Generated SQL usually differs between two questions only in its literals
+(a date, a vendor name, a LIMIT). normalize_sql() lifts those literals out into
+parameters so that both questions share one statement text, and
+execute_prepared() runs that text as a server-side prepared statement. psycopg
+keeps prepared statements per connection, so with a connection pool repeated
+question shapes skip planning entirely.
+"""
+
+import re
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+
+import psycopg
+
+logger = logging.getLogger(__name__)
+
+# One alternative per token kind; order matters (comments and strings first)
+TOKEN_RE = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<ident>"(?:[^"]|"")*")
+  | (?P<placeholder>%\(\w+\)s|%s)
+  | (?P<number>(?<![\w.])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.]))
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<op><>|!=|<=|>=|::|[=<>(),;%])
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# A literal directly after one of these tokens is a value we can bind
+VALUE_CONTEXT = {"=", "<>", "!=", "<", ">", "<=", ">=", "LIKE", "ILIKE", "LIMIT", "OFFSET", "BETWEEN"}
+
+
+def _tokenize(sql: str):
+    return [(m.lastgroup, m.group()) for m in TOKEN_RE.finditer(sql)]
+
+
+def _literal_value(kind: str, text: str) -> Any:
+    if kind == "string":
+        return text[1:-1].replace("''", "'")
+    if "." in text or "e" in text.lower():
+        return Decimal(text)
+    return int(text)
+
+
+def _normalize(sql: str, params: Optional[Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+    params = dict(params or {})
+    literal_names: Dict[Tuple[str, Any], str] = {}
+    out = []
+    prev = None          # previous significant token, uppercased
+    depth = 0
+    in_list_depths = []  # paren depths that belong to an IN (...) list
+    between_pending = False
+
+    for kind, text in _tokenize(sql):
+        if kind in ("space", "comment"):
+            if out and out[-1] != " ":
+                out.append(" ")
+            continue
+
+        if kind in ("string", "number"):
+            bindable = (
+                prev in VALUE_CONTEXT
+                or (prev == "AND" and between_pending)
+                or (prev in ("(", ",") and in_list_depths and in_list_depths[-1] == depth)
+            )
+            if bindable:
+                value = _literal_value(kind, text)
+                key = (type(value).__name__, value)
+                name = literal_names.get(key)
+                if name is None:
+                    name = f"_p{len(literal_names) + 1}"
+                    literal_names[key] = name
+                    params[name] = value
+                out.append(f"%({name})s")
+                if prev == "AND":
+                    between_pending = False
+            else:
+                out.append(text.replace("%", "%%") if kind == "string" else text)
+            prev = "?"
+            continue
+
+        upper = text.upper()
+        out.append("%%" if text == "%" else text)
+
+        if text == "(":
+            depth += 1
+            if prev == "IN":
+                in_list_depths.append(depth)
+        elif text == ")":
+            if in_list_depths and in_list_depths[-1] == depth:
+                in_list_depths.pop()
+            depth -= 1
+        elif upper == "BETWEEN":
+            between_pending = True
+        elif upper == "SELECT" and prev == "(" and in_list_depths and in_list_depths[-1] == depth:
+            # IN (SELECT ...) is a subquery, not a value list
+            in_list_depths.pop()
+        prev = upper
+
+    return "".join(out).strip(), params
+
+
+def normalize_sql(sql: str, params: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Replace bindable literals with named placeholders.
+
+    Only literals in value positions (comparisons, LIKE, IN lists, BETWEEN,
+    LIMIT/OFFSET) are lifted; literals that shape the query (DATE_TRUNC units,
+    INTERVAL '...', GROUP BY 1) stay inline. Identical literals share one
+    placeholder so repeated expressions (e.g. in SELECT and GROUP BY) still match.
+    Existing named params are kept as they are.
+    """
+    normalized, bound = _normalize(sql, params)
+    if not bound:
+        # Nothing to bind: run the original text as plain SQL
+        return sql.strip(), {}
+    return normalized, bound
+
+
+def fingerprint(sql: str) -> str:
+    """Stable identifier for a query shape (literals, comments and whitespace ignored)"""
+    normalized, _ = _normalize(sql, None)
+    return hashlib.sha1(normalized.lower().encode("utf-8")).hexdigest()[:16]
+
+
+class PlanCacheStats:
+    """Mirror of psycopg's per-connection prepared-statement cache, for hit-rate reporting"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def record(self, conn, key) -> bool:
+        """Record one execution; returns True when the plan was already prepared"""
+        with self._lock:
+            seen = self._seen.get(conn)
+            if seen is None:
+                seen = self._seen[conn] = OrderedDict()
+            if key in seen:
+                seen.move_to_end(key)
+                self.hits += 1
+                return True
+            seen[key] = True
+            if len(seen) > (conn.prepared_max or 0):
+                seen.popitem(last=False)
+            self.misses += 1
+            return False
+
+    def record_fallback(self):
+        with self._lock:
+            self.fallbacks += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "fallbacks": self.fallbacks,
+                "connections": len(self._seen),
+            }
+
+
+plan_cache_stats = PlanCacheStats()
+
+
+def execute_prepared(conn: psycopg.Connection, sql: str, params: Optional[Dict[str, Any]] = None):
+    """
+    Execute SQL as a prepared, parameterized statement and return the cursor.
+
+    If the normalized form is rejected by the server (e.g. a lifted literal
+    changed how an expression is typed), the original SQL is executed as-is.
+    The prepared attempt runs in a savepoint, so its failure only rolls back
+    to there: settings made earlier in the transaction (the tenant, see
+    tenancy.scope_query) still apply to the retry.
+    """
+    normalized, bound = normalize_sql(sql, params)
+    key = (normalized, tuple(sorted((k, type(v).__name__) for k, v in bound.items())))
+    cursor = conn.cursor()
+    try:
+        with conn.transaction():
+            cursor.execute(normalized, bound or None, prepare=True)
+        plan_cache_stats.record(conn, key)
+        return cursor
+    except psycopg.Error as e:
+        logger.warning(f"Prepared execution failed, retrying unprepared: {e}")
+        plan_cache_stats.record_fallback()
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        return cursor
@@ -0,0 +1,332 @@
+"""
+Token-bucket admission control for rate-limited LLM providers.
+
+Providers cap both requests per minute and tokens per minute. Rather than
+firing requests until the provider answers 429, each provider gets a
+TokenBucketLimiter with one bucket per limit (GROQ_RPM / GROQ_TPM,
+VANNA_RPM / VANNA_TPM, ...). A request reserves its estimated prompt tokens
+plus max_tokens up front, and the reservation is settled against the usage the
+provider reports.
+
+Waiting requests are served in priority order: interactive /chat questions
+first, background work (training) after them and only while a reserve of the
+budget is left for interactive traffic. A request whose projected wait exceeds
+its priority's budget is shed immediately with RateLimited instead of queueing.
+A 429 that slips through blocks the limiter for the provider's Retry-After and
+the request is retried once.
+"""
+
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import metrics
+from llm_backends import LLMBackend
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {"interactive": 0, "background": 1}
+MAX_WAIT = {
+    "interactive": float(os.getenv("LLM_ADMISSION_MAX_WAIT", 10)),
+    "background": float(os.getenv("LLM_BACKGROUND_MAX_WAIT", 300)),
+}
+# Share of each bucket that background work may not dip into
+BACKGROUND_RESERVE = float(os.getenv("LLM_BACKGROUND_RESERVE", 0.2))
+CHARS_PER_TOKEN = 4.0
+
+# Priority of the work running in the current context; copied into worker threads
+request_priority: ContextVar[str] = ContextVar("request_priority", default="interactive")
+
+_limiters: Dict[str, "TokenBucketLimiter"] = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """Shed by admission control (or still throttled by the provider)"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@contextmanager
+def background():
+    """Run the enclosed LLM calls at background priority"""
+    token = request_priority.set("background")
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class _Bucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, needed: float, reserve: float) -> float:
+        """Seconds until `needed` fits while leaving `reserve` (a share of capacity) untouched"""
+        return (needed + reserve * self.capacity - self.level) / self.rate
+
+
+class TokenBucketLimiter:
+    """Requests/min and tokens/min buckets for one provider, with a priority wait queue"""
+
+    def __init__(self, name: str, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.name = name
+        self.requests = _Bucket(rpm) if rpm else None
+        self.tokens = _Bucket(tpm) if tpm else None
+        self.chars_per_token = CHARS_PER_TOKEN
+        self._cond = threading.Condition()
+        self._waiting: List[tuple] = []
+        self._seq = itertools.count()
+        self._blocked_until = 0.0
+        self.admitted = 0
+        self.shed = 0
+        self.throttled = 0
+        self.waits = {p: metrics.histogram(f"llm_admission_wait_seconds.{name}.{p}") for p in PRIORITIES}
+
+    @property
+    def limited(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def estimate_tokens(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token) + 1
+
+    def observe_prompt(self, chars: int, prompt_tokens: int):
+        """Calibrate the chars-per-token estimate from the provider's measured usage"""
+        if prompt_tokens > 0 and chars > 0:
+            with self._cond:
+                self.chars_per_token += 0.1 * (chars / prompt_tokens - self.chars_per_token)
+
+    def _projected_delay(self, requests: int, tokens: float, reserve: float, now: float) -> float:
+        delay = self._blocked_until - now
+        if self.requests is not None:
+            self.requests.refill(now)
+            delay = max(delay, self.requests.delay(requests, reserve))
+        if self.tokens is not None:
+            self.tokens.refill(now)
+            delay = max(delay, self.tokens.delay(tokens, reserve))
+        return delay
+
+    def acquire(self, tokens: int, priority: Optional[str] = None) -> int:
+        """
+        Block until the request fits the budget, or raise RateLimited. Returns the
+        tokens actually reserved (capped below the bucket size), to settle() against.
+        """
+        if not self.limited:
+            return 0
+        priority = priority or request_priority.get()
+        rank = PRIORITIES[priority]
+        reserve = BACKGROUND_RESERVE if rank else 0.0
+        if self.tokens is not None:
+            # A larger request could never fit; it is admitted at this size and its overrun charged by settle()
+            tokens = min(tokens, int(self.tokens.capacity * (1 - reserve)))
+
+        started = time.monotonic()
+        deadline = started + MAX_WAIT[priority]
+        entry = (rank, next(self._seq), tokens)
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    # Everything queued ahead of us is served first
+                    ahead = [w for w in self._waiting if w < entry]
+                    delay = self._projected_delay(len(ahead) + 1, sum(w[2] for w in ahead) + tokens, reserve, now)
+                    if not ahead and delay <= 0:
+                        break
+                    if now + delay > deadline:
+                        self.shed += 1
+                        raise RateLimited(
+                            f"LLM provider '{self.name}' is at its rate limit, try again in {delay:.0f}s", delay
+                        )
+                    self._cond.wait(min(max(delay, 0.01), deadline - now))
+
+                if self.requests is not None:
+                    self.requests.level -= 1
+                if self.tokens is not None:
+                    self.tokens.level -= tokens
+                self.admitted += 1
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+        self.waits[priority].observe(time.monotonic() - started)
+        return tokens if self.tokens is not None else 0
+
+    def settle(self, reserved: int, used: int):
+        """Return the unused part of a reservation as returned by acquire() (or charge the overrun)"""
+        if self.tokens is None:
+            return
+        with self._cond:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + reserved - used)
+            self._cond.notify_all()
+
+    def penalize(self, retry_after: float):
+        """The provider answered 429: stop admitting until it says we may retry"""
+        with self._cond:
+            self.throttled += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.level = min(bucket.level, 0.0)
+            self._cond.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "rpm": self.requests.capacity if self.requests else None,
+                "tpm": self.tokens.capacity if self.tokens else None,
+                "requests_available": round(self.requests.level, 2) if self.requests else None,
+                "tokens_available": round(self.tokens.level) if self.tokens else None,
+                "queued": len(self._waiting),
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "throttled_429": self.throttled,
+                "blocked_for": round(max(0.0, self._blocked_until - now), 3),
+                "chars_per_token": round(self.chars_per_token, 3),
+            }
+
+
+def get_limiter(provider: str) -> TokenBucketLimiter:
+    """Shared limiter for a provider, configured from <PROVIDER>_RPM / <PROVIDER>_TPM"""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            prefix = provider.upper()
+            rpm = os.getenv(f"{prefix}_RPM")
+            tpm = os.getenv(f"{prefix}_TPM")
+            limiter = _limiters[provider] = TokenBucketLimiter(
+                provider, float(rpm) if rpm else None, float(tpm) if tpm else None
+            )
+        return limiter
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """All limiters that have limits configured"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.snapshot() for name, limiter in sorted(limiters.items()) if limiter.limited}
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds to back off if `error` is a provider 429, else None"""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def limited_call(limiter: TokenBucketLimiter, fn: Callable, *args: Any, tokens: int = 0,
+                 priority: Optional[str] = None, used: Optional[Callable[[Any], int]] = None, **kwargs: Any) -> Any:
+    """
+    Call `fn` once the limiter admits it; a 429 blocks the limiter and retries once.
+    With `used` (result -> tokens it took) the reservation is settled to the actual usage.
+    """
+    for attempt in range(2):
+        reserved = limiter.acquire(tokens, priority)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is None or attempt:
+                raise
+            logger.warning(f"'{limiter.name}' returned 429, backing off {retry_after:g}s")
+            limiter.penalize(retry_after)
+            continue
+        if used is not None:
+            limiter.settle(reserved, used(result) or reserved)
+        return result
+
+
+def _tokens_used(result: Dict[str, Any]) -> int:
+    return result["prompt_tokens"] + result["completion_tokens"]
+
+
+class RateLimitedBackend(LLMBackend):
+    """Wraps a backend so every call goes through its provider's limiter"""
+
+    def __init__(self, backend: LLMBackend, limiter: TokenBucketLimiter):
+        self.backend = backend
+        self.limiter = limiter
+        self.name = backend.name
+        self.supports_batching = backend.supports_batching
+        self.supports_streaming = backend.supports_streaming
+
+    def is_configured(self) -> bool:
+        return self.backend.is_configured()
+
+    def warm_up(self):
+        self.backend.warm_up()
+
+    def ping(self, timeout: float = 2.0):
+        self.backend.ping(timeout)
+
+    def _reserve(self, system: str, prompt: str, max_tokens: int) -> int:
+        return self.limiter.estimate_tokens(system) + self.limiter.estimate_tokens(prompt) + max_tokens
+
+    def complete(self, system: str, prompt: str, max_tokens: int = 500,
+                 temperature: float = 0.1) -> Dict[str, Any]:
+        result = limited_call(self.limiter, self.backend.complete, system, prompt, max_tokens, temperature,
+                              tokens=self._reserve(system, prompt, max_tokens), used=_tokens_used)
+        self.limiter.observe_prompt(len(system) + len(prompt), result["prompt_tokens"])
+        return result
+
+    def complete_batch(self, prompts: List[Dict[str, str]], max_tokens: int = 500,
+                       temperature: float = 0.1) -> List[Dict[str, Any]]:
+        """One admission for the whole batch, then one call, so a batching backend keeps its single pass"""
+        results = limited_call(self.limiter, self.backend.complete_batch, prompts, max_tokens, temperature,
+                               tokens=sum(self._reserve(p["system"], p["prompt"], max_tokens) for p in prompts),
+                               used=lambda results: sum(map(_tokens_used, results)))
+        self.limiter.observe_prompt(sum(len(p["system"]) + len(p["prompt"]) for p in prompts),
+                                    sum(result["prompt_tokens"] for result in results))
+        return results
+
+    def stream(self, system: str, prompt: str, max_tokens: int = 500,
+               temperature: float = 0.1) -> Iterator[str]:
+        estimate = self._reserve(system, prompt, max_tokens)
+        prompt_estimate = estimate - max_tokens
+        for attempt in range(2):
+            reserved = self.limiter.acquire(estimate)
+            chunks = self.backend.stream(system, prompt, max_tokens, temperature)
+            received = 0
+            try:
+                for delta in chunks:
+                    received += 1
+                    yield delta
+                return
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is None or received or attempt:
+                    raise
+                logger.warning(f"'{self.limiter.name}' returned 429, backing off {retry_after:g}s")
+                self.limiter.penalize(retry_after)
+            finally:
+                chunks.close()
+                # Streams closed early never report usage; charge the estimate plus chunks seen
+                self.limiter.settle(reserved, prompt_estimate + received)
+
+
+def rate_limited(backend: LLMBackend) -> LLMBackend:
+    """Wrap `backend` when its provider has RPM/TPM limits configured"""
+    limiter = get_limiter(backend.name.split(":", 1)[0])
+    return RateLimitedBackend(backend, limiter) if limiter.limited else backend
@@ -0,0 +1,98 @@
+"""
+Liveness, readiness and the background warm-up between them.
+
+Nothing slow happens at import time: the Vanna client, the LLM SDKs (or a
+local model) and the database pools are created on first use. On startup the
+servers hand each of them to warm_up.run(), which initializes it on a
+background thread, so the worker answers /health/live immediately while
+/health/ready returns 503 until every warm-up task has finished and the
+health monitor's last database check passed (probes never query the
+database themselves, see health_monitor.py). Load balancers and
+orchestrators should route traffic on readiness and restart on liveness.
+
+A failed warm-up task does not hold readiness back (the client is retried on
+the first request that needs it) but is reported with its error.
+STARTUP_WARM_UP=false skips the warm-up entirely.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List
+
+from fastapi.responses import JSONResponse
+
+import health_monitor
+
+logger = logging.getLogger(__name__)
+
+STARTUP_WARM_UP = os.getenv("STARTUP_WARM_UP", "true").lower() == "true"
+
+
+class WarmUp:
+    """Initialization tasks run off the startup path, and how each of them went"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.ready_at = None
+        self._lock = threading.Lock()
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+
+    def run(self, name: str, fn: Callable[[], Any]):
+        """Run `fn` on its own thread (or not at all with STARTUP_WARM_UP=false)"""
+        with self._lock:
+            self.tasks[name] = {"state": "pending" if STARTUP_WARM_UP else "skipped", "seconds": None}
+        if STARTUP_WARM_UP:
+            threading.Thread(target=self._run, args=(name, fn), name=f"warm-up-{name}", daemon=True).start()
+
+    def _run(self, name: str, fn: Callable[[], Any]):
+        started = time.perf_counter()
+        try:
+            fn()
+            result = {"state": "ready"}
+            logger.info(f"Warmed up {name} in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            result = {"state": "failed", "error": str(e)}
+            logger.warning(f"Warm-up of {name} failed, it will be retried on first use: {e}")
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        with self._lock:
+            self.tasks[name] = result
+            if not self.pending:
+                self.ready_at = time.time()
+
+    @property
+    def pending(self) -> List[str]:
+        return [name for name, task in self.tasks.items() if task["state"] == "pending"]
+
+    def uptime(self) -> float:
+        return round(time.time() - self.started_at, 3)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uptime_seconds": self.uptime(),
+                "ready_after_seconds": round(self.ready_at - self.started_at, 3) if self.ready_at else None,
+                "tasks": {name: dict(task) for name, task in self.tasks.items()},
+            }
+
+
+warm_up = WarmUp()
+
+
+def liveness(service: str) -> Dict[str, Any]:
+    """The process is up and its event loop answers; no dependency is touched"""
+    return {"service": service, "status": "alive", "uptime_seconds": warm_up.uptime()}
+
+
+def readiness(service: str) -> JSONResponse:
+    """200 once the warm-up is done and the database check passes, 503 until then"""
+    checks = {"warm_up": not warm_up.pending, "database": health_monitor.monitor.healthy("database")}
+    ready = all(checks.values())
+    content = {
+        "service": service,
+        "status": "ready" if ready else "not_ready",
+        "checks": checks,
+        "warm_up": warm_up.snapshot(),
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=content)
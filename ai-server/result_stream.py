@@ -0,0 +1,254 @@
+"""
+Bounded-memory execution of /chat result sets.
+
+Rows are streamed from the database in batches and consumed twice on the fly:
+the requested page is kept for the table view, and a StreamingChartSampler
+folds every row into a bounded chart summary (time buckets for time series,
+per-category totals for bars / pies, a systematic sample for scatter plots).
+However large the result, neither the process memory nor the response grows
+with it.
+"""
+
+import re
+import uuid
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import analytics_replica
+import database
+import sargable
+import tenancy
+from chart_inference import (
+    OTHER_LABEL, aggregate, choose_axes, combine_year_month, infer_chart_config, to_array, valid_mask,
+)
+from pagination import encode_page_token
+from query_plans import execute_prepared
+
+logger = logging.getLogger(__name__)
+
+STREAM_BATCH_SIZE = 1000
+# Queries with a trailing LIMIT at or below this are small enough to fetch in one
+# prepared round-trip; everything else goes through a server-side cursor.
+MAX_BUFFERED_LIMIT = 10000
+CHART_BUFFER_ROWS = 20000
+MAX_TIME_BUCKETS = 2000
+MAX_CATEGORIES = 5000
+# datetime64 units from finest to coarsest, used to coarsen time buckets
+TIME_UNITS = ["s", "m", "h", "D", "W", "M", "Y"]
+
+_LIMIT_RE = re.compile(r"\bLIMIT\s+(?:(\d+)|%\((\w+)\)s)\s*;?\s*$", re.IGNORECASE)
+
+
+def _trailing_limit(sql: str, params: Optional[Dict[str, Any]]) -> Optional[int]:
+    match = _LIMIT_RE.search(sql)
+    if not match:
+        return None
+    if match.group(1):
+        return int(match.group(1))
+    value = (params or {}).get(match.group(2))
+    return value if isinstance(value, int) else None
+
+
+def iter_result_batches(sql: str, params: Optional[Dict[str, Any]] = None, offset: int = 0,
+                        batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Tuple[List[str], List[tuple]]]:
+    """Yield (column_names, rows) batches of a SELECT, starting `offset` rows in"""
+    # Date filters as ranges on the bare column, so indexes and partition pruning apply
+    sql, params = sargable.rewrite(sql, params)
+    # Aggregate-heavy SQL runs on the DuckDB replica when it is enabled and current
+    cursor = analytics_replica.execute(sql, params)
+    if cursor is not None:
+        names = [desc[0] for desc in cursor.description]
+        while offset > 0:
+            skipped = len(cursor.fetchmany(min(offset, batch_size)))
+            if not skipped:
+                return
+            offset -= skipped
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield names, rows
+        return
+
+    # Generated SQL only reads, so it can be served by a read replica
+    with database.read_connection() as conn:
+        # Only the current organization's rows (RLS setting plus SQL rewrite where needed)
+        sql, params = tenancy.scope_query(conn, sql, params)
+        limit = _trailing_limit(sql, params)
+        if limit is not None and limit <= MAX_BUFFERED_LIMIT:
+            # Bounded by construction: one prepared execution, plan reused across calls
+            cursor = execute_prepared(conn, sql, params)
+            names = [desc[0] for desc in cursor.description]
+            yield names, cursor.fetchall()[offset:]
+            return
+
+        with conn.cursor(name=f"chat_{uuid.uuid4().hex[:12]}") as cursor:
+            cursor.execute(sql, params)
+            if offset:
+                cursor.scroll(offset)
+            names = [desc[0] for desc in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield names, rows
+
+
+class StreamingChartSampler:
+    """Keeps a bounded summary of a streamed result that charts can be built from"""
+
+    def __init__(self, question: str, max_rows: int = CHART_BUFFER_ROWS):
+        self.question = question
+        self.max_rows = max_rows
+        self.names: List[str] = []
+        self.total_rows = 0
+        self.mode = "buffer"   # buffer -> aggregate | sample | truncate
+        self.buffer: List[tuple] = []
+        self.axes: Optional[Dict[str, Any]] = None
+        self.keys: Optional[np.ndarray] = None
+        self.values: Optional[np.ndarray] = None
+        self.time_unit: Optional[str] = None
+        self.stride = 1
+
+    def add(self, names: List[str], rows: List[tuple]):
+        self.names = names
+        start = self.total_rows
+        self.total_rows += len(rows)
+
+        if self.mode == "buffer":
+            self.buffer.extend(rows)
+            if len(self.buffer) > self.max_rows:
+                self._compact()
+        elif self.mode == "aggregate":
+            self._merge(self._columns(rows))
+        elif self.mode == "sample":
+            self.buffer.extend(row for i, row in enumerate(rows, start) if i % self.stride == 0)
+            if len(self.buffer) > self.max_rows:
+                self.buffer = self.buffer[::2]
+                self.stride *= 2
+
+    def _columns(self, rows: List[tuple]) -> Dict[str, np.ndarray]:
+        if not rows:
+            return {}
+        return combine_year_month({name: to_array([row[i] for row in rows]) for i, name in enumerate(self.names)})
+
+    def _compact(self):
+        """Called once the raw buffer is full: pick axes and switch to a bounded mode"""
+        columns = self._columns(self.buffer)
+        self.axes = choose_axes(self.question, columns)
+
+        if self.axes is None:
+            # Nothing to chart; the first rows are as good a preview as any
+            self.mode = "truncate"
+            self.buffer = self.buffer[:self.max_rows]
+        elif self.axes["type"] == "scatter":
+            self.mode = "sample"
+            self.buffer = self.buffer[::2]
+            self.stride = 2
+        else:
+            self.mode = "aggregate"
+            self.buffer = []
+            x = columns[self.axes["x_axis"]]
+            if x.dtype.kind == "M":
+                self.time_unit = TIME_UNITS[0]
+            self._merge(columns)
+
+    def _merge(self, columns: Dict[str, np.ndarray]):
+        x_axis, y_axis = self.axes["x_axis"], self.axes["y_axis"]
+        x = columns.get(x_axis)
+        if x is None or (self.keys is not None and x.dtype.kind != self.keys.dtype.kind and not self.time_unit):
+            return
+        if self.time_unit and x.dtype.kind != "M":
+            # A batch where every x is NULL comes back untyped; nothing to plot there
+            return
+
+        y = columns.get(y_axis) if y_axis else None
+        if y is None or y.dtype.kind != "f":
+            y = np.ones(len(x), dtype=np.float64) if not y_axis else np.zeros(len(x), dtype=np.float64)
+
+        mask = valid_mask(x)
+        x, y = x[mask], y[mask]
+        if self.time_unit:
+            x = x.astype(f"datetime64[{self.time_unit}]")
+
+        if self.keys is not None:
+            if self.time_unit:
+                x = np.concatenate([self.keys.astype(f"datetime64[{self.time_unit}]"), x])
+            else:
+                x = np.concatenate([self.keys, x])
+            y = np.concatenate([self.values, y])
+        self.keys, self.values = aggregate(x, y, "sum")
+
+        if self.time_unit:
+            # Too many buckets: coarsen (minutes -> hours -> days ...) and re-aggregate
+            while len(self.keys) > MAX_TIME_BUCKETS and self.time_unit != TIME_UNITS[-1]:
+                self.time_unit = TIME_UNITS[TIME_UNITS.index(self.time_unit) + 1]
+                self.keys, self.values = aggregate(self.keys.astype(f"datetime64[{self.time_unit}]"),
+                                                   self.values, "sum")
+        elif len(self.keys) > MAX_CATEGORIES:
+            # Keep the heaviest half and fold the long tail into "Other"
+            order = np.argsort(self.values)[::-1]
+            keep, tail = order[:MAX_CATEGORIES // 2], order[MAX_CATEGORIES // 2:]
+            keys = self.keys[keep].astype(object)
+            self.keys = np.append(keys, OTHER_LABEL).astype(object)
+            self.values = np.append(self.values[keep], self.values[tail].sum())
+
+    def chart_config(self) -> Dict[str, Any]:
+        """Chart-ready config for everything seen so far"""
+        if self.mode == "aggregate":
+            x_axis, y_name = self.axes["x_axis"], self.axes["y_axis"] or "count"
+            keys = self.keys.astype("datetime64[ms]") if self.time_unit else self.keys
+            config = infer_chart_config(self.question, {x_axis: keys, y_name: self.values})
+            config["aggregation"] = self.axes["aggregation"]
+            if self.time_unit:
+                config["time_bucket"] = self.time_unit
+        else:
+            config = infer_chart_config(self.question, self._columns(self.buffer))
+
+        config["total_rows"] = self.total_rows
+        if self.mode != "buffer":
+            config["downsampled"] = True
+            config["sampling"] = self.mode
+        return config
+
+
+def collect_result(question: str, sql: str, params: Optional[Dict[str, Any]], page_size: int,
+                   offset: int = 0, view: str = "auto") -> Dict[str, Any]:
+    """
+    Stream a query once and return one page of rows plus a bounded chart config.
+
+    view="table" stops reading as soon as the page is full; "chart" keeps no rows
+    and only builds the chart; "auto" does both. "from_replica" is True when a
+    read replica answered, which may lag the primary.
+    """
+    database.read_source.set(None)
+    page_rows: List[Dict[str, Any]] = []
+    sampler = StreamingChartSampler(question) if view != "table" else None
+    rows_seen = 0
+
+    for names, rows in iter_result_batches(sql, params, offset):
+        rows_seen += len(rows)
+        if view != "chart" and len(page_rows) < page_size:
+            page_rows.extend(dict(zip(names, row)) for row in rows[:page_size - len(page_rows)])
+        if sampler is not None:
+            sampler.add(names, rows)
+        elif rows_seen > len(page_rows):
+            break
+
+    # The next page starts right after the rows returned here (for view="chart" that is the first page)
+    next_offset = offset + len(page_rows)
+    page = {
+        "offset": offset,
+        "page_size": page_size,
+        "returned_rows": len(page_rows),
+        "total_rows": offset + rows_seen if sampler is not None else None,
+        "next_page_token": encode_page_token(sql, params, next_offset) if rows_seen > len(page_rows) else None,
+    }
+    return {
+        "data": page_rows,
+        "chart_config": sampler.chart_config() if sampler is not None else None,
+        "page": page,
+        "from_replica": database.read_source.get() not in (None, "primary"),
+    }
@@ -0,0 +1,403 @@
+"""
+Sargable rewrites of generated SQL.
+
+The LLM (and the Vanna training examples it imitates) likes to filter on a
+function of a date column: EXTRACT(YEAR FROM i."issueDate") = 2024,
+DATE_TRUNC('month', "issueDate") = DATE_TRUNC('month', CURRENT_DATE),
+"issueDate"::date = '2024-03-01'. Postgres can use neither the index on
+"issueDate" nor the monthly partitions of invoices / payments (see
+partitioning.py) for those, so every row is read. rewrite() turns them into
+equivalent half-open ranges on the bare column:
+
+  EXTRACT(YEAR FROM c) = 2024              c >= '2024-01-01' AND c < '2025-01-01'
+  EXTRACT(YEAR FROM c) = y AND
+    EXTRACT(MONTH FROM c) = m              c >= make_date(y, m, 1) AND c < ... + INTERVAL '1 month'
+  DATE_TRUNC('month', c) = v               c >= v AND c < v + INTERVAL '1 month'
+  CAST(c AS DATE) <= '2024-03-01'          c < '2024-03-02'
+  CAST(c AS TIMESTAMP) > v                 c > v
+
+=, <, <=, >, >=, BETWEEN and IN are handled, with the function on either side,
+and DATE_PART('year', c) is the same expression as EXTRACT. The compared value
+may be any expression without columns (EXTRACT(YEAR FROM CURRENT_DATE) - 1 for
+"last year"); such bounds are computed at execution time, which still prunes
+partitions when the executor starts. A DATE_TRUNC is only rewritten when the
+value is a boundary of its unit (a literal that is one, or a DATE_TRUNC to the
+same or a coarser unit, give or take whole units), since otherwise the two
+forms differ. NULLs compare the same way on both sides, so results never change.
+"""
+
+import os
+import re
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+logger = logging.getLogger(__name__)
+
+SARGABLE_REWRITE = os.getenv("SARGABLE_REWRITE", "true").lower() == "true"
+
+# timestamp(3) columns of the analytics tables. Casts are only looked through
+# for these: a text column cast to DATE compares differently than it would bare
+DATE_COLUMNS = {"issueDate", "dueDate", "paidDate", "createdAt", "updatedAt"}
+_DATE_TYPES = (exp.DataType.Type.DATE, exp.DataType.Type.TIMESTAMP)
+
+# Cheap test that skips parsing for SQL with nothing to rewrite
+_CANDIDATE_RE = re.compile(r"\b(?:EXTRACT|DATE_PART|DATE_TRUNC|CAST)\s*\(|::\s*(?:date|timestamp)\b", re.IGNORECASE)
+
+# Comparison with the function on the right -> the same comparison with it on the left
+_FLIPPED = {exp.GT: exp.LT, exp.GTE: exp.LTE, exp.LT: exp.GT, exp.LTE: exp.GTE, exp.EQ: exp.EQ}
+
+# DATE_TRUNC units that are rewritten: (months, days) in one unit
+TRUNC_UNITS = {"year": (12, 0), "quarter": (3, 0), "month": (1, 0), "week": (0, 7), "day": (0, 1)}
+# EXTRACT fields that single out one period of a year: months per period
+PERIOD_FIELDS = {"month": 1, "quarter": 3}
+
+# (lower, upper) bound of the range of column values a compared value stands for
+Bounds = Tuple[exp.Expression, exp.Expression]
+
+stats: Dict[str, int] = {"queries": 0, "rewritten": 0, "predicates": 0}
+
+
+def _is_constant(node: exp.Expression) -> bool:
+    """No columns, subqueries or aggregates: one value for the whole statement"""
+    return not any(isinstance(n, (exp.Column, exp.Query, exp.AggFunc, exp.Window)) for n in node.walk())
+
+
+def _date_column(node: exp.Expression) -> Optional[exp.Column]:
+    """`node` as a bare column: a column, or a timestamp column cast to DATE / TIMESTAMP"""
+    cast = False
+    while isinstance(node, exp.Cast) and node.to.this in _DATE_TYPES:
+        node, cast = node.this, True
+    if not isinstance(node, exp.Column) or (cast and node.name not in DATE_COLUMNS):
+        return None
+    return node
+
+
+def _int_literal(node: exp.Expression) -> Optional[int]:
+    if isinstance(node, exp.Literal) and not node.is_string and re.fullmatch(r"\d+", node.this):
+        return int(node.this)
+    return None
+
+
+def _unit(node: Optional[exp.Expression]) -> str:
+    name = (node.name if node is not None else "").lower()
+    return name[:-1] if name.endswith("s") else name
+
+
+def _date_literal(node: exp.Expression) -> Optional[datetime]:
+    """The value of '2024-03-01', DATE '2024-03-01' or TIMESTAMP '2024-03-01 00:00'"""
+    if isinstance(node, exp.Cast) and node.to.this in _DATE_TYPES:
+        node = node.this
+    if not (isinstance(node, exp.Literal) and node.is_string):
+        return None
+    try:
+        return datetime.fromisoformat(node.this.strip())
+    except ValueError:
+        return None
+
+
+def _date_sql(value: date) -> exp.Expression:
+    return exp.cast(exp.Literal.string(value.isoformat()), "date")
+
+
+def _interval(amount: int, unit: str) -> exp.Interval:
+    return exp.Interval(this=exp.Literal.string(str(amount)), unit=exp.Var(this=unit.upper()))
+
+
+def _range(column: exp.Column, bounds: Bounds) -> exp.Expression:
+    return exp.and_(column.copy() >= bounds[0], column.copy() < bounds[1])
+
+
+# EXTRACT(YEAR FROM c)
+
+def _year_start(year: exp.Expression, offset: int = 0) -> Optional[exp.Expression]:
+    """January 1st of `year` (+ `offset` years) as a DATE expression"""
+    if isinstance(year, exp.Literal):
+        value = _int_literal(year)
+        if value is None or not 1 <= value + offset <= 9999:
+            return None
+        return _date_sql(date(value + offset, 1, 1))
+    if not _is_constant(year):
+        return None
+    value = exp.cast(year.copy(), "int")
+    if offset:
+        value = exp.Add(this=value, expression=exp.Literal.number(offset))
+    return exp.func("make_date", value, exp.Literal.number(1), exp.Literal.number(1))
+
+
+def _year_bounds(year: exp.Expression) -> Optional[Bounds]:
+    start, end = _year_start(year), _year_start(year, 1)
+    return (start, end) if start is not None and end is not None else None
+
+
+def _extracted(node: exp.Expression, field: str) -> Optional[exp.Column]:
+    """The column in EXTRACT(<field> FROM column), or None"""
+    if isinstance(node, exp.Extract) and node.name.lower() == field:
+        return _date_column(node.expression)
+    return None
+
+
+# DATE_TRUNC(unit, c)
+
+def _aligned(value: exp.Expression, unit: str) -> bool:
+    """Whether `value` certainly starts a `unit`, i.e. DATE_TRUNC(unit, value) = value"""
+    months, days = TRUNC_UNITS[unit]
+    literal = _date_literal(value)
+    if literal is not None:
+        if literal.time() != datetime.min.time():
+            return False
+        if days:
+            return days == 1 or literal.weekday() == 0
+        return literal.day == 1 and (literal.month - 1) % months == 0
+    if isinstance(value, (exp.TimestampTrunc, exp.DateTrunc)):
+        inner = TRUNC_UNITS.get(_unit(value.args.get("unit")))
+        if inner is None:
+            return False
+        # The start of a year also starts a quarter, month and day, but weeks line up with none of them
+        if days:
+            return days == 1 or inner == (0, 7)
+        return bool(inner[0]) and inner[0] % months == 0
+    if isinstance(value, (exp.Add, exp.Sub)) and isinstance(value.expression, exp.Interval):
+        step = TRUNC_UNITS.get(_unit(value.expression.args.get("unit")))
+        amount = value.expression.name.strip()
+        if step is None or not amount.isdigit():
+            return False
+        amount = int(amount)
+        if months:
+            whole = not step[1] and (step[0] * amount) % months == 0
+        else:
+            whole = not step[0] and (step[1] * amount) % days == 0
+        return whole and _aligned(value.this, unit)
+    return False
+
+
+def _trunc_bounds(unit: str) -> Callable[[exp.Expression], Optional[Bounds]]:
+    months, days = TRUNC_UNITS[unit]
+
+    def bounds(value: exp.Expression) -> Optional[Bounds]:
+        if not _is_constant(value) or not _aligned(value, unit):
+            return None
+        literal = _date_literal(value)
+        if literal is not None:
+            start = literal.date()
+            index = start.year * 12 + start.month - 1 + months
+            end = date(index // 12, index % 12 + 1, 1) if months else start + timedelta(days=days)
+            return _date_sql(start), _date_sql(end)
+        step = _interval(months, "month") if months else _interval(days, "day")
+        return value.copy(), exp.Add(this=value.copy(), expression=step)
+
+    return bounds
+
+
+# CAST(c AS DATE)
+
+def _is_date_valued(node: exp.Expression) -> bool:
+    """
+    Constants a DATE is compared with day by day: date literals, CURRENT_DATE,
+    casts to DATE and those plus or minus whole days (not timestamps such as now())
+    """
+    if isinstance(node, exp.CurrentDate) or (isinstance(node, exp.Literal) and node.is_string):
+        return True
+    if isinstance(node, exp.Cast):
+        return node.to.this is exp.DataType.Type.DATE
+    if isinstance(node, (exp.Add, exp.Sub)):
+        return _int_literal(node.expression) is not None and _is_date_valued(node.this)
+    return False
+
+
+def _day_bounds(value: exp.Expression) -> Optional[Bounds]:
+    if not _is_constant(value) or not _is_date_valued(value):
+        return None
+    literal = _date_literal(value)
+    if literal is not None:
+        return _date_sql(literal.date()), _date_sql(literal.date() + timedelta(days=1))
+    day = exp.cast(value.copy(), "date") if isinstance(value, exp.Literal) else value.copy()
+    return day, exp.Add(this=day.copy(), expression=exp.Literal.number(1))
+
+
+def _bucketed(node: exp.Expression) -> Optional[Tuple[exp.Column, Callable[[exp.Expression], Optional[Bounds]]]]:
+    """
+    For a function that maps a date column onto consecutive periods: the column,
+    and how to get the bounds of the period a compared value stands for
+    """
+    column = _extracted(node, "year")
+    if column is not None:
+        return column, _year_bounds
+    if isinstance(node, (exp.TimestampTrunc, exp.DateTrunc)):
+        unit, column = _unit(node.args.get("unit")), _date_column(node.this)
+        if column is not None and unit in TRUNC_UNITS:
+            return column, _trunc_bounds(unit)
+    if isinstance(node, exp.Cast) and node.to.this is exp.DataType.Type.DATE:
+        column = _date_column(node)
+        if column is not None:
+            return column, _day_bounds
+    return None
+
+
+def _rewrite_comparison(node: exp.Expression) -> Optional[exp.Expression]:
+    """Range form of one comparison against a function of a date column, or None to keep it"""
+    if isinstance(node, exp.Between):
+        bucketed = _bucketed(node.this)
+        if bucketed is None:
+            return None
+        column, bounds = bucketed
+        low, high = bounds(node.args["low"]), bounds(node.args["high"])
+        if low is None or high is None:
+            return None
+        return _range(column, (low[0], high[1]))
+
+    if isinstance(node, exp.In):
+        bucketed = _bucketed(node.this)
+        if bucketed is None or node.args.get("query") or not node.expressions:
+            return None
+        column, bounds = bucketed
+        periods = [bounds(value) for value in node.expressions]
+        if any(period is None for period in periods):
+            return None
+        ranges = [_range(column, period) for period in periods]
+        return exp.or_(*ranges) if len(ranges) > 1 else ranges[0]
+
+    kind, left, right = type(node), node.this, node.expression
+    if kind not in _FLIPPED:
+        return None
+    bucketed = _bucketed(left)
+    if bucketed is None:
+        bucketed, right = _bucketed(right), left
+        kind = _FLIPPED[kind]
+        if bucketed is None:
+            return None
+    column, bounds = bucketed
+    period = bounds(right)
+    if period is None:
+        return None
+    if kind is exp.EQ:
+        return _range(column, period)
+    if kind is exp.GTE:
+        return column.copy() >= period[0]
+    if kind is exp.GT:
+        return column.copy() >= period[1]
+    if kind is exp.LT:
+        return column.copy() < period[0]
+    return column.copy() < period[1]
+
+
+# EXTRACT(YEAR FROM c) = y AND EXTRACT(MONTH FROM c) = m
+
+def _equal_to(node: exp.Expression, field: str) -> Optional[Tuple[exp.Column, exp.Expression]]:
+    """(column, value) of EXTRACT(<field> FROM column) = constant, either way round"""
+    if not isinstance(node, exp.EQ):
+        return None
+    for side, value in ((node.this, node.expression), (node.expression, node.this)):
+        column = _extracted(side, field)
+        if column is not None and _is_constant(value):
+            return column, value
+    return None
+
+
+def _period_range(year: exp.Expression, field: str, value: exp.Expression) -> Optional[Bounds]:
+    """Bounds of month / quarter `value` of `year`"""
+    months = PERIOD_FIELDS[field]
+    number, year_number = _int_literal(value), _int_literal(year)
+    if number is not None:
+        if not 1 <= number <= 12 // months:
+            return None
+        first = (number - 1) * months + 1
+        if year_number is not None and 1 <= year_number <= 9998:
+            end = date(year_number + (first + months > 12), (first + months - 1) % 12 + 1, 1)
+            return _date_sql(date(year_number, first, 1)), _date_sql(end)
+        first_month = exp.Literal.number(first)
+    elif isinstance(value, exp.Extract) and value.name.lower() == field:
+        # EXTRACT(MONTH FROM CURRENT_DATE) and the like are valid months by construction
+        first_month = exp.cast(value.copy(), "int")
+        if months > 1:
+            first_month = exp.Add(
+                this=exp.Mul(this=exp.Paren(this=exp.Sub(this=first_month, expression=exp.Literal.number(1))),
+                             expression=exp.Literal.number(months)),
+                expression=exp.Literal.number(1))
+    else:
+        return None
+    start = exp.func("make_date", exp.cast(year.copy(), "int"), first_month, exp.Literal.number(1))
+    return start, exp.Add(this=start.copy(), expression=_interval(months, "month"))
+
+
+def _combine_periods(tree: exp.Expression) -> int:
+    """
+    EXTRACT(YEAR FROM c) = y AND EXTRACT(MONTH FROM c) = m (or QUARTER) in one
+    conjunction: a range over that month instead of a year range plus a filter
+    """
+    combined = 0
+    for conjunction in list(tree.find_all(exp.And)):
+        if isinstance(conjunction.parent, exp.And):
+            continue
+        conjuncts = list(conjunction.flatten())
+        years: Dict[str, Tuple[int, exp.Expression]] = {}
+        for i, conjunct in enumerate(conjuncts):
+            match = _equal_to(conjunct, "year")
+            if match is not None:
+                years.setdefault(match[0].sql(), (i, match[1]))
+        replaced: Dict[int, Optional[exp.Expression]] = {}
+        for i, conjunct in enumerate(conjuncts):
+            for field in PERIOD_FIELDS:
+                match = _equal_to(conjunct, field)
+                if match is None or match[0].sql() not in years:
+                    continue
+                year_index, year = years[match[0].sql()]
+                bounds = _period_range(year, field, match[1])
+                if year_index in replaced or bounds is None:
+                    continue
+                replaced[year_index] = exp.Paren(this=_range(match[0], bounds))
+                replaced[i] = None
+        if replaced:
+            kept = [replaced.get(i, conjunct) for i, conjunct in enumerate(conjuncts)]
+            conjunction.replace(exp.and_(*(c for c in kept if c is not None), copy=False))
+            combined += len(replaced) // 2
+    return combined
+
+
+def _drop_timestamp_casts(tree: exp.Expression) -> int:
+    """CAST(c AS TIMESTAMP) of a timestamp column being compared is just c"""
+    dropped = 0
+    for cast in list(tree.find_all(exp.Cast)):
+        if (cast.to.this is exp.DataType.Type.TIMESTAMP and isinstance(cast.this, exp.Column)
+                and cast.this.name in DATE_COLUMNS and isinstance(cast.parent, exp.Predicate)):
+            cast.replace(cast.this.copy())
+            dropped += 1
+    return dropped
+
+
+def rewrite(sql: str, params: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """`sql` with predicates on functions of date columns turned into ranges on the columns"""
+    if not SARGABLE_REWRITE or not _CANDIDATE_RE.search(sql):
+        return sql, params
+    stats["queries"] += 1
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except Exception as e:
+        logger.debug(f"Sargable rewrite skipped, could not parse SQL: {e}")
+        return sql, params
+
+    rewritten = _combine_periods(tree) + _drop_timestamp_casts(tree)
+    comparisons: List[exp.Expression] = list(
+        tree.find_all(exp.EQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between, exp.In))
+    for node in comparisons:
+        replacement = _rewrite_comparison(node)
+        if replacement is None:
+            continue
+        # Parenthesized so the AND / OR binds the same way as the comparison did
+        node.replace(exp.Paren(this=replacement) if isinstance(replacement, exp.Connector) else replacement)
+        rewritten += 1
+    if not rewritten:
+        return sql, params
+
+    stats["rewritten"] += 1
+    stats["predicates"] += rewritten
+    result = tree.sql(dialect="postgres")
+    logger.info(f"Rewrote {rewritten} date predicate(s) into sargable ranges")
+    return result, params
+
+
+def snapshot() -> Dict[str, Any]:
+    return {"enabled": SARGABLE_REWRITE, **stats}
@@ -0,0 +1,310 @@
+"""
+Local refinement of the previous turn's SQL for simple follow-ups.
+
+Follow-ups such as "only paid ones", "limit to 10", "sort ascending", "for Q4
+2024" or "break that down by vendor" are small edits of the SQL that answered
+the previous question. refine_sql() parses that SQL into an AST with sqlglot,
+applies the edits the follow-up asks for (WHERE predicates, LIMIT, ORDER BY,
+GROUP BY dimension) and prints it back, so the turn needs no LLM call.
+
+Every word of the follow-up has to be accounted for by a recognized edit (or be
+filler); if anything is left over, or the SQL does not have the shape an edit
+needs, refine_sql() returns None and the caller falls back to the LLM.
+"""
+
+import re
+import logging
+from typing import Callable, List, Optional
+
+import sqlglot
+from sqlglot import exp
+
+from sql_templates import NUMBER_WORDS, PERIOD_PREDICATES, extract_period, normalize_question, render_sql
+
+logger = logging.getLogger(__name__)
+
+MAX_LIMIT = 10000
+
+STATUS_WORDS = {
+    "paid": ["PAID"],
+    "pending": ["PENDING"],
+    "overdue": ["OVERDUE"],
+    "cancelled": ["CANCELLED"],
+    "canceled": ["CANCELLED"],
+    "draft": ["DRAFT"],
+    "unpaid": ["PENDING", "OVERDUE"],
+    "open": ["PENDING", "OVERDUE"],
+}
+
+# Follow-up word -> (table, column) a result can be grouped by
+DIMENSIONS = {
+    "vendor": ("vendors", "name"),
+    "supplier": ("vendors", "name"),
+    "vendor category": ("vendors", "category"),
+    "customer": ("customers", "name"),
+    "client": ("customers", "name"),
+    "category": ("invoices", "category"),
+    "currency": ("invoices", "currency"),
+    "status": ("invoices", "status"),
+    "country": ("vendors", "country"),
+    "city": ("vendors", "city"),
+}
+TIME_DIMENSIONS = {"day": "day", "week": "week", "month": "month", "quarter": "quarter", "year": "year"}
+
+# How to reach each table from invoices when a new dimension needs a join
+JOINS = {
+    "vendors": ("v", 'v.id = {invoices}."vendorId"'),
+    "customers": ("c", 'c.id = {invoices}."customerId"'),
+}
+
+_NUMBER = r"(?P<n>\d+|" + "|".join(NUMBER_WORDS) + r")"
+_DIMENSION = r"(?P<dim>" + "|".join(sorted(list(DIMENSIONS) + list(TIME_DIMENSIONS), key=len, reverse=True)) + r")s?"
+
+LIMIT_RE = re.compile(r"\b(?:limit(?: it| that| them)?(?: to)?|top|first|only show|show only|just) " + _NUMBER + r"\b")
+DIRECTION_RE = re.compile(
+    r"\b(?P<dir>asc|ascending|desc|descending|"
+    r"(?:lowest|smallest|least|oldest|earliest) first|(?:highest|largest|biggest|most|newest|latest) first|"
+    r"reverse(?: order)?)\b"
+)
+ORDER_BY_RE = re.compile(r"\b(?:sort|order)(?:ed)?(?: it| that| them)? by (?P<col>[a-z_]+)\b")
+GROUP_BY_RE = re.compile(
+    r"\b(?:(?:break|split)(?: it| that| this| them)?(?: down)?|group(?:ed)?(?: it| that| this| them)?|per|by) "
+    r"(?:by )?" + _DIMENSION + r"\b"
+)
+STATUS_RE = re.compile(r"\b(?P<status>" + "|".join(STATUS_WORDS) + r")\b")
+
+# Words that carry no edit of their own
+FILLER = set("""
+now then and also only just show me the a an ones one those these them that this it its instead please
+for in of with invoices invoice results result rows row but sort sorted order ordered by to limit
+same data again what about how can you give list make do let see only keep
+""".split())
+
+
+def _from_table(select: exp.Select):
+    clause = select.args.get("from_") or select.args.get("from")
+    return clause.this if clause is not None else None
+
+
+def _tables(select: exp.Select) -> List[exp.Table]:
+    """Plain tables in the FROM / JOIN clauses of this SELECT (not in subqueries)"""
+    found = [_from_table(select)] + [join.this for join in select.args.get("joins") or []]
+    return [table for table in found if isinstance(table, exp.Table)]
+
+
+def _alias_of(select: exp.Select, table_name: str) -> Optional[str]:
+    for table in _tables(select):
+        if table.name.lower() == table_name:
+            return table.alias_or_name
+    return None
+
+
+def _column(name: str, table: str) -> exp.Column:
+    return exp.Column(this=exp.to_identifier(name, quoted=name != name.lower()), table=exp.to_identifier(table))
+
+
+def _conjuncts(condition: Optional[exp.Expression]) -> List[exp.Expression]:
+    if condition is None:
+        return []
+    if isinstance(condition, exp.And):
+        return _conjuncts(condition.left) + _conjuncts(condition.right)
+    if isinstance(condition, exp.Paren):
+        inner = condition.this
+        return _conjuncts(inner) if isinstance(inner, exp.And) else [condition]
+    return [condition]
+
+
+def _replace_predicate(select: exp.Select, column: str, predicate: exp.Expression):
+    """Drop top-level WHERE conjuncts that filter on `column`, then AND in `predicate`"""
+    where = select.args.get("where")
+    kept = [c for c in _conjuncts(where.this if where else None)
+            if not any(col.name == column for col in c.find_all(exp.Column))]
+    # "WHERE TRUE" placeholders from templates are no longer needed once there is a real predicate
+    kept = [c for c in kept if not isinstance(c, exp.Boolean)]
+    select.set("where", None)
+    for condition in kept + [predicate]:
+        select.where(condition, copy=False)
+
+
+def _is_aggregate(expression: exp.Expression) -> bool:
+    return expression.find(exp.AggFunc) is not None
+
+
+def _ordered(target: exp.Expression, descending: bool) -> exp.Ordered:
+    # Postgres puts NULLs first for DESC and last for ASC; say nothing beyond that
+    return exp.Ordered(this=target, desc=descending, nulls_first=descending)
+
+
+def _apply_status(select: exp.Select, values: List[str]) -> bool:
+    alias = _alias_of(select, "invoices")
+    if alias is None:
+        return False
+    column = _column("status", alias)
+    literals = [exp.Literal.string(v) for v in values]
+    predicate = exp.EQ(this=column, expression=literals[0]) if len(literals) == 1 else \
+        exp.In(this=column, expressions=literals)
+    _replace_predicate(select, "status", predicate)
+    return True
+
+
+def _apply_period(select: exp.Select, kind: str, params: dict) -> bool:
+    alias = _alias_of(select, "invoices")
+    if alias is None:
+        return False
+    column = _column("issueDate", alias).sql(dialect="postgres")
+    predicate = sqlglot.condition(render_sql(PERIOD_PREDICATES[kind].format(col=column), params), dialect="postgres")
+    _replace_predicate(select, "issueDate", predicate)
+    return True
+
+
+def _apply_limit(select: exp.Select, n: int) -> bool:
+    select.limit(max(1, min(n, MAX_LIMIT)), copy=False)
+    return True
+
+
+def _apply_direction(select: exp.Select, descending: Optional[bool]) -> bool:
+    order = select.args.get("order")
+    if order is None:
+        # Nothing to flip yet: order by the first aggregate, e.g. the total
+        measure = next((e for e in select.expressions if _is_aggregate(e)), None)
+        if measure is None:
+            return False
+        target = exp.to_identifier(measure.alias) if measure.alias else measure.unalias().copy()
+        select.order_by(_ordered(target, bool(descending)), copy=False)
+        return True
+    for ordered in order.expressions:
+        flipped = (not ordered.args.get("desc")) if descending is None else descending
+        ordered.set("desc", flipped)
+        ordered.set("nulls_first", flipped)
+    return True
+
+
+def _apply_order_by(select: exp.Select, word: str, descending: Optional[bool]) -> bool:
+    for expression in select.expressions:
+        name = expression.alias_or_name.lower()
+        if word.rstrip("s") in name:
+            target = exp.to_identifier(expression.alias) if expression.alias else expression.unalias().copy()
+            if descending is None:
+                descending = _is_aggregate(expression)
+            select.set("order", None)
+            select.order_by(_ordered(target, descending), copy=False)
+            return True
+    return False
+
+
+def _apply_group_by(select: exp.Select, dimension: str) -> bool:
+    if select.args.get("group") is None:
+        return False
+    invoices = _alias_of(select, "invoices")
+    if invoices is None:
+        return False
+
+    if dimension in TIME_DIMENSIONS:
+        unit = TIME_DIMENSIONS[dimension]
+        key = sqlglot.parse_one(f"DATE_TRUNC('{unit}', {_column('issueDate', invoices).sql('postgres')})",
+                                read="postgres")
+        label = dimension
+    else:
+        table, column = DIMENSIONS[dimension]
+        alias = _alias_of(select, table)
+        if alias is None:
+            if table not in JOINS:
+                return False
+            alias, on = JOINS[table]
+            if alias in {t.alias_or_name for t in _tables(select)}:
+                return False
+            select.join(exp.to_table(table).as_(alias), on=on.format(invoices=invoices),
+                        join_type="left", dialect="postgres", copy=False)
+        key = _column(column, alias)
+        label = dimension.replace(" ", "_")
+
+    measures = [e for e in select.expressions if _is_aggregate(e)]
+    if not measures:
+        return False
+    regrouped = [e.sql("postgres") for e in select.args["group"].expressions] != [key.sql("postgres")]
+    select.set("expressions", [exp.alias_(key.copy(), label)] + measures)
+    select.set("group", exp.Group(expressions=[key.copy()]))
+    if regrouped:
+        # "top 5 vendors" -> "by month" means every month, not 5 of them; a limit in
+        # the same follow-up is applied after this edit
+        select.set("limit", None)
+
+    order = select.args.get("order")
+    if dimension in TIME_DIMENSIONS:
+        # A time breakdown reads in time order
+        select.set("order", exp.Order(expressions=[_ordered(exp.to_identifier(label), False)]))
+    elif order is not None:
+        # Ordering by a dimension that is gone no longer makes sense; keep orderings by measures
+        names = {m.alias_or_name for m in measures}
+        kept = [o for o in order.expressions if _is_aggregate(o.this) or o.this.name in names]
+        select.set("order", exp.Order(expressions=kept) if kept else None)
+    return True
+
+
+def _leftover(text: str) -> List[str]:
+    return [word for word in text.split() if word not in FILLER]
+
+
+def refine_sql(previous_sql: str, follow_up: str) -> Optional[str]:
+    """Apply a follow-up to the previous SQL locally; None when the LLM is needed"""
+    text = normalize_question(follow_up)
+    edits: List[Callable[[exp.Select], bool]] = []
+
+    period, params, text = extract_period(text)
+    if period:
+        edits.append(lambda s: _apply_period(s, period, params))
+
+    # descending: True / False, or None for "reverse" (flip whatever is there)
+    descending = None
+    direction = DIRECTION_RE.search(text)
+    if direction:
+        word = direction.group("dir")
+        if not word.startswith("reverse"):
+            descending = word.startswith("desc") or word.split()[0] in (
+                "highest", "largest", "biggest", "most", "newest", "latest"
+            )
+        text = text[:direction.start()] + " " + text[direction.end():]
+
+    match = ORDER_BY_RE.search(text)
+    if match:
+        word = match.group("col")
+        edits.append(lambda s: _apply_order_by(s, word, descending))
+        text = text[:match.start()] + " " + text[match.end():]
+    elif direction:
+        edits.append(lambda s: _apply_direction(s, descending))
+
+    match = LIMIT_RE.search(text)
+    if match:
+        n = match.group("n")
+        n = NUMBER_WORDS[n] if n in NUMBER_WORDS else int(n)
+        edits.append(lambda s: _apply_limit(s, n))
+        text = text[:match.start()] + " " + text[match.end():]
+
+    match = GROUP_BY_RE.search(text)
+    if match:
+        dimension = match.group("dim")
+        # First, so the follow-up's own ordering and limit apply to the new grouping
+        edits.insert(0, lambda s: _apply_group_by(s, dimension))
+        text = text[:match.start()] + " " + text[match.end():]
+
+    match = STATUS_RE.search(text)
+    if match:
+        values = STATUS_WORDS[match.group("status")]
+        edits.append(lambda s: _apply_status(s, values))
+        text = text[:match.start()] + " " + text[match.end():]
+
+    if not edits or _leftover(text):
+        return None
+
+    try:
+        tree = sqlglot.parse_one(previous_sql, read="postgres")
+    except sqlglot.errors.ParseError as e:
+        logger.info(f"Previous SQL not parseable for refinement: {e}")
+        return None
+    if not isinstance(tree, exp.Select):
+        return None
+
+    for edit in edits:
+        if not edit(tree):
+            return None
+    return tree.sql(dialect="postgres")
@@ -0,0 +1,129 @@
+"""
+Incremental SQL extraction from streamed LLM completions.
+
+The model is asked for a bare SQL query but often wraps it in a markdown fence
+or adds trailing chatter after it. Rather than waiting for (and paying for)
+the whole completion, stream_sql() reads the token stream, stops as soon as a
+complete statement has been produced (a `;` outside quotes and comments, or
+the closing fence) and closes the stream so the provider stops generating.
+"""
+
+import re
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+FENCE = "```"
+# Unfenced text is only cut at `;` once it looks like SQL, so a preamble such as
+# "Sure; here is the query" does not end the stream early
+SQL_START_RE = re.compile(r"^\s*(SELECT|WITH|EXPLAIN|VALUES|TABLE)\b", re.IGNORECASE)
+
+
+class StreamCancelled(Exception):
+    """The stream was abandoned through its `cancel` event; what it produced so far is not a result"""
+
+
+def _statement_end(text: str) -> Optional[int]:
+    """Index of the first `;` outside string literals, quoted identifiers and comments"""
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch in ("'", '"'):
+            close = text.find(ch, i + 1)
+            # Doubled quotes are escapes and simply re-open the literal on the next pass
+            if close == -1:
+                return None
+            i = close + 1
+        elif text.startswith("--", i):
+            close = text.find("\n", i)
+            if close == -1:
+                return None
+            i = close + 1
+        elif text.startswith("/*", i):
+            close = text.find("*/", i + 2)
+            if close == -1:
+                return None
+            i = close + 2
+        elif ch == ";":
+            return i
+        else:
+            i += 1
+    return None
+
+
+def complete_statement(text: str) -> Optional[str]:
+    """The finished SQL statement in `text` so far, or None if more is needed"""
+    fence = text.find(FENCE)
+    if fence != -1:
+        body_start = text.find("\n", fence)
+        if body_start == -1:
+            return None
+        body = text[body_start + 1:]
+        end = _statement_end(body)
+        close = body.find(FENCE)
+        if close != -1 and (end is None or close < end):
+            return body[:close].strip()
+        return body[:end].strip() if end is not None else None
+
+    if not SQL_START_RE.match(text):
+        return None
+    end = _statement_end(text)
+    return text[:end].strip() if end is not None else None
+
+
+def clean_sql(text: str) -> str:
+    """Extract the SQL from a full completion (markdown fences, trailing `;`)"""
+    statement = complete_statement(text)
+    if statement is None:
+        statement = text.strip()
+        if statement.startswith(FENCE):
+            statement = statement[len(FENCE):]
+            if statement[:3].lower() == "sql":
+                statement = statement[3:]
+            statement = statement.replace(FENCE, "")
+    return statement.strip().rstrip(";").strip()
+
+
+def stream_sql(backend, system: str, prompt: str, max_tokens: int = 500,
+               temperature: float = 0.1, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """
+    Stream a completion and stop at the end of the first SQL statement.
+
+    Returns a completion dict like LLMBackend.complete(), with "text" already
+    cleaned to bare SQL and "stopped_early" telling whether the stream was cut.
+    completion_tokens counts streamed chunks (about one token each), since the
+    provider's usage totals never arrive for a stream that is closed early.
+    Setting `cancel` abandons the stream at the next chunk and raises
+    StreamCancelled, so truncated SQL is never returned as if it were complete.
+    """
+    started = time.perf_counter()
+    chunks = backend.stream(system, prompt, max_tokens, temperature)
+    text, statement, received, cancelled = "", None, 0, False
+    try:
+        for delta in chunks:
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+            received += 1
+            text += delta
+            statement = complete_statement(text)
+            if statement is not None:
+                break
+    finally:
+        # Closing the generator closes the HTTP stream, so generation stops server-side too
+        chunks.close()
+
+    if cancelled:
+        raise StreamCancelled(f"Stream cancelled after {received} chunks")
+    if statement is not None:
+        logger.info(f"SQL complete after {received} chunks in {time.perf_counter() - started:.2f}s, stream closed")
+    return {
+        "text": clean_sql(statement if statement is not None else text),
+        "prompt_tokens": 0,
+        "completion_tokens": received,
+        "latency": time.perf_counter() - started,
+        "stopped_early": statement is not None,
+    }
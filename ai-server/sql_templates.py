@@ -0,0 +1,174 @@
+"""
+Template fast path for well-known question shapes.
+
+Questions such as "top 5 vendors by spend in Q3 2024" or "total spend this year"
+map onto a handful of canned queries. Recognizing them locally lets /chat skip
+the LLM round-trip entirely; anything that is not an exact match falls through
+to Groq / Vanna as before.
+"""
+
+import re
+from typing import Any, Dict, Optional
+
+# Small number words people actually type in "top N" questions
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "fifteen": 15, "twenty": 20, "fifty": 50, "hundred": 100,
+}
+
+DEFAULT_TOP_N = 5
+MAX_TOP_N = 100
+
+# Period phrases, checked in order. Each one is stripped from the question
+# before the shape patterns are matched against what is left.
+PERIOD_PATTERNS = [
+    ("quarter", re.compile(r"\b(?:for |in |during )?(?:the )?(?:q|quarter )(?P<quarter>[1-4])(?: of)? (?P<year>\d{4})\b")),
+    ("this_year", re.compile(r"\b(?:for |in |during )?(?:this|the current) year\b")),
+    ("last_year", re.compile(r"\b(?:for |in |during )?(?:the )?last year\b")),
+    ("this_quarter", re.compile(r"\b(?:for |in |during )?(?:this|the current) quarter\b")),
+    ("last_quarter", re.compile(r"\b(?:for |in |during )?(?:the )?last quarter\b")),
+    ("this_month", re.compile(r"\b(?:for |in |during )?(?:this|the current) month\b")),
+    # A bare number is not a year ("top 2000 vendors"): it needs "in", "for", "during" or "the year"
+    ("year", re.compile(r"\b(?:(?:for|in|during) (?:the year )?|the year )(?P<year>(?:19|20)\d{2})\b")),
+]
+
+# Sargable range predicates over a date column, one per period kind
+PERIOD_PREDICATES = {
+    "quarter": (
+        "{col} >= make_date(%(year)s, %(quarter)s * 3 - 2, 1) "
+        "AND {col} < make_date(%(year)s, %(quarter)s * 3 - 2, 1) + INTERVAL '3 months'"
+    ),
+    "year": "{col} >= make_date(%(year)s, 1, 1) AND {col} < make_date(%(year)s + 1, 1, 1)",
+    "this_year": "{col} >= DATE_TRUNC('year', CURRENT_DATE)",
+    "last_year": (
+        "{col} >= DATE_TRUNC('year', CURRENT_DATE) - INTERVAL '1 year' "
+        "AND {col} < DATE_TRUNC('year', CURRENT_DATE)"
+    ),
+    "this_quarter": "{col} >= DATE_TRUNC('quarter', CURRENT_DATE)",
+    "last_quarter": (
+        "{col} >= DATE_TRUNC('quarter', CURRENT_DATE) - INTERVAL '3 months' "
+        "AND {col} < DATE_TRUNC('quarter', CURRENT_DATE)"
+    ),
+    "this_month": "{col} >= DATE_TRUNC('month', CURRENT_DATE)",
+}
+
+_LEAD = r"(?:(?:what is|what's|what are|who are|show(?: me)?|list|give me|get) )?(?:our |the |all )?"
+_SPEND = r"(?:spend|spending|expenses)"
+
+# Question shapes. The pattern must match the whole (period-stripped) question.
+SHAPE_PATTERNS = [
+    ("top_vendors", re.compile(
+        _LEAD + r"(?:top|biggest|largest) (?:(?P<n>\d+|" + "|".join(NUMBER_WORDS) + r") )?vendors"
+        r"(?: by (?:total )?" + _SPEND + r")?"
+    )),
+    ("spend_by_category", re.compile(
+        _LEAD + r"(?:total )?" + _SPEND + r" (?:by|per) category"
+    )),
+    ("total_spend", re.compile(_LEAD + r"total " + _SPEND)),
+    ("invoice_count", re.compile(
+        r"(?:how many invoices(?: do we have| are there| were (?:issued|processed))?"
+        r"|" + _LEAD + r"(?:total )?(?:number|count) of invoices)"
+    )),
+    ("average_invoice", re.compile(_LEAD + r"average invoice (?:amount|value)")),
+    ("overdue_invoices", re.compile(_LEAD + r"overdue invoices")),
+    ("monthly_trend", re.compile(_LEAD + r"monthly (?:invoice |spend |spending )?trends?")),
+]
+
+# SQL per shape. {period} is replaced by an "AND <predicate>" clause (or nothing).
+SHAPE_SQL = {
+    "top_vendors": (
+        "SELECT v.name, SUM(i.\"totalAmount\") as total_spend FROM vendors v "
+        "JOIN invoices i ON v.id = i.\"vendorId\" WHERE i.status = 'PAID'{period} "
+        "GROUP BY v.id, v.name ORDER BY total_spend DESC LIMIT %(n)s"
+    ),
+    "spend_by_category": (
+        "SELECT i.category, SUM(i.\"totalAmount\") as total_spend FROM invoices i "
+        "WHERE i.status = 'PAID'{period} GROUP BY i.category ORDER BY total_spend DESC"
+    ),
+    "total_spend": (
+        "SELECT SUM(i.\"totalAmount\") as total_spend FROM invoices i "
+        "WHERE i.status = 'PAID'{period}"
+    ),
+    "invoice_count": (
+        "SELECT COUNT(*) as total_invoices FROM invoices i WHERE TRUE{period}"
+    ),
+    "average_invoice": (
+        "SELECT AVG(i.\"totalAmount\") as average_amount FROM invoices i "
+        "WHERE i.status = 'PAID'{period}"
+    ),
+    "overdue_invoices": (
+        "SELECT i.\"invoiceNumber\", v.name as vendor, i.\"totalAmount\", i.\"dueDate\" "
+        "FROM invoices i JOIN vendors v ON i.\"vendorId\" = v.id "
+        "WHERE (i.status = 'OVERDUE' OR (i.status = 'PENDING' AND i.\"dueDate\" < CURRENT_DATE)){period} "
+        "ORDER BY i.\"dueDate\" LIMIT 100"
+    ),
+    "monthly_trend": (
+        "SELECT DATE_TRUNC('month', i.\"issueDate\") as month, COUNT(*) as invoice_count, "
+        "SUM(i.\"totalAmount\") as total_spend FROM invoices i WHERE i.status = 'PAID'{period} "
+        "GROUP BY month ORDER BY month DESC LIMIT 12"
+    ),
+}
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    text = re.sub(r"[?!.,;:]", " ", question.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def extract_period(text: str):
+    """Find the first period phrase and return (kind, params, remaining_text)"""
+    for kind, pattern in PERIOD_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        params = {key: int(value) for key, value in match.groupdict().items() if value}
+        remaining = re.sub(r"\s+", " ", text[:match.start()] + " " + text[match.end():]).strip()
+        return kind, params, remaining
+    return None, {}, text
+
+
+def match_template(question: str) -> Optional[Dict[str, Any]]:
+    """
+    Match a question against the known shapes.
+
+    Returns a dict with the intent name, parameterized SQL (psycopg named
+    placeholders) and its params, or None when the question is not a known shape.
+    """
+    text = normalize_question(question)
+    period, params, remaining = extract_period(text)
+
+    for intent, pattern in SHAPE_PATTERNS:
+        match = pattern.fullmatch(remaining)
+        if not match:
+            continue
+
+        if intent == "top_vendors":
+            n = match.group("n")
+            if n is None:
+                n = DEFAULT_TOP_N
+            else:
+                n = NUMBER_WORDS[n] if n in NUMBER_WORDS else int(n)
+            params["n"] = max(1, min(n, MAX_TOP_N))
+
+        period_sql = ""
+        if period:
+            period_sql = " AND " + PERIOD_PREDICATES[period].format(col='i."issueDate"')
+
+        return {
+            "intent": intent,
+            "period": period,
+            "sql": SHAPE_SQL[intent].format(period=period_sql),
+            "params": params,
+        }
+
+    return None
+
+
+def render_sql(sql: str, params: Dict[str, Any]) -> str:
+    """Inline template params for display or for runners that only take plain SQL"""
+    if not params:
+        return sql
+    # Template params are always validated ints, so inlining them is safe
+    return sql % {key: int(value) for key, value in params.items()}
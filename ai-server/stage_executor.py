@@ -0,0 +1,116 @@
+"""
+Bounded thread pool for blocking pipeline stages.
+
+Vanna's generate_sql / run_sql / generate_explanation are synchronous network
+calls. Running them directly inside an async endpoint blocks the event loop for
+every other request on the worker, so they are handed to a dedicated, bounded
+executor instead. Each stage gets its own timeout and is abandoned as soon as
+the client disconnects.
+"""
+
+import os
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+STAGE_WORKERS = int(os.getenv("STAGE_EXECUTOR_WORKERS", 8))
+# Stages allowed to wait for a worker before new ones are rejected
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_EXECUTOR_QUEUE", STAGE_WORKERS * 4))
+DISCONNECT_POLL_INTERVAL = 0.25
+
+_executor = None
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+class StageTimeout(Exception):
+    """A stage did not finish within its time budget"""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"Stage '{stage}' timed out after {timeout:g}s")
+        self.stage = stage
+
+
+class ClientDisconnected(Exception):
+    """The client went away while a stage was running"""
+
+
+class ExecutorBusy(Exception):
+    """Too many stages already queued; shed load instead of queueing forever"""
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+    return _executor
+
+
+def shutdown_executor():
+    """Stop accepting work and drop queued stages (used on shutdown)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _wait_for_disconnect(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+def _release_slot(_future):
+    # Runs when the worker is actually done (or the stage was cancelled before starting)
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+async def run_stage(stage: str, fn: Callable, *args: Any, timeout: float,
+                    request: Optional[Request] = None, **kwargs: Any) -> Any:
+    """
+    Run a blocking callable on the stage executor and await its result.
+
+    Raises StageTimeout, ClientDisconnected or ExecutorBusy. On timeout or
+    disconnect the stage is cancelled if it has not started yet; a stage that is
+    already running finishes in the background and its result is discarded.
+    """
+    global _pending
+    with _pending_lock:
+        if _pending >= STAGE_WORKERS + STAGE_QUEUE_SIZE:
+            raise ExecutorBusy(f"Server busy, too many pending '{stage}' stages")
+        _pending += 1
+
+    # Carry context variables (e.g. the request priority) into the worker thread
+    context = contextvars.copy_context()
+    work = get_executor().submit(context.run, functools.partial(fn, *args, **kwargs))
+    work.add_done_callback(_release_slot)
+    future = asyncio.wrap_future(work)
+
+    watchers = {future}
+    disconnect = None
+    if request is not None:
+        disconnect = asyncio.ensure_future(_wait_for_disconnect(request))
+        watchers.add(disconnect)
+
+    try:
+        done, _ = await asyncio.wait(watchers, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if future in done:
+            return future.result()
+        future.cancel()
+        if disconnect is not None and disconnect in done:
+            logger.info(f"Client disconnected during '{stage}', abandoning request")
+            raise ClientDisconnected(stage)
+        logger.warning(f"Stage '{stage}' exceeded {timeout:g}s")
+        raise StageTimeout(stage, timeout)
+    finally:
+        if disconnect is not None:
+            disconnect.cancel()
@@ -0,0 +1,183 @@
+"""
+Per-organization scoping of generated SQL.
+
+The organization comes from the TENANT_HEADER request header (set by the API in
+front of this server) and is kept in a context variable for the rest of the
+request, including the stage worker threads. Every query then runs scoped to it:
+
+  RLS      the tenant is set on the borrowed pooled connection for the current
+           transaction (set_config('app.tenant_id', ..., true)), so the row
+           level security policies of enable-tenant-rls.sql filter rows;
+           nothing is left on the connection when it goes back to the pool.
+           Unscoped queries set it to ALL_TENANTS ('*') explicitly: for roles
+           in ai_server_scoped the policies fail closed and return no rows
+           when the setting is missing
+  rewrite  tables with a TENANT_COLUMN whose policy would not apply to this
+           role (RLS off, not forced for the owner, BYPASSRLS, no tenant
+           policy) are replaced in the SQL AST by
+           (SELECT * FROM t WHERE "organizationId" = '<tenant>')
+
+Tables without the column are shared by all tenants. Caches that hold query
+results or conversation state are keyed by tenant (see partition_key()).
+"""
+
+import os
+import re
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.scope import traverse_scope
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+TENANT_HEADER = os.getenv("TENANT_HEADER", "X-Organization-Id")
+TENANT_COLUMN = os.getenv("TENANT_COLUMN", "organizationId")
+TENANT_REQUIRED = os.getenv("TENANT_REQUIRED", "false").lower() == "true"
+TENANT_SETTING = "app.tenant_id"
+# Explicit "every organization" value; the header pattern below can never produce it
+ALL_TENANTS = "*"
+# Endpoints that serve no tenant data and so never need the header
+UNSCOPED_PATHS = ("/", "/health", "/metrics", "/schema", "/docs", "/openapi.json")
+_TENANT_ID_RE = re.compile(r"^[\w.:@-]{1,128}$")
+
+current_tenant: ContextVar[Optional[str]] = ContextVar("current_tenant", default=None)
+
+_tables_lock = threading.Lock()
+# Tenant-scoped table -> whether RLS already filters it for our role
+_scoped_tables: Optional[Dict[str, bool]] = None
+
+
+class TenantError(ValueError):
+    """Missing or malformed tenant, or SQL that cannot be scoped to it"""
+
+
+def tenant_from(request: Request) -> Optional[str]:
+    """The organization a request is made for, validated"""
+    tenant = (request.headers.get(TENANT_HEADER) or "").strip()
+    if not tenant:
+        if TENANT_REQUIRED and request.url.path not in UNSCOPED_PATHS:
+            raise TenantError(f"{TENANT_HEADER} header is required")
+        return None
+    if not _TENANT_ID_RE.match(tenant):
+        raise TenantError(f"Invalid {TENANT_HEADER} header")
+    return tenant
+
+
+def add_tenant_middleware(app: FastAPI):
+    """Scope every request to the tenant named in its TENANT_HEADER"""
+
+    @app.middleware("http")
+    async def tenant_scope(request: Request, call_next):
+        try:
+            tenant = tenant_from(request)
+        except TenantError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+        with scoped(tenant):
+            return await call_next(request)
+
+
+@contextmanager
+def scoped(tenant: Optional[str]):
+    """Run the block (and stages it starts) on behalf of `tenant`"""
+    token = current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        current_tenant.reset(token)
+
+
+def partition_key(key: Any) -> Any:
+    """`key` qualified by the current tenant, for caches shared across requests"""
+    tenant = current_tenant.get()
+    if tenant is None:
+        return key
+    if isinstance(key, str):
+        return f"{tenant}\x1f{key}"
+    return (tenant, key)
+
+
+def scoped_tables(conn) -> Dict[str, bool]:
+    """Tables carrying TENANT_COLUMN, and whether RLS filters them for the connected role"""
+    global _scoped_tables
+    if _scoped_tables is None:
+        rows = conn.execute(
+            "SELECT c.relname,"
+            "       c.relrowsecurity AND NOT (r.rolsuper OR r.rolbypassrls)"
+            "       AND (c.relforcerowsecurity OR c.relowner <> r.oid)"
+            "       AND EXISTS (SELECT 1 FROM pg_policies p WHERE p.schemaname = 'public'"
+            "                   AND p.tablename = c.relname AND p.qual LIKE %s)"
+            " FROM pg_class c"
+            " JOIN pg_attribute a ON a.attrelid = c.oid AND a.attname = %s AND NOT a.attisdropped"
+            " JOIN pg_roles r ON r.rolname = current_user"
+            # Partitions are read through their parent, whose policies apply
+            " WHERE c.relnamespace = 'public'::regnamespace AND c.relkind IN ('r', 'p') AND NOT c.relispartition",
+            (f"%{TENANT_SETTING}%", TENANT_COLUMN),
+        ).fetchall()
+        with _tables_lock:
+            _scoped_tables = {name: bool(enforced) for name, enforced in rows}
+        logger.info(f"Tenant-scoped tables (RLS enforced): {_scoped_tables}")
+    return _scoped_tables
+
+
+def scope_sql(sql: str, tenant: str, tables: Iterable[str], dialect: str = "postgres") -> str:
+    """Replace every reference to `tables` in `sql` by a subquery filtered to `tenant`"""
+    tables = set(tables)
+    try:
+        tree = sqlglot.parse_one(sql, read=dialect)
+    except Exception as e:
+        raise TenantError(f"Could not scope query to the organization: {e}")
+    # Only references that resolve to a real table, not to a CTE of the same name (a CTE
+    # body's own "FROM invoices" still reads the table)
+    try:
+        scopes = traverse_scope(tree)
+    except Exception as e:
+        raise TenantError(f"Could not scope query to the organization: {e}")
+    if not scopes and tree.find(exp.Table):
+        raise TenantError("Could not scope query to the organization: not a query")
+    references = [table for scope in scopes for table in scope.tables
+                  if scope.sources.get(table.alias_or_name) is table]
+    changed = False
+    for table in references:
+        name = table.name.lower()
+        if name not in tables or table.db.lower() not in ("", "public"):
+            continue
+        source = table.copy()
+        source.set("alias", None)
+        filtered = (
+            exp.select("*")
+            .from_(source)
+            .where(exp.column(TENANT_COLUMN, quoted=True).eq(exp.Literal.string(tenant)))
+        )
+        # Keep the name the rest of the query refers to the table by
+        alias = table.args.get("alias") or exp.TableAlias(this=table.this.copy())
+        table.replace(exp.Subquery(this=filtered, alias=alias.copy()))
+        changed = True
+    return tree.sql(dialect=dialect) if changed else sql
+
+
+def all_tenants(conn, local: bool = True):
+    """Read every organization's rows on `conn` (for the transaction, or the session with local=False)"""
+    conn.execute("SELECT set_config(%s, %s, %s)", (TENANT_SETTING, ALL_TENANTS, local))
+
+
+def scope_query(conn, sql: str, params: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Scope a query about to run on `conn` to the current tenant: the tenant is set
+    for RLS, and tables RLS does not cover are filtered in the SQL itself
+    """
+    tenant = current_tenant.get()
+    if tenant is None:
+        all_tenants(conn)
+        return sql, params
+    conn.execute("SELECT set_config(%s, %s, true)", (TENANT_SETTING, tenant))
+    unprotected: Set[str] = {table for table, enforced in scoped_tables(conn).items() if not enforced}
+    if unprotected:
+        sql = scope_sql(sql, tenant, unprotected)
+    return sql, params
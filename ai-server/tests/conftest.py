@@ -0,0 +1,9 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# The servers pick their result path from DATABASE_URL at import time; the
+# tests that need a real database use TEST_DATABASE_URL instead
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/flowbit_test")
+os.environ.setdefault("STARTUP_WARM_UP", "false")
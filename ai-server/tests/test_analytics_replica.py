@@ -0,0 +1,29 @@
+import data_version
+import tenancy
+from analytics_replica import TABLES, AnalyticsReplica
+
+
+def test_a_table_whose_columns_changed_is_reloaded(monkeypatch):
+    replica = AnalyticsReplica()
+    columns = {table: [("id", "character varying", None, None)] for table in TABLES}
+    loads = []
+
+    def load_table(table):
+        loads.append(table)
+        replica.rows[table] = 0
+
+    monkeypatch.setattr(replica, "_read_columns", lambda: {table: list(spec) for table, spec in columns.items()})
+    monkeypatch.setattr(replica, "load_table", load_table)
+    monkeypatch.setattr(data_version, "current", lambda tables=None: "v1")
+
+    replica.refresh()
+    assert sorted(loads) == sorted(TABLES)
+    loads.clear()
+    replica.refresh()
+    assert loads == []
+
+    # Adding the tenant column moves no data version, but the copy must get it to be filtered
+    columns["invoices"].append((tenancy.TENANT_COLUMN, "text", None, None))
+    replica.refresh()
+    assert loads == ["invoices"]
+    assert tenancy.TENANT_COLUMN in [name for name, *_ in replica._table_columns("invoices")]
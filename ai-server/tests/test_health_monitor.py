@@ -0,0 +1,53 @@
+import os
+import threading
+import time
+
+import pytest
+
+import database
+import health_monitor
+from health_monitor import HealthMonitor
+
+
+def test_a_hung_check_does_not_hold_up_the_others(monkeypatch):
+    monkeypatch.setattr(health_monitor, "HEALTH_CHECK_TIMEOUT", 0.2)
+    release = threading.Event()
+    calls = []
+
+    def hung():
+        calls.append(time.monotonic())
+        release.wait(5)
+
+    monitor = HealthMonitor()
+    monitor.register("database", lambda: None, interval=0.05)
+    monitor.register("llm_backend", hung, interval=0.05)
+    monitor.start()
+    try:
+        time.sleep(0.6)
+        status = monitor.snapshot()["checks"]
+        assert status["database"]["status"] == "healthy"
+        # Checked concurrently, so the fast check never waits out the slow one's timeout
+        assert max(entry["latency_ms"] for entry in status["database"]["history"]) < 100
+        assert status["llm_backend"]["status"] == "unhealthy"
+        assert status["llm_backend"]["error"] in ("timed out after 0.2s", "previous check still running")
+        # The hung call is not started again while it is still running
+        assert len(calls) == 1
+    finally:
+        release.set()
+        monitor.stop()
+
+
+def test_database_ping_timeout_stays_in_its_transaction(monkeypatch):
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL not set")
+    monkeypatch.setenv("DATABASE_URL", url)
+    monkeypatch.setenv("DB_POOL_MAX_SIZE", "1")
+    monkeypatch.setattr(database, "_pool", None)
+    try:
+        database.ping(0.5)
+        # Same pooled connection, next transaction: the server default again
+        with database.connection() as conn:
+            assert conn.execute("SHOW statement_timeout").fetchone()[0] == "0"
+    finally:
+        database.close_pool()
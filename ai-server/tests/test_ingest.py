@@ -0,0 +1,92 @@
+import os
+import json
+import uuid
+from urllib.parse import quote
+
+import psycopg
+import pytest
+
+import database
+import ingest
+import tenancy
+
+ROLE = "ingest_test_scoped"
+
+
+def document(organization: str, number: str, total: str) -> dict:
+    def fields(**values):
+        return {"value": {name: {"value": value} for name, value in values.items()}}
+
+    return {
+        "_id": str(uuid.uuid4()),
+        "filePath": f"{number}.pdf",
+        "organizationId": organization,
+        "createdAt": {"$date": "2025-11-04T12:52:19.781Z"},
+        "updatedAt": {"$date": "2025-11-06T07:37:48.881Z"},
+        "extractedData": {"llmData": {
+            "invoice": fields(invoiceId=number, invoiceDate="2025-11-04", status="paid"),
+            "vendor": fields(vendorName=f"Vendor {number}"),
+            "summary": fields(invoiceTotal=total, currencySymbol="€"),
+            "lineItems": {"value": {"items": {"value": [
+                {"description": {"value": "Consulting"}, "quantity": {"value": 1}, "totalPrice": {"value": total}},
+            ]}}},
+        }},
+    }
+
+
+@pytest.fixture
+def scoped_url(monkeypatch):
+    """TEST_DATABASE_URL as a role whose policies fail closed (a member of ai_server_scoped)"""
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL not set")
+    with psycopg.connect(url, autocommit=True) as conn:
+        if not conn.execute("SELECT 1 FROM pg_roles WHERE rolname = 'ai_server_scoped'").fetchone():
+            pytest.skip("enable-tenant-rls.sql not applied to the test database")
+        conn.execute(f"DROP OWNED BY {ROLE}" if conn.execute(
+            "SELECT 1 FROM pg_roles WHERE rolname = %s", (ROLE,)).fetchone() else f"CREATE ROLE {ROLE}")
+        conn.execute(f"GRANT ai_server_scoped TO {ROLE}")
+        conn.execute(f"GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA public TO {ROLE}")
+        conn.execute(f"GRANT CREATE ON SCHEMA public TO {ROLE}")
+    # The superuser of the test URL switches to the role for the whole session
+    scoped = f"{url}{'&' if '?' in url else '?'}options={quote(f'-c role={ROLE}')}"
+    monkeypatch.setenv("DATABASE_URL", scoped)
+    monkeypatch.setattr(tenancy, "_scoped_tables", None)
+    yield scoped
+    with psycopg.connect(url, autocommit=True) as conn:
+        conn.execute(f"DROP OWNED BY {ROLE}")
+        conn.execute(f"DROP ROLE {ROLE}")
+
+
+def test_ingested_rows_belong_to_their_organization(scoped_url, tmp_path):
+    suffix = uuid.uuid4().hex[:8]
+    documents = [document("org_a", f"A-{suffix}", "100.00"), document("org_b", f"B-{suffix}", "250.00")]
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps(documents))
+    ids = [doc["_id"] for doc in documents]
+
+    try:
+        report = ingest.ingest(str(path))
+        assert report["rows"]["invoices"] == 2
+
+        with psycopg.connect(database.get_database_url()) as conn:
+            for tenant, doc in (("org_a", documents[0]), ("org_b", documents[1])):
+                with tenancy.scoped(tenant), conn.transaction():
+                    rows = {}
+                    for table in ingest.TENANT_TABLES:
+                        key = "id" if table == "invoices" else '"invoiceId"'
+                        sql, params = tenancy.scope_query(
+                            conn, f'SELECT {key}, "organizationId" FROM {table} WHERE {key} = ANY(%(ids)s)',
+                            {"ids": ids})
+                        rows[table] = conn.execute(sql, params).fetchall()
+                for table in ingest.TENANT_TABLES:
+                    assert rows[table] == [(doc["_id"], tenant)], table
+            # Without a tenant the scoped role sees nothing
+            assert conn.execute("SELECT count(*) FROM invoices WHERE id = ANY(%s)", (ids,)).fetchone()[0] == 0
+    finally:
+        with ingest.connect() as conn:
+            for table in ("payments", "line_items"):
+                conn.execute(f'DELETE FROM {table} WHERE "invoiceId" = ANY(%s)', (ids,))
+            conn.execute("DELETE FROM invoices WHERE id = ANY(%s)", (ids,))
+            conn.execute("DELETE FROM vendors WHERE name LIKE %s", (f"Vendor %-{suffix}",))
+            conn.execute("DELETE FROM ingest_checkpoints WHERE source = %s", (ingest.source_key(str(path)),))
@@ -0,0 +1,29 @@
+import pytest
+
+import pagination
+
+
+@pytest.fixture(autouse=True)
+def fresh_secret(monkeypatch):
+    monkeypatch.setattr(pagination, "_secret", None)
+
+
+@pytest.mark.parametrize("secret", ["change_me", "CHANGE_ME_IN_PRODUCTION_0123456789abcdef", "your_page_token_secret", "short"])
+def test_placeholder_and_short_secrets_are_refused(monkeypatch, secret):
+    monkeypatch.setenv("PAGE_TOKEN_SECRET", secret)
+    with pytest.raises(RuntimeError):
+        pagination.check_secret()
+
+
+def test_tokens_round_trip_with_a_configured_secret(monkeypatch):
+    monkeypatch.setenv("PAGE_TOKEN_SECRET", "k3Jq9vXz2LmN8pR4tW6yB1cD5fG7hJ0a")
+    token = pagination.encode_page_token("SELECT 1", None, 500)
+    assert pagination.decode_page_token(token)["offset"] == 500
+    with pytest.raises(ValueError):
+        pagination.decode_page_token(token[:-2] + ("A" if token[-2] != "A" else "B") + token[-1])
+
+
+def test_unset_secret_is_generated_per_process(monkeypatch):
+    monkeypatch.delenv("PAGE_TOKEN_SECRET", raising=False)
+    pagination.check_secret()
+    assert len(pagination._get_secret()) == 32
@@ -0,0 +1,93 @@
+import os
+import uuid
+from datetime import date
+
+import psycopg
+import pytest
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+
+import partitioning
+
+SCHEMA = [
+    'CREATE TABLE invoices (id TEXT PRIMARY KEY, "invoiceNumber" TEXT NOT NULL, "issueDate" TIMESTAMP NOT NULL)',
+    'CREATE TABLE line_items (id TEXT PRIMARY KEY,'
+    ' "invoiceId" TEXT NOT NULL REFERENCES invoices (id) ON DELETE CASCADE ON UPDATE CASCADE)',
+    'CREATE TABLE payments (id TEXT PRIMARY KEY, "paidDate" TIMESTAMP,'
+    ' "invoiceId" TEXT NOT NULL REFERENCES invoices (id) ON DELETE RESTRICT)',
+    "INSERT INTO invoices VALUES ('inv-1', 'A-1', '2024-01-15'), ('inv-2', 'A-2', '2024-03-02')",
+    "INSERT INTO line_items VALUES ('li-1', 'inv-1'), ('li-2', 'inv-2')",
+    "INSERT INTO payments VALUES ('pay-1', '2024-02-01', 'inv-2')",
+]
+
+
+@pytest.fixture
+def conn():
+    """A connection to a scratch database holding the invoice tables, dropped afterwards"""
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL not set")
+    name = f"partitioning_test_{uuid.uuid4().hex[:8]}"
+    with psycopg.connect(url, autocommit=True) as admin:
+        try:
+            admin.execute(f"CREATE DATABASE {name}")
+        except psycopg.errors.InsufficientPrivilege:
+            pytest.skip("cannot create a scratch database")
+    try:
+        with psycopg.connect(make_conninfo(**{**conninfo_to_dict(url), "dbname": name})) as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+            yield connection
+    finally:
+        with psycopg.connect(url, autocommit=True) as admin:
+            admin.execute(f"DROP DATABASE IF EXISTS {name}")
+
+
+def fails(conn, sql: str) -> bool:
+    try:
+        with conn.transaction():
+            conn.execute(sql)
+    except psycopg.errors.ForeignKeyViolation:
+        return True
+    return False
+
+
+def test_foreign_keys_to_a_partitioned_table_are_enforced(conn):
+    partitioning.migrate(conn, "invoices", months_ahead=0)
+    partitioning.migrate(conn, "payments", months_ahead=0)
+    assert partitioning.is_partitioned(conn, "invoices") and partitioning.is_partitioned(conn, "payments")
+
+    assert fails(conn, "INSERT INTO line_items VALUES ('li-x', 'no-such-invoice')")
+    assert fails(conn, "INSERT INTO payments VALUES ('pay-x', '2024-02-01', 'no-such-invoice')")
+    # ON DELETE RESTRICT of payments
+    assert fails(conn, "DELETE FROM invoices WHERE id = 'inv-2'")
+
+    with conn.transaction():
+        # Moving to another partition keeps the children
+        conn.execute("""UPDATE invoices SET "issueDate" = '2024-02-20' WHERE id = 'inv-1'""")
+        assert conn.execute("""SELECT count(*) FROM line_items WHERE "invoiceId" = 'inv-1'""").fetchone()[0] == 1
+        # ON UPDATE CASCADE, then ON DELETE CASCADE of line_items
+        conn.execute("UPDATE invoices SET id = 'inv-1b' WHERE id = 'inv-1'")
+        assert conn.execute("""SELECT "invoiceId" FROM line_items WHERE id = 'li-1'""").fetchone()[0] == "inv-1b"
+        conn.execute("DELETE FROM invoices WHERE id = 'inv-1b'")
+        assert conn.execute("SELECT count(*) FROM line_items WHERE id = 'li-1'").fetchone()[0] == 0
+
+
+def test_foreign_keys_are_only_dropped_when_asked(conn):
+    plan = partitioning.migration_plan(conn, "invoices", drop_foreign_keys=True)
+    assert not any("partitioning_fk" in statement for statement in plan)
+    conn.rollback()
+    partitioning.migrate(conn, "invoices", months_ahead=0, drop_foreign_keys=True)
+    assert not fails(conn, "INSERT INTO line_items VALUES ('li-x', 'no-such-invoice')")
+
+
+def test_maintain_leaves_rows_before_since_in_the_default_partition(conn):
+    partitioning.migrate(conn, "invoices", since=date(2024, 3, 1), months_ahead=0)
+    assert partitioning.maintain(conn, months_ahead=0)["invoices"] == 0
+    names = partitioning._partitions(conn, "invoices")
+    assert "invoices_p2024_01" not in names and "invoices_p2024_03" in names
+    assert conn.execute("SELECT count(*) FROM invoices_default").fetchone()[0] == 1
+
+    # An explicit since moves them after all
+    assert partitioning.maintain(conn, months_ahead=0, since=date(2024, 1, 1))["invoices"] == 1
+    assert conn.execute("SELECT count(*) FROM invoices_default").fetchone()[0] == 0
@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import llm_router
+import vanna_main
+from llm_backends import LLMBackend
+from llm_router import LLMRouter
+from rate_limiter import RateLimited, RateLimitedBackend, TokenBucketLimiter, request_priority
+
+
+class BatchingBackend(LLMBackend):
+    name = "fake"
+    supports_batching = True
+
+    def __init__(self):
+        self.batches = []
+
+    def is_configured(self):
+        return True
+
+    def complete(self, system, prompt, max_tokens=500, temperature=0.1):
+        return self.complete_batch([{"system": system, "prompt": prompt}], max_tokens, temperature)[0]
+
+    def complete_batch(self, prompts, max_tokens=500, temperature=0.1):
+        self.batches.append(len(prompts))
+        return [{"text": "SELECT 1", "prompt_tokens": 10, "completion_tokens": 5, "latency": 0.0}
+                for _ in prompts]
+
+
+def test_a_batch_is_admitted_once_and_sent_in_one_call():
+    limiter = TokenBucketLimiter("fake", rpm=60, tpm=100000)
+    backend = BatchingBackend()
+    prompts = [{"system": "schema", "prompt": f"question {i}"} for i in range(4)]
+    results = RateLimitedBackend(backend, limiter).complete_batch(prompts, max_tokens=100)
+    assert len(results) == 4
+    assert backend.batches == [4]
+    assert limiter.admitted == 1
+    # The reservation for four prompts is settled down to what they used
+    assert limiter.tokens.level == pytest.approx(100000 - 4 * 15, abs=1)
+
+
+def test_startup_training_runs_at_background_priority(monkeypatch):
+    calls = []
+
+    class FakeVanna:
+        def get_training_data(self):
+            return []
+
+        def train(self, **kwargs):
+            calls.append(kwargs)
+
+    priorities = []
+    original = vanna_main.vanna_limiter.acquire
+    monkeypatch.setattr(vanna_main, "vn", FakeVanna())
+    monkeypatch.setattr(vanna_main, "VANNA_API_KEY", "test-key")
+    monkeypatch.setattr(vanna_main.vanna_limiter, "acquire",
+                        lambda tokens, priority=None: priorities.append(priority) or original(tokens, priority))
+    vanna_main.setup_vanna_training()
+    assert calls and priorities
+    # get_training_data plus one admission per train call
+    assert len(priorities) == len(calls) + 1
+    assert set(priorities) == {"background"}
+
+
+def test_clearing_training_runs_on_stage_workers_through_the_limiter(monkeypatch):
+    calls = []
+
+    class FakeVanna:
+        def get_training_data(self):
+            calls.append(("get_training_data", threading.current_thread().name))
+            return [{"id": "old-1"}, {"id": "old-2"}]
+
+        def remove_training_data(self, id):
+            calls.append(("remove_training_data", threading.current_thread().name))
+
+        def train(self, **kwargs):
+            calls.append(("train", threading.current_thread().name))
+
+    admitted = []
+    monkeypatch.setattr(vanna_main, "vn", FakeVanna())
+    monkeypatch.setattr(vanna_main, "VANNA_API_KEY", "test-key")
+    monkeypatch.setattr(vanna_main.vanna_limiter, "acquire",
+                        lambda tokens, priority=None: admitted.append(priority or request_priority.get()) or 0.0)
+    client = TestClient(vanna_main.app)
+
+    assert client.post("/clear-training").status_code == 200
+    assert [name for name, _ in calls].count("remove_training_data") == 2
+    # Every Vanna call ran on a stage worker, never on the event loop, and was admitted at background priority
+    assert all(thread.startswith("stage") for _, thread in calls)
+    assert len(admitted) == len(calls) and set(admitted) == {"background"}
+
+    calls.clear()
+    admitted.clear()
+    assert client.get("/training-data").status_code == 200
+    assert calls == [("get_training_data", calls[0][1])] and calls[0][1].startswith("stage")
+    assert admitted == ["interactive"]
+
+
+def test_backends_must_implement_complete():
+    class Incomplete(LLMBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_an_oversized_request_is_settled_against_what_was_reserved():
+    limiter = TokenBucketLimiter("fake", tpm=1000)
+    backend = BatchingBackend()
+    # The estimate is far beyond the bucket, so only the whole bucket is reserved
+    RateLimitedBackend(backend, limiter).complete("schema", "question", max_tokens=50000)
+    assert limiter.tokens.level == pytest.approx(1000 - 15, abs=1)
+
+
+def test_shedding_does_not_open_the_circuit():
+    class Shedding(BatchingBackend):
+        name = "shedding"
+
+        def complete(self, system, prompt, max_tokens=500, temperature=0.1):
+            raise RateLimited("at the rate limit", 5.0)
+
+    class Healthy(BatchingBackend):
+        name = "healthy"
+
+    router = LLMRouter([Shedding(), Healthy()], workers=2)
+    for _ in range(llm_router.BREAKER_FAILURES + 2):
+        assert router.complete("schema", "question")["backend"] == "healthy"
+    status = router.snapshot()["shedding"]
+    assert status["circuit"] == "closed" and status["errors"] == 0
+
+    only_shedding = LLMRouter([Shedding()], workers=1)
+    with pytest.raises(RateLimited):
+        only_shedding.complete("schema", "question")
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+import database
+from result_stream import collect_result
+
+
+@pytest.fixture
+def primary(monkeypatch):
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL not set")
+    monkeypatch.setenv("DATABASE_URL", url)
+    monkeypatch.setattr(database, "_replicas", [])
+    yield url
+    database.close_pool()
+
+
+def test_results_from_the_primary(primary):
+    result = collect_result("numbers", "SELECT n FROM generate_series(1, 25) AS n", None, 10)
+    assert [row["n"] for row in result["data"]] == list(range(1, 11))
+    assert result["page"]["total_rows"] == 25
+    assert result["from_replica"] is False
+
+
+def test_results_from_a_replica_are_flagged(primary, monkeypatch):
+    # The test database stands in for a replica of itself
+    monkeypatch.setattr(database, "_replicas", [database.DataSource("replica-1", primary)])
+    result = collect_result("numbers", "SELECT n FROM generate_series(1, 25) AS n", None, 10)
+    assert result["page"]["total_rows"] == 25
+    assert result["from_replica"] is True
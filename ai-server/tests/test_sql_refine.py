@@ -0,0 +1,42 @@
+from sql_refine import refine_sql
+
+TOP_VENDORS = ('SELECT v.name, SUM(i."totalAmount") AS total_spend FROM vendors v'
+               ' JOIN invoices i ON v.id = i."vendorId" WHERE i.status = \'PAID\''
+               ' GROUP BY v.id, v.name ORDER BY total_spend DESC LIMIT 5')
+
+
+def test_limit_and_status():
+    sql = refine_sql(TOP_VENDORS, "limit to 10")
+    assert sql.endswith("LIMIT 10")
+    sql = refine_sql(TOP_VENDORS, "only pending ones")
+    assert "i.status = 'PENDING'" in sql and "'PAID'" not in sql
+
+
+def test_period():
+    sql = refine_sql(TOP_VENDORS, "for Q4 2024")
+    assert 'i."issueDate" >= MAKE_DATE(2024, 4 * 3 - 2, 1)' in sql
+
+
+def test_a_new_grouping_drops_the_previous_limit():
+    sql = refine_sql(TOP_VENDORS, "break that down by month")
+    assert "GROUP BY DATE_TRUNC('MONTH', i.\"issueDate\")" in sql
+    assert "LIMIT" not in sql
+
+
+def test_a_limit_asked_for_with_the_grouping_is_kept():
+    sql = refine_sql(TOP_VENDORS, "break that down by month, top 3")
+    assert sql.endswith("LIMIT 3")
+    # An explicit ordering applies to the new grouping, not before it
+    sql = refine_sql(TOP_VENDORS, "group by category sorted by total descending")
+    assert "ORDER BY total_spend DESC" in sql
+
+
+def test_the_same_grouping_keeps_the_limit():
+    sql = refine_sql('SELECT i.category, SUM(i."totalAmount") AS total FROM invoices i'
+                     ' GROUP BY i.category ORDER BY total DESC LIMIT 5', "by category")
+    assert sql.endswith("LIMIT 5")
+
+
+def test_unrecognized_follow_ups_fall_back():
+    assert refine_sql(TOP_VENDORS, "why did spend go up") is None
+    assert refine_sql(TOP_VENDORS, "what about 2023") is None
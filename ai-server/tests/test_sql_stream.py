@@ -0,0 +1,43 @@
+import threading
+
+import pytest
+
+from sql_stream import StreamCancelled, complete_statement, stream_sql
+
+
+class StreamingBackend:
+    def __init__(self, chunks, cancel_after=None, cancel=None):
+        self.chunks = chunks
+        self.cancel_after = cancel_after
+        self.cancel = cancel
+        self.closed = False
+
+    def stream(self, system, prompt, max_tokens=500, temperature=0.1):
+        try:
+            for n, chunk in enumerate(self.chunks):
+                if n == self.cancel_after:
+                    self.cancel.set()
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def test_stops_at_the_end_of_the_statement():
+    backend = StreamingBackend(["```sql\n", "SELECT 1", ";", "\n```", " and some chatter"])
+    completion = stream_sql(backend, "system", "prompt")
+    assert completion["text"] == "SELECT 1"
+    assert completion["stopped_early"] is True
+    assert backend.closed
+
+
+def test_a_cancelled_stream_does_not_return_partial_sql():
+    cancel = threading.Event()
+    backend = StreamingBackend(["SELECT id, ", "name FROM vendors ", "WHERE id = 1;"], cancel_after=2, cancel=cancel)
+    with pytest.raises(StreamCancelled):
+        stream_sql(backend, "system", "prompt", cancel=cancel)
+    assert backend.closed
+
+
+def test_semicolons_in_literals_do_not_end_the_statement():
+    assert complete_statement("SELECT ';' AS x") is None
+    assert complete_statement("SELECT ';' AS x;") == "SELECT ';' AS x"
@@ -0,0 +1,30 @@
+import pytest
+
+from sql_templates import match_template
+
+
+@pytest.mark.parametrize("question, year", [
+    ("Total spend in 2024", 2024),
+    ("top 5 vendors by spend for the year 2023", 2023),
+    ("How many invoices during 2022?", 2022),
+])
+def test_year_periods(question, year):
+    match = match_template(question)
+    assert match["period"] == "year" and match["params"]["year"] == year
+
+
+def test_a_number_after_top_is_not_a_year():
+    match = match_template("top 2000 vendors")
+    assert match["period"] is None
+    assert "year" not in match["params"]
+    assert match_template("top 20 vendors in 2024")["params"] == {"year": 2024, "n": 20}
+
+
+def test_quarters():
+    match = match_template("top 3 vendors by spend in Q3 2024")
+    assert match["period"] == "quarter"
+    assert match["params"] == {"quarter": 3, "year": 2024, "n": 3}
+
+
+def test_unknown_shapes_fall_through():
+    assert match_template("which vendors raised their prices in 2024") is None
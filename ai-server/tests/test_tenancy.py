@@ -0,0 +1,91 @@
+import os
+
+import psycopg
+import pytest
+
+import query_plans
+import tenancy
+from tenancy import TenantError, scope_sql
+
+TABLES = {"invoices", "payments", "line_items"}
+
+
+def scoped(table: str, tenant: str = "org_a", schema: str = "") -> str:
+    return f"(SELECT * FROM {schema}{table} WHERE \"organizationId\" = '{tenant}')"
+
+
+def test_plain_table_keeps_its_name():
+    sql = scope_sql("SELECT COUNT(*) FROM invoices", "org_a", TABLES)
+    assert sql == f"SELECT COUNT(*) FROM {scoped('invoices')} AS invoices"
+
+
+def test_aliases_are_kept():
+    sql = scope_sql('SELECT i.id, v.name FROM invoices i JOIN vendors v ON v.id = i."vendorId"', "org_a", TABLES)
+    assert f"{scoped('invoices')} AS i" in sql
+    # Shared tables are left alone
+    assert "JOIN vendors AS v" in sql
+
+
+def test_subqueries_are_scoped():
+    sql = scope_sql('SELECT * FROM payments p WHERE p."invoiceId" IN (SELECT id FROM invoices)', "org_b", TABLES)
+    assert f"{scoped('payments', 'org_b')} AS p" in sql
+    assert f"{scoped('invoices', 'org_b')} AS invoices" in sql
+
+
+def test_cte_reading_a_table_is_scoped():
+    sql = scope_sql("WITH paid AS (SELECT * FROM invoices WHERE status = 'PAID') SELECT COUNT(*) FROM paid",
+                    "org_a", TABLES)
+    assert f"FROM {scoped('invoices')} AS invoices WHERE status = 'PAID'" in sql
+    assert sql.endswith("SELECT COUNT(*) FROM paid")
+
+
+def test_cte_named_like_a_table():
+    # References to the CTE are not tables, but the CTE's own body still reads the table
+    sql = scope_sql("WITH invoices AS (SELECT * FROM invoices) SELECT * FROM invoices", "org_a", TABLES)
+    assert sql == f"WITH invoices AS (SELECT * FROM {scoped('invoices')} AS invoices) SELECT * FROM invoices"
+    assert scope_sql("WITH invoices AS (SELECT 1 AS id) SELECT * FROM invoices", "org_a", TABLES) == \
+        "WITH invoices AS (SELECT 1 AS id) SELECT * FROM invoices"
+
+
+def test_schema_qualified_tables():
+    sql = scope_sql("SELECT * FROM public.invoices AS inv", "org_a", TABLES)
+    assert sql == f"SELECT * FROM {scoped('invoices', schema='public.')} AS inv"
+    # Another schema's table of the same name is not ours to scope
+    assert scope_sql("SELECT * FROM archive.invoices", "org_a", TABLES) == "SELECT * FROM archive.invoices"
+
+
+def test_unions_are_scoped():
+    sql = scope_sql("SELECT id FROM invoices UNION ALL SELECT \"invoiceId\" FROM payments", "org_a", TABLES)
+    assert scoped("invoices") in sql and scoped("payments") in sql
+
+
+def test_unparsable_sql_fails_closed():
+    with pytest.raises(TenantError):
+        scope_sql("SELECT FROM WHERE (", "org_a", TABLES)
+
+
+@pytest.fixture
+def conn():
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL not set")
+    with psycopg.connect(url) as connection:
+        yield connection
+
+
+def test_tenant_survives_the_prepared_fallback(conn, monkeypatch):
+    monkeypatch.setattr(tenancy, "_scoped_tables", None)
+    # Make the prepared attempt fail the way a mistyped lifted literal would
+    monkeypatch.setattr(query_plans, "normalize_sql", lambda sql, params: ("SELECT * FROM no_such_table", {}))
+    with tenancy.scoped("org_a"):
+        sql, params = tenancy.scope_query(conn, "SELECT current_setting('app.tenant_id', true)")
+        cursor = query_plans.execute_prepared(conn, sql, params)
+    assert cursor.fetchone()[0] == "org_a"
+    assert query_plans.plan_cache_stats.fallbacks >= 1
+
+
+def test_unscoped_queries_ask_for_every_tenant(conn, monkeypatch):
+    monkeypatch.setattr(tenancy, "_scoped_tables", None)
+    with tenancy.scoped(None):
+        sql, params = tenancy.scope_query(conn, "SELECT current_setting('app.tenant_id', true)")
+    assert conn.execute(sql, params).fetchone()[0] == tenancy.ALL_TENANTS
@@ -0,0 +1,185 @@
+"""
+Concurrent /chat and /explain requests for different organizations must never
+see each other's cached results, conversations, query ids or explanations.
+
+The LLM and the database are replaced by fakes that answer with the tenant
+they run for (read from the request's context in the stage worker thread), so
+any response carrying another tenant's marker was served across tenants.
+"""
+
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+import data_version
+import main
+import tenancy
+import vanna_main
+
+TENANTS = ["org_a", "org_b", "org_c", None]
+QUESTION = "xyzzy revenue report for the board"
+REQUESTS = 96
+
+
+def marker() -> str:
+    return f"tenant:{tenancy.current_tenant.get()}"
+
+
+def headers(tenant):
+    return {tenancy.TENANT_HEADER: tenant} if tenant else {}
+
+
+def fake_collect_result(question, sql, params=None, page_size=None, offset=0, view="auto"):
+    return {
+        "data": [{"tenant": marker(), "sql": sql}],
+        "chart_config": {"type": "table"},
+        "page": {"offset": offset, "page_size": page_size, "total_rows": 1, "next_page_token": None},
+        "from_replica": False,
+    }
+
+
+class FakeVanna:
+    def generate_sql(self, prompt):
+        return f"SELECT '{marker()}' AS tenant, COUNT(*) FROM invoices"
+
+    def generate_explanation(self, question, sql):
+        return f"Explained for {marker()}"
+
+
+class FakeLLM:
+    name = "fake"
+    supports_streaming = False
+    supports_batching = False
+
+    def is_configured(self):
+        return True
+
+    def complete(self, system, prompt, max_tokens=500, temperature=0.1):
+        return {"text": f"SELECT '{marker()}' AS tenant, COUNT(*) FROM invoices",
+                "prompt_tokens": 0, "completion_tokens": 0, "latency": 0.0}
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    monkeypatch.setattr(data_version, "current", lambda tables=None: "v1")
+    for server in (main, vanna_main):
+        monkeypatch.setattr(server.chat_cache, "version", data_version.current)
+        server.chat_cache.entries.clear()
+        server.conversations.sessions.clear()
+    vanna_main.recent_queries.clear()
+    vanna_main.explanation_cache.clear()
+
+
+def concurrently(call, jobs):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        return list(pool.map(call, jobs))
+
+
+def tenants_for_requests():
+    rnd = random.Random(46)
+    return [rnd.choice(TENANTS) for _ in range(REQUESTS)]
+
+
+def assert_own_turns(server, session_id):
+    for tenant in TENANTS:
+        with tenancy.scoped(tenant):
+            turn = server.conversations.last_turn(tenancy.partition_key(session_id))
+        assert turn is not None and f"tenant:{tenant}'" in turn["sql"]
+
+
+def test_vanna_server_keeps_tenants_apart(monkeypatch):
+    monkeypatch.setattr(vanna_main, "vn", FakeVanna())
+    monkeypatch.setattr(vanna_main, "collect_result", fake_collect_result)
+    client = TestClient(vanna_main.app)
+
+    def chat(tenant):
+        response = client.post("/chat", json={"question": QUESTION, "context": {"session_id": "shared"}},
+                               headers=headers(tenant))
+        assert response.status_code == 200
+        return tenant, response.json()
+
+    results = concurrently(chat, tenants_for_requests())
+    for tenant, payload in results:
+        assert payload["error"] is None
+        assert payload["data"][0]["tenant"] == f"tenant:{tenant}"
+        assert f"tenant:{tenant}'" in payload["sql"]
+    # One cached payload per tenant, none shared
+    assert vanna_main.chat_cache.stats()["size"] == len({tenant for tenant, _ in results})
+    assert_own_turns(vanna_main, "shared")
+
+    def explain(job):
+        tenant, payload = job
+        response = client.get(f"/explain/{payload['query_id']}", headers=headers(tenant))
+        assert response.status_code == 200
+        return tenant, response.json()["explanation"]
+
+    for tenant, explanation in concurrently(explain, results):
+        assert explanation == f"Explained for tenant:{tenant}"
+
+    # Query ids are only known to the organization that asked
+    for tenant, payload in results[:16]:
+        other = next(t for t in TENANTS if t != tenant and t is not None)
+        response = client.get(f"/explain/{payload['query_id']}", headers=headers(other))
+        assert response.status_code == 404
+
+
+def test_groq_server_keeps_tenants_apart(monkeypatch):
+    monkeypatch.setattr(main, "llm_backend", FakeLLM())
+    monkeypatch.setattr(main, "collect_result", fake_collect_result)
+    client = TestClient(main.app)
+
+    def chat(tenant):
+        response = client.post("/chat", json={"question": QUESTION, "context": {"session_id": "shared"}},
+                               headers=headers(tenant))
+        assert response.status_code == 200
+        return tenant, response.json(), response.headers.get("etag")
+
+    results = concurrently(chat, tenants_for_requests())
+    etags = {}
+    for tenant, payload, etag in results:
+        assert payload.get("error") is None
+        assert payload["data"][0]["tenant"] == f"tenant:{tenant}"
+        etags.setdefault(tenant, set()).add(etag)
+    # Each organization revalidates against its own entry only
+    assert all(len(tags) == 1 for tags in etags.values())
+    assert len(set().union(*etags.values())) == len(etags)
+    assert_own_turns(main, "shared")
+
+    # Another organization's ETag is not a match
+    tenant_a, tenant_b = "org_a", "org_b"
+    response = client.post("/chat", json={"question": QUESTION}, headers={
+        **headers(tenant_b), "If-None-Match": next(iter(etags[tenant_a]))})
+    assert response.status_code == 200
+    assert response.json()["data"][0]["tenant"] == f"tenant:{tenant_b}"
+
+
+def test_explanations_are_not_shared_between_literals(monkeypatch):
+    class EchoVanna(FakeVanna):
+        def generate_explanation(self, question, sql):
+            return f"{question} -> {sql}"
+
+    monkeypatch.setattr(vanna_main, "vn", EchoVanna())
+
+    def explain(question, sql):
+        return asyncio.run(vanna_main.get_explanation(question, sql))
+
+    sql_2023 = "SELECT SUM(total) FROM invoices WHERE EXTRACT(YEAR FROM \"issueDate\") = 2023"
+    sql_2024 = sql_2023.replace("2023", "2024")
+    assert explain("revenue in 2023", sql_2023) == (f"revenue in 2023 -> {sql_2023}", False)
+    assert explain("revenue in 2024", sql_2024) == (f"revenue in 2024 -> {sql_2024}", False)
+    assert explain("revenue in 2023", sql_2023)[1] is True
+
+
+def test_results_from_a_replica_are_not_cached(monkeypatch):
+    def from_replica(*args, **kwargs):
+        return {**fake_collect_result(*args, **kwargs), "from_replica": True}
+
+    monkeypatch.setattr(main, "llm_backend", FakeLLM())
+    monkeypatch.setattr(main, "collect_result", from_replica)
+    response = TestClient(main.app).post("/chat", json={"question": QUESTION}, headers=headers("org_a"))
+    assert response.status_code == 200
+    assert response.headers.get("etag") is None
+    assert main.chat_cache.stats()["size"] == 0
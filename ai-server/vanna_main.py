@@ -4,19 +4,38 @@ Production-grade FastAPI server using Vanna AI framework with Groq LLM integrati
 """
 
 import os
+import uuid
 import logging
+import threading
 import traceback
 from typing import Dict, List, Optional
 from datetime import datetime
 
-import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-# Vanna AI import
-from vanna.remote import VannaDefault
+import analytics_replica
+import change_feed
+import database
+import data_version
+import health_monitor
+import metrics
+import rate_limiter
+import sargable
+import tenancy
+from cache import LRUCache
+from conversations import ConversationStore, follow_up_prompt, is_follow_up, session_id_from
+from chart_inference import columns_from_records, infer_chart_config
+from http_cache import ResultCache, add_compression, conditional_json
+from pagination import check_secret, clamp_page_size, decode_page_token
+from rate_limiter import RateLimited, background, get_limiter, limited_call
+from readiness import liveness, readiness, warm_up
+from result_stream import collect_result
+from sql_refine import refine_sql
+from sql_templates import match_template, render_sql
+from stage_executor import ClientDisconnected, StageTimeout, run_stage, shutdown_executor
 
 # Load environment variables
 load_dotenv()
@@ -40,8 +59,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# gzip (or brotli) for large responses
+add_compression(app)
+tenancy.add_tenant_middleware(app)
+
 # Environment variables
 DATABASE_URL = os.getenv("DATABASE_URL")
 VANNA_API_KEY = os.getenv("VANNA_API_KEY")  # Vanna AI API key
@@ -49,49 +73,101 @@ VANNA_MODEL = os.getenv("VANNA_MODEL", "flowbitai_analytics")  # Vanna model nam
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")  # Keep for reference but Vanna handles LLM
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
 
-# Initialize Vanna AI
+# Per-stage time budgets (seconds) for the blocking Vanna calls
+VANNA_SQL_TIMEOUT = float(os.getenv("VANNA_SQL_TIMEOUT", 30))
+VANNA_RUN_SQL_TIMEOUT = float(os.getenv("VANNA_RUN_SQL_TIMEOUT", 60))
+VANNA_EXPLAIN_TIMEOUT = float(os.getenv("VANNA_EXPLAIN_TIMEOUT", 15))
+VANNA_TRAIN_TIMEOUT = float(os.getenv("VANNA_TRAIN_TIMEOUT", 300))
+
+# Admission control for calls to the Vanna API (VANNA_RPM / VANNA_TPM)
+vanna_limiter = get_limiter("vanna")
+
+# Explanations cost a second LLM round-trip, so by default they are only
+# generated on demand through GET /explain/{query_id}
+VANNA_EXPLAIN_BY_DEFAULT = os.getenv("VANNA_EXPLAIN_BY_DEFAULT", "false").lower() == "true"
+recent_queries = LRUCache(max_size=int(os.getenv("QUERY_REGISTRY_SIZE", 10000)), ttl=3600)
+explanation_cache = LRUCache(max_size=int(os.getenv("EXPLANATION_CACHE_SIZE", 2048)))
+# Recent turns per session, for follow-up questions
+conversations = ConversationStore()
+# /chat payloads that do not depend on the conversation, valid while the data version holds
+chat_cache = ResultCache(max_size=int(os.getenv("CHAT_CACHE_SIZE", 256)),
+                         ttl=float(os.getenv("CHAT_CACHE_TTL", 600)))
+
+# Vanna AI client, built on first use or by the startup warm-up: importing vanna
+# pulls in pandas and the client connects to Postgres, which must not hold up the
+# worker before it can answer /health/live
 vn = None
 vanna_initialized = False
-try:
-    # Initialize VannaDefault with API key and optional model
-    if VANNA_API_KEY:
-        if VANNA_MODEL and VANNA_MODEL.strip():
-            # Use specified model
-            vn = VannaDefault(model=VANNA_MODEL, api_key=VANNA_API_KEY)
-        else:
-            # Use just API key, let Vanna create default model
-            vn = VannaDefault(api_key=VANNA_API_KEY)
-        
-        # Connect to PostgreSQL database
-        vn.connect_to_postgres(
-            host='localhost',
-            dbname='flowbitai_analytics',
-            user='postgres',
-            password='mukul@237lassi',
-            port=5432
-        )
-        
-        vanna_initialized = True
-        logger.info("Vanna AI initialized successfully with VannaDefault")
-    else:
-        logger.warning("VANNA_API_KEY or VANNA_MODEL not provided. Get them from https://vanna.ai/account/profile")
-        vanna_initialized = False
-except Exception as e:
-    logger.error(f"Failed to initialize Vanna AI: {e}")
-    vanna_initialized = False
+_vanna_lock = threading.Lock()
+
+if not VANNA_API_KEY:
+    logger.warning("VANNA_API_KEY or VANNA_MODEL not provided. Get them from https://vanna.ai/account/profile")
+
+def get_vanna():
+    """The Vanna client, initialized on the first call; None when not configured or failing to start"""
+    global vn, vanna_initialized
+    if vn is not None or not VANNA_API_KEY:
+        return vn
+    with _vanna_lock:
+        if vn is not None:
+            return vn
+        try:
+            from vanna.remote import VannaDefault
+            
+            if VANNA_MODEL and VANNA_MODEL.strip():
+                # Use specified model
+                client = VannaDefault(model=VANNA_MODEL, api_key=VANNA_API_KEY)
+            else:
+                # Use just API key, let Vanna create default model
+                client = VannaDefault(api_key=VANNA_API_KEY)
+            
+            # Connect to PostgreSQL database (credentials come from DATABASE_URL)
+            if DATABASE_URL:
+                client.connect_to_postgres(**database.parse_database_url())
+            else:
+                logger.warning("DATABASE_URL not configured; Vanna AI cannot run SQL")
+            
+            vn = client
+            vanna_initialized = True
+            logger.info("Vanna AI initialized successfully with VannaDefault")
+        except Exception as e:
+            logger.error(f"Failed to initialize Vanna AI: {e}")
+    return vn
+
+async def require_vanna():
+    """The Vanna client for an endpoint, initialized off the event loop if the warm-up has not done it yet"""
+    client = vn if vn is not None else await run_stage("init_vanna", get_vanna, timeout=VANNA_SQL_TIMEOUT)
+    if client is None:
+        raise HTTPException(status_code=500, detail="Vanna AI not initialized")
+    return client
+
+def check_vanna():
+    """Health check: a probe never initializes (or calls) Vanna, it only looks"""
+    if vn is None:
+        raise RuntimeError("Vanna AI not initialized" if VANNA_API_KEY else "VANNA_API_KEY not configured")
+
+# Probes are answered from these background checks (see health_monitor.py)
+health_monitor.register("database", health_monitor.check_database)
+health_monitor.register("vanna_ai", check_vanna, interval=health_monitor.HEALTH_LLM_CHECK_INTERVAL)
 
 # Pydantic models
 class ChatRequest(BaseModel):
     question: str
     context: Optional[Dict] = {}
+    explain: Optional[bool] = None
+    page_size: Optional[int] = None
+    page_token: Optional[str] = None
 
 class ChatResponse(BaseModel):
     question: str
+    session_id: Optional[str] = None
+    query_id: Optional[str] = None
     sql: Optional[str] = None
     data: Optional[List[Dict]] = None
     chart_config: Optional[Dict] = None
     error: Optional[str] = None
     explanation: Optional[str] = None
+    page: Optional[Dict] = None
 
 class TrainingData(BaseModel):
     question: Optional[str] = None
@@ -100,7 +176,7 @@ class TrainingData(BaseModel):
 
 def setup_vanna_training():
     """Train Vanna AI with database schema and sample queries"""
-    if not vanna_initialized or not vn:
+    if get_vanna() is None:
         logger.warning("Vanna AI not initialized, skipping training")
         return
     
@@ -109,13 +185,15 @@ def setup_vanna_training():
         logger.warning("No valid Vanna API key provided. Training requires Vanna AI account. Get API key from https://vanna.ai/account/profile")
         return
     
+    # Every call goes through the Vanna limiter at background priority, so startup
+    # training yields the API budget to interactive /chat traffic
     try:
         logger.info("Starting Vanna AI training with database schema...")
         
         # First, let's try to remove any conflicting old training data
         try:
             logger.info("Checking for existing training data...")
-            existing_data = vn.get_training_data()
+            existing_data = limited_call(vanna_limiter, vn.get_training_data, priority="background")
             if existing_data and len(existing_data) > 0:
                 logger.info(f"Found {len(existing_data)} existing training items")
                 # Remove old DDL statements that might have wrong column names
@@ -123,7 +201,7 @@ def setup_vanna_training():
                     if 'content' in item and ('total_amount' in item.get('content', '') or 'issue_date' in item.get('content', '')):
                         try:
                             if 'id' in item:
-                                vn.remove_training_data(item['id'])
+                                limited_call(vanna_limiter, vn.remove_training_data, item['id'], priority="background")
                                 logger.info("Removed old training data with incorrect column names")
                         except Exception as e:
                             logger.warning(f"Failed to remove old training item: {e}")
@@ -211,7 +289,8 @@ def setup_vanna_training():
         ]
         
         for ddl in ddl_statements:
-            vn.train(ddl=ddl)
+            limited_call(vanna_limiter, vn.train, ddl=ddl,
+                         tokens=vanna_limiter.estimate_tokens(ddl), priority="background")
         
         # Train with sample question-SQL pairs using correct column names
         training_pairs = [
@@ -250,7 +329,8 @@ def setup_vanna_training():
         ]
         
         for pair in training_pairs:
-            vn.train(question=pair["question"], sql=pair["sql"])
+            limited_call(vanna_limiter, vn.train, question=pair["question"], sql=pair["sql"],
+                         tokens=vanna_limiter.estimate_tokens(pair["question"] + pair["sql"]), priority="background")
         
         logger.info("Vanna AI training completed successfully")
         
@@ -258,39 +338,23 @@ def setup_vanna_training():
         logger.error(f"Failed to train Vanna AI: {e}")
 
 def generate_chart_config(question: str, data: List[Dict]) -> Dict:
-    """Generate chart configuration based on question and data"""
+    """Generate chart configuration from the column types and values of the result"""
     if not data:
         return {"type": "table", "data": data, "title": question}
     
-    question_lower = question.lower()
-    columns = list(data[0].keys()) if data else []
-    
-    chart_config = {
-        "type": "table",  # default
-        "data": data,
-        "title": question
-    }
-    
-    # Detect chart types based on keywords and data structure
-    if any(word in question_lower for word in ['trend', 'over time', 'monthly', 'yearly']):
-        chart_config["type"] = "line"
-    elif any(word in question_lower for word in ['top', 'best', 'highest', 'vendors', 'categories']):
-        chart_config["type"] = "bar"
-    elif any(word in question_lower for word in ['distribution', 'breakdown', 'percentage']):
-        chart_config["type"] = "pie"
-    
-    # Set axes based on column names
-    if len(columns) >= 2:
-        chart_config["x_axis"] = columns[0]
-        chart_config["y_axis"] = columns[1]
-    
-    return chart_config
+    # Axes, aggregation and downsampling are inferred from the data itself
+    return infer_chart_config(question, columns_from_records(data))
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize Vanna AI training on startup"""
-    if vanna_initialized:
-        setup_vanna_training()
+    """Warm up Vanna AI (client and training) and the pool, start the change feed and the DuckDB replica"""
+    # A placeholder PAGE_TOKEN_SECRET stops the server here
+    check_secret()
+    warm_up.run("vanna", setup_vanna_training)
+    warm_up.run("database", database.warm_up)
+    health_monitor.start()
+    change_feed.start()
+    analytics_replica.start()
 
 @app.get("/")
 async def root():
@@ -307,12 +371,21 @@ async def root():
         "database_configured": DATABASE_URL is not None
     }
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the change feed, release pooled database connections, drop queued Vanna stages and close the session store"""
+    health_monitor.stop()
+    analytics_replica.stop()
+    change_feed.stop()
+    database.close_pool()
+    shutdown_executor()
+    conversations.close()
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_with_data(request: ChatRequest) -> ChatResponse:
+async def chat_with_data(request: ChatRequest, http_request: Request) -> ChatResponse:
     """Process natural language questions using Vanna AI"""
     try:
-        if not vanna_initialized:
-            raise HTTPException(status_code=500, detail="Vanna AI not initialized")
+        await require_vanna()
         
         question = request.question.strip()
         if not question:
@@ -320,43 +393,125 @@ async def chat_with_data(request: ChatRequest) -> ChatResponse:
         
         logger.info(f"Processing question with Vanna AI: {question}")
         
-        # Use Vanna AI to generate SQL
-        sql = vn.generate_sql(question)
-        logger.info(f"Vanna AI generated SQL: {sql}")
+        page_size = clamp_page_size(request.page_size)
+        session_id = session_id_from(request.context)
+        # Conversation state, cached results and query ids are kept apart per organization
+        conversation_key = tenancy.partition_key(session_id)
+        template, params, offset, previous = None, None, 0, None
+        explain = request.explain if request.explain is not None else VANNA_EXPLAIN_BY_DEFAULT
+        if not request.page_token:
+            previous = conversations.last_turn(conversation_key)
+            if previous and not is_follow_up(question):
+                previous = None
+        
+        # Answers that do not depend on the conversation are cached until a table they read
+        # changes; a client sending the matching If-None-Match gets a 304 and no body
+        cache_key = None if previous else tenancy.partition_key((question, page_size, request.page_token, explain))
+        # Validating an entry may read the data version from Postgres, so it runs off the event loop
+        cached = await run_stage("check_cache", chat_cache.get, cache_key,
+                                 timeout=VANNA_RUN_SQL_TIMEOUT) if cache_key else None
+        if cached:
+            logger.info(f"Serving cached result for data version {cached['version']}")
+            payload = cached["payload"]
+            recent_queries.set(tenancy.partition_key(payload["query_id"]), {"question": question, "sql": payload["sql"]})
+            if not request.page_token:
+                conversations.add_turn(conversation_key, question, payload["sql"])
+            return conditional_json(http_request, {**payload, "session_id": session_id}, cached["etag"])
         
-        # Execute the SQL query using Vanna AI
-        data = vn.run_sql(sql)
+        if request.page_token:
+            # Later pages re-run the SQL of the first one; no LLM involved
+            token = decode_page_token(request.page_token)
+            sql, params, offset = token["sql"], token["params"] or None, token["offset"]
+        else:
+            # Known question shapes skip the LLM entirely
+            template = match_template(question) if not previous else None
+            # Simple follow-ups are applied to the previous SQL's AST locally
+            refined = refine_sql(previous["sql"], question) if previous else None
+            if template:
+                sql = render_sql(template["sql"], template["params"])
+                logger.info(f"Matched template '{template['intent']}': {sql}")
+            elif refined:
+                sql = refined
+                logger.info(f"Refined previous SQL locally: {sql}")
+            else:
+                # Use Vanna AI to generate SQL (off the event loop); a follow-up
+                # only carries the previous SQL and the requested change
+                prompt = follow_up_prompt(previous, question) if previous else question
+                sql = await run_stage("generate_sql", limited_call, vanna_limiter, vn.generate_sql, prompt,
+                                      tokens=vanna_limiter.estimate_tokens(prompt),
+                                      timeout=VANNA_SQL_TIMEOUT, request=http_request)
+                logger.info(f"Vanna AI generated SQL{' (follow-up)' if previous else ''}: {sql}")
         
-        # Convert pandas DataFrame to list of dictionaries if needed
-        if hasattr(data, 'to_dict'):
-            data = data.to_dict('records')
-        elif not isinstance(data, list):
-            data = []
+        # Version the tables before reading them, so a concurrent write invalidates the entry
+        tables = data_version.referenced_tables(sql) if cache_key else None
+        version = await run_stage("data_version", data_version.current, tables,
+                                  timeout=VANNA_RUN_SQL_TIMEOUT) if cache_key else None
+        
+        page = None
+        if DATABASE_URL:
+            # Stream rows straight from the pooled connection into the payload,
+            # without building a pandas DataFrame first
+            result = await run_stage("run_sql", collect_result, question, sql, params, page_size, offset,
+                                     "table" if request.page_token else "auto",
+                                     timeout=VANNA_RUN_SQL_TIMEOUT, request=http_request)
+            data, chart_config, page = result["data"], result["chart_config"], result["page"]
+            # A read replica may not have the writes counted in `version` yet, so its results are not cached
+            if result["from_replica"]:
+                version = None
+        else:
+            # Execute the SQL query using Vanna AI
+            data = await run_stage("run_sql", vn.run_sql, sql,
+                                   timeout=VANNA_RUN_SQL_TIMEOUT, request=http_request)
+            
+            # Convert pandas DataFrame to list of dictionaries if needed
+            if hasattr(data, 'to_dict'):
+                data = data.to_dict('records')
+            elif not isinstance(data, list):
+                data = []
+            
+            # Generate chart configuration
+            chart_config = generate_chart_config(question, data)
         
         logger.info(f"Query returned {len(data)} rows")
         
-        # Generate chart configuration
-        chart_config = generate_chart_config(question, data)
+        # Remember the query so its explanation can be fetched lazily
+        query_id = uuid.uuid4().hex
+        recent_queries.set(tenancy.partition_key(query_id), {"question": question, "sql": sql})
         
-        # Generate explanation using Vanna AI (if available)
+        # Generate explanation using Vanna AI only when asked for
         explanation = ""
         try:
-            if hasattr(vn, 'generate_explanation'):
-                explanation = vn.generate_explanation(question, sql)
+            if template:
+                explanation = f"Answered from the '{template['intent']}' query template. Found {len(data)} result(s)."
+            elif explain and hasattr(vn, 'generate_explanation'):
+                explanation, _ = await get_explanation(question, sql, http_request)
             else:
-                explanation = f"Generated SQL query to answer: {question}. Found {len(data)} result(s)."
+                explanation = f"Found {len(data)} result(s). Use GET /explain/{query_id} for an explanation of the query."
+        except ClientDisconnected:
+            raise
         except Exception as e:
             logger.warning(f"Could not generate explanation: {e}")
             explanation = f"Query executed successfully. Found {len(data)} result(s)."
         
-        return ChatResponse(
+        if not request.page_token:
+            conversations.add_turn(conversation_key, question, sql)
+        
+        response = ChatResponse(
             question=question,
+            session_id=session_id,
+            query_id=query_id,
             sql=sql,
             data=data,
             chart_config=chart_config,
-            explanation=explanation
+            explanation=explanation,
+            page=page
         )
+        etag = chat_cache.set(cache_key, version, response.dict(), tables) if cache_key else None
+        return conditional_json(http_request, response, etag) if etag else response
         
+    except ClientDisconnected as e:
+        # Nobody is listening any more; skip the remaining stages
+        return ChatResponse(question=request.question, error=f"Client disconnected during '{e}'")
     except Exception as e:
         logger.error(f"Chat processing error: {traceback.format_exc()}")
         return ChatResponse(
@@ -364,38 +519,88 @@ async def chat_with_data(request: ChatRequest) -> ChatResponse:
             error=str(e)
         )
 
+async def get_explanation(question: str, sql: str, http_request: Request = None):
+    """Explain SQL with Vanna, cached by question and SQL; returns (explanation, was_cached)"""
+    # Explanations quote the question and the SQL's literals (a different year or vendor is a
+    # different answer), and are not shared across organizations
+    key = tenancy.partition_key((question, sql))
+    cached = explanation_cache.get(key)
+    if cached is not None:
+        return cached, True
+    
+    explanation = await run_stage("generate_explanation", limited_call, vanna_limiter,
+                                  vn.generate_explanation, question, sql,
+                                  tokens=vanna_limiter.estimate_tokens(question + sql),
+                                  timeout=VANNA_EXPLAIN_TIMEOUT, request=http_request)
+    explanation_cache.set(key, explanation)
+    return explanation, False
+
+@app.get("/explain/{query_id}")
+async def explain_query(query_id: str, http_request: Request):
+    """Generate (or return the cached) explanation for a previous /chat query"""
+    entry = recent_queries.get(tenancy.partition_key(query_id))
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired query_id")
+    if not hasattr(await require_vanna(), 'generate_explanation'):
+        raise HTTPException(status_code=500, detail="Vanna AI explanations not available")
+    
+    try:
+        explanation, cached = await get_explanation(entry["question"], entry["sql"], http_request)
+    except StageTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    except Exception as e:
+        logger.error(f"Explanation error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to generate explanation: {str(e)}")
+    
+    return {
+        "query_id": query_id,
+        "sql": entry["sql"],
+        "explanation": explanation,
+        "cached": cached
+    }
+
+def remove_all_training_data():
+    """Remove every training item from Vanna AI, one limited call each"""
+    training_data = limited_call(vanna_limiter, vn.get_training_data)
+    for item in training_data or []:
+        if 'id' in item:
+            try:
+                limited_call(vanna_limiter, vn.remove_training_data, item['id'])
+            except RateLimited:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to remove training data item {item.get('id')}: {e}")
+
 @app.post("/clear-training")
 async def clear_training():
     """Clear all training data and retrain with fresh schema"""
     try:
-        if not vanna_initialized or not vn:
-            raise HTTPException(status_code=500, detail="Vanna AI not initialized")
+        await require_vanna()
         
         if not VANNA_API_KEY or VANNA_API_KEY == "your_vanna_api_key_here":
             raise HTTPException(status_code=400, detail="Valid Vanna API key required for training operations")
         
-        logger.info("Clearing existing training data...")
-        
-        # Get current training data
-        training_data = vn.get_training_data()
-        
-        # Remove old training data
-        if training_data and len(training_data) > 0:
-            for item in training_data:
-                if 'id' in item:
-                    try:
-                        vn.remove_training_data(item['id'])
-                    except Exception as e:
-                        logger.warning(f"Failed to remove training data item {item.get('id')}: {e}")
-        
-        logger.info("Retraining with correct schema...")
-        setup_vanna_training()
+        # Off the event loop and through the Vanna limiter, yielding to interactive /chat traffic
+        with background():
+            logger.info("Clearing existing training data...")
+            await run_stage("train", remove_all_training_data, timeout=VANNA_TRAIN_TIMEOUT)
+            
+            logger.info("Retraining with correct schema...")
+            await run_stage("train", setup_vanna_training, timeout=VANNA_TRAIN_TIMEOUT)
         
         return {
             "message": "Training data cleared and retrained successfully",
             "timestamp": datetime.now().isoformat()
         }
         
+    except HTTPException:
+        raise
+    except StageTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": f"{e.retry_after:.0f}"})
     except Exception as e:
         logger.error(f"Clear training error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to clear training: {str(e)}")
@@ -404,27 +609,37 @@ async def clear_training():
 async def train_vanna(training_data: TrainingData):
     """Train Vanna AI with new question-SQL pairs or DDL"""
     try:
-        if not vanna_initialized:
-            raise HTTPException(status_code=500, detail="Vanna AI not initialized")
-        
-        # Train with DDL if provided
-        if training_data.ddl:
-            vn.train(ddl=training_data.ddl)
-            return {
-                "message": "DDL training completed successfully",
-                "ddl": training_data.ddl[:100] + "..." if len(training_data.ddl) > 100 else training_data.ddl
-            }
+        await require_vanna()
         
-        # Train with question-SQL pair if provided
-        elif training_data.question and training_data.sql:
-            vn.train(question=training_data.question, sql=training_data.sql)
-            return {
-                "message": "Training completed successfully",
-                "question": training_data.question
-            }
-        else:
-            raise HTTPException(status_code=400, detail="Either provide question+sql or ddl")
+        # Training yields to interactive /chat traffic for the Vanna API budget
+        with background():
+            # Train with DDL if provided
+            if training_data.ddl:
+                await run_stage("train", limited_call, vanna_limiter, vn.train, ddl=training_data.ddl,
+                                tokens=vanna_limiter.estimate_tokens(training_data.ddl),
+                                timeout=VANNA_TRAIN_TIMEOUT)
+                return {
+                    "message": "DDL training completed successfully",
+                    "ddl": training_data.ddl[:100] + "..." if len(training_data.ddl) > 100 else training_data.ddl
+                }
+            
+            # Train with question-SQL pair if provided
+            elif training_data.question and training_data.sql:
+                await run_stage("train", limited_call, vanna_limiter, vn.train,
+                                question=training_data.question, sql=training_data.sql,
+                                tokens=vanna_limiter.estimate_tokens(training_data.question + training_data.sql),
+                                timeout=VANNA_TRAIN_TIMEOUT)
+                return {
+                    "message": "Training completed successfully",
+                    "question": training_data.question
+                }
+            else:
+                raise HTTPException(status_code=400, detail="Either provide question+sql or ddl")
         
+    except HTTPException:
+        raise
+    except RateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": f"{e.retry_after:.0f}"})
     except Exception as e:
         logger.error(f"Training error: {e}")
         raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
@@ -433,42 +648,56 @@ async def train_vanna(training_data: TrainingData):
 async def get_training_data():
     """Get current training data from Vanna AI"""
     try:
-        if not vanna_initialized:
-            raise HTTPException(status_code=500, detail="Vanna AI not initialized")
+        await require_vanna()
         
-        training_data = vn.get_training_data()
+        training_data = await run_stage("training_data", limited_call, vanna_limiter, vn.get_training_data,
+                                        timeout=VANNA_TRAIN_TIMEOUT)
         return {"training_data": training_data}
         
+    except StageTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": f"{e.retry_after:.0f}"})
     except Exception as e:
         logger.error(f"Error retrieving training data: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve training data: {str(e)}")
 
-@app.get("/health")
-async def health_check():
-    """Detailed health check"""
-    health_status = {
-        "service": "FlowbitAI - Vanna AI Analytics Server",
-        "status": "healthy",
+@app.get("/metrics")
+async def get_metrics():
+    """Runtime metrics: stage histograms and Vanna API admission control"""
+    return {
         "timestamp": datetime.now().isoformat(),
-        "checks": {
-            "vanna_ai": vanna_initialized,
-            "vanna_api_key": VANNA_API_KEY is not None and VANNA_API_KEY != "your_vanna_api_key_here",
-            "database": False
-        }
+        "histograms": metrics.snapshot(),
+        "llm_admission": rate_limiter.snapshot(),
+        "chat_cache": chat_cache.stats(),
+        "change_feed": change_feed.feed.snapshot(),
+        "analytics_replica": analytics_replica.replica.snapshot(),
+        "data_sources": database.sources_snapshot(),
+        "sargable_rewrites": sargable.snapshot(),
+        "warm_up": warm_up.snapshot()
     }
-    
-    # Test database connection through Vanna AI
-    try:
-        if vanna_initialized and vn:
-            vn.run_sql("SELECT 1 as test")
-            health_status["checks"]["database"] = True
-    except Exception as e:
-        health_status["checks"]["database"] = False
-        health_status["errors"] = {"database": str(e)}
-    
-    return health_status
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness probe: answers as soon as the worker is up"""
+    return liveness("FlowbitAI - Vanna AI Analytics Server")
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe: 503 until Vanna AI and the pool are warmed up and the last database check passed"""
+    return readiness("FlowbitAI - Vanna AI Analytics Server")
+
+@app.get("/health")
+async def health_check():
+    """Detailed health check: the monitor's cached results, their age and recent latencies"""
+    return health_monitor.report(
+        "FlowbitAI - Vanna AI Analytics Server",
+        vanna_api_key=VANNA_API_KEY is not None and VANNA_API_KEY != "your_vanna_api_key_here"
+    )
 
 if __name__ == "__main__":
+    import uvicorn
+
     port = int(os.getenv("PORT", 8000))
     host = os.getenv("HOST", "0.0.0.0")
     
@@ -0,0 +1,85 @@
+-- Organization-scoped Row Level Security for the analytics tables
+-- Used by the ai-server (see ai-server/tenancy.py), which sets app.tenant_id for
+-- each query it runs: the organization, or '*' for every organization. Sessions
+-- that do not set it (the API, ingestion, migrations) keep seeing every row,
+-- except for members of ai_server_scoped: for them the policies fail closed, so
+-- a query that lost its tenant returns nothing instead of every organization.
+-- Grant it to the role the ai-server connects as:
+--   GRANT ai_server_scoped TO <ai-server role>;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'ai_server_scoped') THEN
+        CREATE ROLE ai_server_scoped NOLOGIN;
+    END IF;
+END
+$$;
+
+-- Tenant column on the tables that hold organization data
+-- (vendors and customers stay shared between organizations)
+ALTER TABLE public.invoices ADD COLUMN IF NOT EXISTS "organizationId" TEXT;
+ALTER TABLE public.line_items ADD COLUMN IF NOT EXISTS "organizationId" TEXT;
+ALTER TABLE public.payments ADD COLUMN IF NOT EXISTS "organizationId" TEXT;
+
+CREATE INDEX IF NOT EXISTS invoices_organization_id_idx ON public.invoices ("organizationId");
+CREATE INDEX IF NOT EXISTS line_items_organization_id_idx ON public.line_items ("organizationId");
+CREATE INDEX IF NOT EXISTS payments_organization_id_idx ON public.payments ("organizationId");
+
+-- Line items and payments belong to their invoice's organization
+UPDATE public.line_items li SET "organizationId" = i."organizationId"
+FROM public.invoices i
+WHERE i.id = li."invoiceId" AND li."organizationId" IS DISTINCT FROM i."organizationId";
+
+UPDATE public.payments p SET "organizationId" = i."organizationId"
+FROM public.invoices i
+WHERE i.id = p."invoiceId" AND p."organizationId" IS DISTINCT FROM i."organizationId";
+
+-- Enable RLS, also for the table owner (the role the ai-server usually connects as)
+ALTER TABLE public.invoices ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.invoices FORCE ROW LEVEL SECURITY;
+ALTER TABLE public.line_items ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.line_items FORCE ROW LEVEL SECURITY;
+ALTER TABLE public.payments ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.payments FORCE ROW LEVEL SECURITY;
+
+-- Permissive policies are combined with OR, so the allow-all policy from
+-- enable-rls.sql has to go for the tenant policy to have any effect
+DROP POLICY IF EXISTS "Allow all access to invoices" ON public.invoices;
+
+-- Policies: rows of the organization in app.tenant_id, every row for '*', and
+-- when unset every row except for ai_server_scoped members, who get none
+DROP POLICY IF EXISTS "Tenant isolation for invoices" ON public.invoices;
+CREATE POLICY "Tenant isolation for invoices" ON public.invoices
+FOR ALL USING (
+    CASE
+        WHEN NULLIF(current_setting('app.tenant_id', true), '') IS NULL
+            THEN NOT pg_has_role(current_user, 'ai_server_scoped', 'MEMBER')
+        ELSE current_setting('app.tenant_id', true) = '*'
+            OR "organizationId" = current_setting('app.tenant_id', true)
+    END
+);
+
+DROP POLICY IF EXISTS "Tenant isolation for line_items" ON public.line_items;
+CREATE POLICY "Tenant isolation for line_items" ON public.line_items
+FOR ALL USING (
+    CASE
+        WHEN NULLIF(current_setting('app.tenant_id', true), '') IS NULL
+            THEN NOT pg_has_role(current_user, 'ai_server_scoped', 'MEMBER')
+        ELSE current_setting('app.tenant_id', true) = '*'
+            OR "organizationId" = current_setting('app.tenant_id', true)
+    END
+);
+
+DROP POLICY IF EXISTS "Tenant isolation for payments" ON public.payments;
+CREATE POLICY "Tenant isolation for payments" ON public.payments
+FOR ALL USING (
+    CASE
+        WHEN NULLIF(current_setting('app.tenant_id', true), '') IS NULL
+            THEN NOT pg_has_role(current_user, 'ai_server_scoped', 'MEMBER')
+        ELSE current_setting('app.tenant_id', true) = '*'
+            OR "organizationId" = current_setting('app.tenant_id', true)
+    END
+);
+
+-- Note: superusers and roles with BYPASSRLS are never filtered by policies;
+-- the ai-server detects that and adds the organization filter to the SQL itself